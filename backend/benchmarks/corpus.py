@@ -0,0 +1,53 @@
+import os
+import random
+
+_WORDS = (
+    "retrieval embedding vector index query document chunk token latency throughput cache shard replica "
+    "cluster partition schema migration backup restore snapshot compaction eviction budget prompt context "
+    "model inference batch stream queue worker scheduler timeout retry backoff circuit breaker gateway "
+    "ingestion pipeline parser tokenizer encoder decoder attention layer weight gradient optimizer epoch "
+    "dataset sample metric histogram percentile baseline regression benchmark profile trace span header"
+).split()
+_TOPICS = ("networking", "storage", "search", "billing", "security", "deployment", "monitoring", "training")
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+
+def _identifier(rng: random.Random) -> str:
+    return f"{rng.choice(('ERR', 'SKU', 'CFG', 'REQ'))}-{rng.randint(100, 9999)}"
+
+
+def generate_corpus(target_dir: str, docs: int, paragraphs: int = 12, seed: int = 1234) -> dict:
+    """Write `docs` deterministic Markdown documents and return the questions to ask about them.
+
+    Every document has a title, sections of random technical prose and a few
+    identifiers (`ERR-1234`, `SKU-42`) so dense, lexical and conversational
+    retrieval all have something to match.
+    """
+    rng = random.Random(seed)
+    os.makedirs(target_dir, exist_ok=True)
+    questions = []
+    total_bytes = 0
+    for i in range(docs):
+        topic = rng.choice(_TOPICS)
+        identifier = _identifier(rng)
+        lines = [f"# {topic.title()} note {i}", ""]
+        for p in range(paragraphs):
+            if p % 4 == 0:
+                lines += [f"## Section {p // 4 + 1}", ""]
+            sentences = [_sentence(rng) for _ in range(rng.randint(3, 6))]
+            if p == 1:
+                sentences.append(f"The {topic} incident code is {identifier}.")
+            lines += [" ".join(sentences), ""]
+        text = "\n".join(lines)
+        path = os.path.join(target_dir, f"doc_{i:05d}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        total_bytes += len(text.encode("utf-8"))
+        questions.append(f"What does {identifier} mean for {topic}?")
+        questions.append(f"How does the {topic} {rng.choice(_WORDS)} {rng.choice(_WORDS)} work?")
+    rng.shuffle(questions)
+    return {"docs": docs, "bytes": total_bytes, "questions": questions}
@@ -0,0 +1,129 @@
+"""Embedding backend benchmark: throughput and retrieval recall.
+
+Run from `backend/`:
+
+    python -m benchmarks.embedding_backends --backends torch,onnx,onnx-int8 --texts 2000 --queries 100
+
+Each backend encodes the same synthetic passages and queries. Throughput is
+passages/sec for batched encodes and the p50 latency of single-query encodes.
+Recall@k is the overlap between a backend's exact top-k neighbours and those of
+the reference backend (the first one listed, normally the current `torch`).
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import numpy as np
+from benchmarks.corpus import generate_corpus
+from benchmarks.run import percentile
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def synthetic_texts(count: int, queries: int, seed: int):
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = generate_corpus(tmp, max(1, count // 10), paragraphs=12, seed=seed)
+        passages = []
+        for name in sorted(os.listdir(tmp)):
+            with open(os.path.join(tmp, name), "r", encoding="utf-8") as f:
+                passages.extend(p for p in f.read().split("\n\n") if len(p) > 40)
+    rng = random.Random(seed)
+    rng.shuffle(passages)
+    return passages[:count], corpus["questions"][:queries]
+
+
+def top_k(passages: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ passages.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def bench_backend(name: str, model_name: str, threads: int, passages: list, queries: list, batch_size: int) -> dict:
+    from utils.embedding_backends import load_backend
+    started = time.perf_counter()
+    backend = load_backend(name, model_name, threads)
+    load_seconds = time.perf_counter() - started
+    backend.encode(passages[:batch_size], batch_size=batch_size)
+
+    started = time.perf_counter()
+    passage_vectors = np.asarray(backend.encode(passages, batch_size=batch_size), dtype=np.float32)
+    encode_seconds = time.perf_counter() - started
+
+    latencies = []
+    query_vectors = []
+    for query in queries:
+        started = time.perf_counter()
+        query_vectors.append(backend.encode([query])[0])
+        latencies.append(time.perf_counter() - started)
+    return {
+        "fingerprint": backend.fingerprint(),
+        "load_seconds": round(load_seconds, 3),
+        "passages_per_second": round(len(passages) / encode_seconds, 1),
+        "query_p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "query_p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "_passages": passage_vectors,
+        "_queries": np.asarray(query_vectors, dtype=np.float32),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare embedding backends")
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8", help="comma-separated; the first is the reference")
+    parser.add_argument("--model", default=None, help="model name (default RAG_EMBEDDING_MODEL)")
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (default: library default)")
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="write the JSON report here (default stdout)")
+    args = parser.parse_args(argv)
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    from utils.embedding_backends import EMBEDDING_MODEL
+    model_name = args.model or EMBEDDING_MODEL
+    passages, queries = synthetic_texts(args.texts, args.queries, args.seed)
+
+    results = {}
+    for name in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        try:
+            results[name] = bench_backend(name, model_name, args.threads, passages, queries, args.batch_size)
+        except Exception as e:
+            results[name] = {"error": str(e)}
+
+    reference_name = next((name for name, r in results.items() if "error" not in r), None)
+    if reference_name is not None:
+        reference = results[reference_name]
+        expected = top_k(reference["_passages"], reference["_queries"], args.k)
+        for name, result in results.items():
+            if "error" in result:
+                continue
+            found = top_k(result["_passages"], result["_queries"], args.k)
+            hits = sum(len(set(e) & set(f)) for e, f in zip(expected.tolist(), found.tolist()))
+            result[f"recall_at_{args.k}"] = round(hits / (len(queries) * args.k), 4)
+            result["speedup"] = round(result["passages_per_second"] / reference["passages_per_second"], 2)
+    for result in results.values():
+        result.pop("_passages", None)
+        result.pop("_queries", None)
+
+    report = json.dumps({
+        "model": model_name,
+        "reference": reference_name,
+        "texts": len(passages),
+        "queries": len(queries),
+        "threads": args.threads,
+        "backends": results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_REPLY = (
+    "Based on the provided context the component retries failed requests with exponential backoff "
+    "and records every attempt in the trace so latency regressions can be located quickly."
+).split(" ")
+
+
+class FakeOllama:
+    """Local stand-in for the Ollama HTTP API.
+
+    Serves `/api/tags` and a streaming `/api/chat` that waits `prefill_seconds`
+    plus `prefill_per_kchar` per thousand prompt characters, then emits
+    `tokens` tokens at `tokens_per_second`, ending with the same timing fields
+    Ollama reports. Point the backend at it with `OLLAMA_HOST=<url>`.
+    """
+
+    def __init__(self, tokens_per_second: float = 50.0, tokens: int = 64, prefill_seconds: float = 0.05,
+                 prefill_per_kchar: float = 0.01, host: str = "127.0.0.1", port: int = 0):
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.prefill_seconds = prefill_seconds
+        self.prefill_per_kchar = prefill_per_kchar
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllama":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, payload, status=200):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._json({"models": [{"name": "fake:latest", "model": "fake:latest", "size": 0, "digest": ""}]})
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path != "/api/chat":
+                    self._json({"error": "not found"}, 404)
+                    return
+                with fake._lock:
+                    fake.requests += 1
+                prompt = "".join(m.get("content", "") for m in request.get("messages", []))
+                model = request.get("model", "fake")
+                started = time.perf_counter()
+                prefill = fake.prefill_seconds + fake.prefill_per_kchar * len(prompt) / 1000
+                time.sleep(prefill)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                interval = 1.0 / fake.tokens_per_second if fake.tokens_per_second > 0 else 0.0
+                generation_started = time.perf_counter()
+                try:
+                    for i in range(fake.tokens):
+                        token = _REPLY[i % len(_REPLY)] + " "
+                        line = {"model": model, "message": {"role": "assistant", "content": token}, "done": False}
+                        self.wfile.write(json.dumps(line).encode("utf-8") + b"\n")
+                        self.wfile.flush()
+                        if interval:
+                            time.sleep(interval)
+                    finished = time.perf_counter()
+                    final = {
+                        "model": model,
+                        "message": {"role": "assistant", "content": ""},
+                        "done": True,
+                        "done_reason": "stop",
+                        "total_duration": int((finished - started) * 1e9),
+                        "prompt_eval_count": max(1, len(prompt) // 4),
+                        "prompt_eval_duration": int(prefill * 1e9),
+                        "eval_count": fake.tokens,
+                        "eval_duration": int((finished - generation_started) * 1e9),
+                    }
+                    self.wfile.write(json.dumps(final).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
@@ -0,0 +1,355 @@
+"""Offline benchmark suite.
+
+Run from `backend/`:
+
+    python -m benchmarks.run --docs 200 --requests 200 --concurrency 8 --output results.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json        # compare, exit 1 on regression
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json   # record a new baseline
+
+Everything runs in a temporary working directory: a synthetic corpus is
+ingested with `run_pipeline`, then the FastAPI app is served by uvicorn on a
+local port with Ollama replaced by `FakeOllama`, and concurrent chat requests
+are replayed against it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from benchmarks.corpus import generate_corpus
+from benchmarks.fake_ollama import FakeOllama
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+COLLECTION_NAME = "bench"
+RETRIEVAL_STAGES = ("retrieve_dense", "retrieve_context", "retrieve_lexical")
+
+# Metrics compared against the baseline, with whether a larger value is better
+COMPARED_METRICS = {
+    "ingest.docs_per_second": True,
+    "ingest.chunks_per_second": True,
+    "chat.throughput_rps": True,
+    "chat.ttft_p50": False,
+    "chat.ttft_p99": False,
+    "chat.total_p50": False,
+    "chat.total_p99": False,
+    "chat.retrieval_p50": False,
+    "chat.retrieval_p99": False,
+    "peak_rss_mb": False,
+}
+
+
+def percentile(values, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _live_children_peak_kib() -> int:
+    """Sum of the peak RSS (`VmHWM`) of this process's live children, in KiB.
+
+    The conversion pool outlives each run, so its workers are never waited for
+    and `RUSAGE_CHILDREN` does not include them. Linux only; 0 elsewhere.
+    """
+    parent = str(os.getpid())
+    total = 0
+    try:
+        pids = [entry for entry in os.listdir("/proc") if entry.isdigit()]
+    except OSError:
+        return 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue
+        if fields.get("PPid", "").strip() == parent and "VmHWM" in fields:
+            total += int(fields["VmHWM"].split()[0])
+    return total
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process plus its children, in MiB: the
+    live ones (the conversion pool workers) by their `VmHWM`, and the largest
+    one that has already exited from `RUSAGE_CHILDREN`. Peaks are summed even
+    if they were not simultaneous, so this is an upper bound."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    exited = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round((own + exited) / scale + _live_children_peak_kib() / 1024, 1)
+
+
+def parse_server_timing(header: str) -> dict:
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                stages[name] = float(value) / 1000
+    return stages
+
+
+def bench_ingest(corpus_dir: str, workers) -> dict:
+    from utils.pipeline import run_pipeline
+    collection_dir = os.path.join("collections", COLLECTION_NAME)
+    started = time.perf_counter()
+    stats = run_pipeline(corpus_dir, collection_dir, COLLECTION_NAME, workers=workers)
+    elapsed = time.perf_counter() - started
+    return {
+        "docs": stats["files_processed"],
+        "failed": stats["files_failed"],
+        "chunks": stats["chunks_added"],
+        "seconds": round(elapsed, 3),
+        "docs_per_second": round(stats["files_processed"] / elapsed, 2) if elapsed else None,
+        "chunks_per_second": round(stats["chunks_added"] / elapsed, 2) if elapsed else None,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _Server:
+    """Serve `main.app` with uvicorn in a background thread, lifespan included."""
+
+    def __init__(self, app):
+        import uvicorn
+        self.port = _free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, name="bench-uvicorn", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 120
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("uvicorn did not start")
+            time.sleep(0.05)
+        return f"http://127.0.0.1:{self.port}"
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(60)
+
+
+async def _replay(base_url: str, questions: list, requests: int, concurrency: int, turns_per_conversation: int):
+    import httpx
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+    errors = []
+    conversations = [str(uuid.uuid4()) for _ in range(max(1, requests // max(1, turns_per_conversation)))]
+
+    async def one(client, i):
+        body = {
+            "modelName": "fake",
+            "prompt": questions[i % len(questions)],
+            "conversation_id": conversations[i % len(conversations)],
+            "collectionName": COLLECTION_NAME,
+        }
+        async with semaphore:
+            started = time.perf_counter()
+            ttft = None
+            completed = False
+            try:
+                async with client.stream("POST", "/conversation/get_response_stream", json=body) as response:
+                    stages = parse_server_timing(response.headers.get("server-timing"))
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data: "):
+                            continue
+                        event = json.loads(line[6:])
+                        if event.get("status") == "streaming" and ttft is None:
+                            ttft = time.perf_counter() - started
+                        elif event.get("status") == "complete":
+                            completed = True
+                        elif event.get("status") == "error":
+                            raise RuntimeError(event.get("error"))
+            except Exception as e:
+                errors.append(str(e))
+                return
+            if not completed:
+                errors.append("stream ended without a complete event")
+                return
+            samples.append({"ttft": ttft, "total": time.perf_counter() - started, "stages": stages})
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+    return samples, errors, elapsed
+
+
+def bench_chat(questions: list, requests: int, concurrency: int, turns_per_conversation: int) -> dict:
+    import main
+    from utils import rag_utils
+    rag_utils.BASE_DIR = os.path.abspath("collections")
+    with _Server(main.app) as base_url:
+        # One warm-up request loads the embedding model and opens Chroma
+        asyncio.run(_replay(base_url, questions, 1, 1, 1))
+        samples, errors, elapsed = asyncio.run(
+            _replay(base_url, questions, requests, concurrency, turns_per_conversation)
+        )
+
+    def summary(values):
+        return percentile(values, 0.5), percentile(values, 0.99)
+
+    ttfts = [s["ttft"] for s in samples if s["ttft"] is not None]
+    totals = [s["total"] for s in samples]
+    retrievals = [
+        s["stages"].get("embed_query", 0.0) + max(s["stages"].get(stage, 0.0) for stage in RETRIEVAL_STAGES)
+        for s in samples
+    ]
+    stage_names = sorted({name for s in samples for name in s["stages"]})
+    stages = {}
+    for name in stage_names:
+        p50, p99 = summary([s["stages"][name] for s in samples if name in s["stages"]])
+        stages[name] = {"p50": _round(p50), "p99": _round(p99)}
+    ttft_p50, ttft_p99 = summary(ttfts)
+    total_p50, total_p99 = summary(totals)
+    retrieval_p50, retrieval_p99 = summary(retrievals)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "completed": len(samples),
+        "errors": len(errors),
+        "first_errors": errors[:5],
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "ttft_p50": _round(ttft_p50),
+        "ttft_p99": _round(ttft_p99),
+        "total_p50": _round(total_p50),
+        "total_p99": _round(total_p99),
+        "retrieval_p50": _round(retrieval_p50),
+        "retrieval_p99": _round(retrieval_p99),
+        "stages": stages,
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 5)
+
+
+def _lookup(results: dict, dotted: str):
+    value = results
+    for part in dotted.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> dict:
+    """Relative change of every compared metric; a change worse than
+    `tolerance` in the metric's bad direction is a regression."""
+    rows = {}
+    regressions = []
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        current = _lookup(results, metric)
+        previous = _lookup(baseline, metric)
+        if current is None or previous is None or previous == 0:
+            continue
+        change = (current - previous) / abs(previous)
+        worse = -change if higher_is_better else change
+        regressed = worse > tolerance
+        rows[metric] = {"baseline": previous, "current": current, "change": round(change, 4), "regressed": regressed}
+        if regressed:
+            regressions.append(metric)
+    return {"tolerance": tolerance, "metrics": rows, "regressions": regressions}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline ingestion and chat benchmarks")
+    parser.add_argument("--docs", type=int, default=100, help="synthetic documents to ingest")
+    parser.add_argument("--paragraphs", type=int, default=12, help="paragraphs per document")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--workers", type=int, default=None, help="conversion processes (default RAG_INGEST_WORKERS)")
+    parser.add_argument("--requests", type=int, default=100, help="chat requests to replay")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=4, help="requests per conversation")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="fake Ollama generation rate")
+    parser.add_argument("--tokens", type=int, default=64, help="tokens per fake answer")
+    parser.add_argument("--prefill", type=float, default=0.05, help="fake Ollama fixed prefill seconds")
+    parser.add_argument("--skip-chat", action="store_true", help="only benchmark ingestion")
+    parser.add_argument("--output", help="write the JSON report here (default stdout)")
+    parser.add_argument("--baseline", help="baseline report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    parser.add_argument("--save-baseline", help="also write the report here as the new baseline")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+    save_baseline = os.path.abspath(args.save_baseline) if args.save_baseline else None
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    previous_cwd = os.getcwd()
+    fake = FakeOllama(args.tokens_per_second, args.tokens, args.prefill).start()
+    os.environ["OLLAMA_HOST"] = fake.url
+    try:
+        os.chdir(workdir)
+        corpus = generate_corpus(os.path.join(workdir, "corpus"), args.docs, args.paragraphs, args.seed)
+        results = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "save_baseline")},
+            },
+            "corpus": {"docs": corpus["docs"], "bytes": corpus["bytes"]},
+        }
+        results["ingest"] = bench_ingest(os.path.join(workdir, "corpus"), args.workers)
+        results["ingest"]["peak_rss_mb"] = peak_rss_mb()
+        if not args.skip_chat:
+            results["chat"] = bench_chat(corpus["questions"], args.requests, args.concurrency, args.turns)
+            results["chat"]["ollama_requests"] = fake.requests
+        results["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        fake.stop()
+        os.chdir(previous_cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    exit_code = 0
+    if baseline is not None:
+        results["comparison"] = compare(results, baseline, args.tolerance)
+        for metric, row in results["comparison"]["metrics"].items():
+            flag = "REGRESSED" if row["regressed"] else "ok"
+            print(f"{metric:28} {row['baseline']:>12} -> {row['current']:>12} ({row['change']:+.1%}) {flag}", file=sys.stderr)
+        if results["comparison"]["regressions"]:
+            exit_code = 1
+
+    report = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    if save_baseline:
+        with open(save_baseline, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
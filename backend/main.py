@@ -1,9 +1,42 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from routers import conversation, api
+from utils.jobs import get_job_manager
+from utils.write_behind import shutdown_write_behind_queue
+from utils.memory_store import start_vacuum_thread, stop_vacuum_thread
+from utils.catalog import get_catalog
+from utils.metrics import MetricsMiddleware, merge_metrics, render_metrics, render_server_metrics
+from utils.warmup import start_warmup
+from utils.retrieval_ipc import is_remote
+import argparse
+import asyncio
+import os
+import secrets
+import time
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # In multi-worker mode the retrieval server owns warm-up, ingestion jobs
+    # and memory vacuuming; a worker only flushes its own write-behind queue
+    remote = is_remote()
+    if not remote:
+        start_warmup()
+        resumed = await asyncio.to_thread(get_job_manager().resume)
+        if resumed:
+            print(f"Resumed {resumed} ingestion job(s)")
+        start_vacuum_thread(lambda conversation_id: get_catalog().get(conversation_id) is not None)
+    yield
+    if not remote:
+        stop_vacuum_thread()
+        get_job_manager().shutdown()
+    await asyncio.to_thread(shutdown_write_behind_queue)
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(conversation.router)
 app.include_router(api.router)
 
@@ -11,9 +44,56 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["X-Answer-Cache", "X-Context-Tokens", "X-Context-Tokens-Saved", "X-Retrieval-Timeouts", "Retry-After", "Server-Timing", "X-Snapshot-Chunks", "Content-Disposition", "X-Stream-Id"]
 )
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    text = render_metrics()
+    if is_remote():
+        # Retrieval, ingestion and Chroma metrics are recorded in the retrieval server
+        text = merge_metrics(text, await asyncio.to_thread(render_server_metrics))
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def serve_workers(workers: int, host: str, port: int):
+    """Run `workers` API processes in front of one retrieval server process."""
+    import multiprocessing
+    from utils.retrieval_server import serve, DEFAULT_SOCKET
+
+    socket_path = os.path.abspath(os.environ.get("RAG_RETRIEVAL_SOCKET", DEFAULT_SOCKET))
+    os.environ["RAG_RETRIEVAL_SOCKET"] = socket_path
+    os.environ.setdefault("RAG_RETRIEVAL_AUTHKEY", secrets.token_hex(16))
+    # Each worker runs its own generation scheduler; split the limits between them
+    os.environ["RAG_GEN_WORKERS"] = str(workers)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = multiprocessing.get_context("spawn").Process(target=serve, args=(socket_path,), name="retrieval-server")
+    server.start()
+    deadline = time.monotonic() + 60
+    while not os.path.exists(socket_path):
+        if not server.is_alive() or time.monotonic() > deadline:
+            server.terminate()
+            raise SystemExit("Retrieval server failed to start")
+        time.sleep(0.05)
+    try:
+        uvicorn.run("main:app", host=host, port=port, workers=workers)
+    finally:
+        server.terminate()
+        server.join(30)
+
 
 if __name__ == "__main__":
-    print("Server Running at port 3000")
-    uvicorn.run("main:app", host="127.0.0.1", port=3000, reload=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="RAG backend")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("RAG_WORKERS", 1)),
+                        help="API worker processes; more than one starts a shared retrieval server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    args = parser.parse_args()
+    print(f"Server Running at port {args.port}")
+    if args.workers > 1:
+        serve_workers(args.workers, args.host, args.port)
+    else:
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
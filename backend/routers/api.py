@@ -2,11 +2,20 @@ import os
 import shutil
 import json
 import asyncio
+import uuid
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from typing import Optional
 from utils.ollama_utils import models_available
-from utils.pipeline import run_pipeline
-import httpx
+from utils.jobs import get_job_manager
+from utils.warmup import get_warmup
+from utils.cache import resource_stats
+from utils.scheduler import get_generation_scheduler
+from utils.embedding_backends import check_compatible, EmbeddingMismatchError
+from utils.snapshot import (
+    SNAPSHOT_DTYPES, SnapshotError, check_snapshot, export_snapshot, import_snapshot, iter_tar, extract_tar
+)
 
 router = APIRouter(
     prefix="/api",
@@ -14,6 +23,26 @@ router = APIRouter(
 )
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../collections"))
+SNAPSHOT_STAGING_DIR = "./db/snapshots"
+
+
+@router.get("/ready")
+async def ready():
+    """Readiness probe: 503 until the background warm-up has finished."""
+    state = await asyncio.to_thread(get_warmup().to_dict)
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+
+@router.get("/generation_queue")
+async def generation_queue():
+    """Running and queued generations per model."""
+    return get_generation_scheduler().stats()
+
+
+@router.get("/resources")
+async def resources():
+    """Open Chroma clients and collection handles, with hit/miss counts."""
+    return await asyncio.to_thread(resource_stats)
 
 
 @router.get("/get_ollama_models")
@@ -26,89 +55,190 @@ async def get_collections():
     return await asyncio.to_thread(os.listdir, BASE_DIR)
 
 
-@router.post("/create_collection/{collection_name}")
-async def create_collection(
-    collection_name: str,
-    files: list[UploadFile] = File(default=[]),
-    urls: Optional[str] = Form(None)
-):
-    url_list = []
-    if urls:
-        try:
-            url_list = json.loads(urls)
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=400, detail="Invalid URLs format")
-    if not files and not url_list:
-        raise HTTPException(status_code=400, detail="No files or URLs provided")
+def _parse_urls(urls: Optional[str]) -> list:
+    if not urls:
+        return []
+    try:
+        return json.loads(urls)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid URLs format")
+
 
-    target_dir = os.path.abspath(os.path.join(BASE_DIR, collection_name, "files"))
-    if not target_dir.startswith(BASE_DIR):
+def _collection_dir(collection_name: str) -> str:
+    collection_dir = os.path.abspath(os.path.join(BASE_DIR, collection_name))
+    if not collection_dir.startswith(BASE_DIR + os.sep):
         raise HTTPException(status_code=403, detail="Invalid collection path")
+    return collection_dir
 
-    await asyncio.to_thread(os.makedirs, target_dir, True)
 
-    saved_files = []
-    processed_urls = []
+async def _ingest(collection_name: str, files: list[UploadFile], url_list: list):
+    """Stage the uploads and queue a background ingestion job for them.
+
+    Only the upload itself happens inside the request; URL downloads,
+    conversion and embedding run in the job so the request returns at once.
+    """
+    if not files and not url_list:
+        raise HTTPException(status_code=400, detail="No files or URLs provided")
+
+    collection_dir = _collection_dir(collection_name)
+    try:
+        check_compatible(collection_dir)
+    except EmbeddingMismatchError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # Each job stages into its own directory so concurrent uploads into the
+    # same collection never see (or delete) each other's files
+    target_dir = os.path.join(collection_dir, "files", uuid.uuid4().hex)
+
+    await asyncio.to_thread(os.makedirs, target_dir, 0o777, True)
 
     try:
         async def save_file(file: UploadFile):
-            file_path = os.path.join(target_dir, file.filename)
+            file_path = os.path.join(target_dir, os.path.basename(file.filename))
             try:
                 def _write_file():
                     with open(file_path, "wb") as buffer:
                         shutil.copyfileobj(file.file, buffer)
                 await asyncio.to_thread(_write_file)
-                return file.filename
+                return os.path.basename(file.filename)
             finally:
                 await file.close()
 
-        saved_files_from_uploads = await asyncio.gather(*[save_file(file) for file in files])
-        saved_files.extend(saved_files_from_uploads)
-
-        async def fetch_url(idx: int, url: str):
-            try:
-                async with httpx.AsyncClient(timeout=30) as client:
-                    response = await client.get(url)
-                url_filename = f"url_{idx}_{url.split('/')[-1] or 'page'}.html"
-                if not url_filename.endswith(".html"):
-                    url_filename += ".html"
-                url_file_path = os.path.join(target_dir, url_filename)
-                await asyncio.to_thread(
-                    open(url_file_path, "w", encoding="utf-8").write, response.text
-                )
-                return url_filename, url
-            except Exception as e:
-                print(f"Failed to fetch {url}: {str(e)}")
-                return None, None
-
-        url_tasks = [fetch_url(i, u) for i, u in enumerate(url_list)]
-        results = await asyncio.gather(*url_tasks)
-
-        for filename, url in results:
-            if filename and url:
-                saved_files.append(filename)
-                processed_urls.append(url)
-
-        await asyncio.to_thread(
-            run_pipeline,
-            target_dir,
-            os.path.join(BASE_DIR, collection_name),
-            collection_name,
-        )
-
-        await asyncio.to_thread(shutil.rmtree, target_dir)
-
+        saved_files = await asyncio.gather(*[save_file(file) for file in files])
     except Exception as e:
-        if await asyncio.to_thread(os.path.exists, target_dir):
-            await asyncio.to_thread(shutil.rmtree, target_dir)
+        await asyncio.to_thread(shutil.rmtree, target_dir, True)
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred while processing: {str(e)}"
         )
 
-    return {
-        "status": "success",
-        "collection": collection_name,
-        "files": [f for f in saved_files if not f.startswith("url_")],
-        "urls": processed_urls,
-    }
\ No newline at end of file
+    job = await asyncio.to_thread(
+        get_job_manager().submit,
+        collection_name,
+        collection_dir,
+        target_dir,
+        list(saved_files),
+        url_list,
+    )
+    return JSONResponse(
+        status_code=202,
+        content={
+            "status": "queued",
+            "job_id": job["job_id"],
+            "collection": collection_name,
+            "files": list(saved_files),
+            "urls": url_list,
+        }
+    )
+
+
+@router.post("/create_collection/{collection_name}")
+async def create_collection(
+    collection_name: str,
+    files: list[UploadFile] = File(default=[]),
+    urls: Optional[str] = Form(None)
+):
+    return await _ingest(collection_name, files, _parse_urls(urls))
+
+
+@router.post("/add_to_collection/{collection_name}")
+async def add_to_collection(
+    collection_name: str,
+    files: list[UploadFile] = File(default=[]),
+    urls: Optional[str] = Form(None)
+):
+    """Append files/URLs to an existing collection. Unchanged files are skipped
+    and changed ones only re-embed the chunks that differ."""
+    collection_dir = _collection_dir(collection_name)
+    if not await asyncio.to_thread(os.path.isdir, os.path.join(collection_dir, "chromadb")):
+        raise HTTPException(status_code=404, detail="Collection not found")
+    return await _ingest(collection_name, files, _parse_urls(urls))
+
+
+@router.get("/jobs")
+async def list_jobs(collection: Optional[str] = None):
+    return await asyncio.to_thread(get_job_manager().list, collection)
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(get_job_manager().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    cancelled = await asyncio.to_thread(get_job_manager().cancel, job_id)
+    if not cancelled:
+        raise HTTPException(status_code=409, detail="Job is not queued or running")
+    return {"status": "success", "job_id": job_id}
+
+
+@router.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str):
+    retried = await asyncio.to_thread(get_job_manager().retry, job_id)
+    if not retried:
+        raise HTTPException(status_code=409, detail="Job is not failed or its files are gone")
+    return {"status": "success", "job_id": job_id}
+
+
+@router.get("/export_collection/{collection_name}")
+async def export_collection(collection_name: str, dtype: str = "float32"):
+    """Download the collection as a snapshot archive (an uncompressed tar of
+    the embedding matrix, the chunks as JSONL and the model fingerprint)."""
+    if dtype not in SNAPSHOT_DTYPES:
+        raise HTTPException(status_code=400, detail=f"dtype must be one of {', '.join(SNAPSHOT_DTYPES)}")
+    collection_dir = _collection_dir(collection_name)
+    if not await asyncio.to_thread(os.path.isdir, os.path.join(collection_dir, "chromadb")):
+        raise HTTPException(status_code=404, detail="Collection not found")
+    snapshot_dir = os.path.abspath(os.path.join(SNAPSHOT_STAGING_DIR, uuid.uuid4().hex))
+    try:
+        header = await asyncio.to_thread(export_snapshot, collection_name, collection_dir, snapshot_dir, dtype)
+    except Exception as e:
+        await asyncio.to_thread(shutil.rmtree, snapshot_dir, True)
+        raise HTTPException(status_code=500, detail=f"Export failed: {str(e)}")
+    return StreamingResponse(
+        iter_tar(snapshot_dir),
+        media_type="application/x-tar",
+        headers={
+            "Content-Disposition": f'attachment; filename="{collection_name}.snapshot.tar"',
+            "X-Snapshot-Chunks": str(header["count"]),
+        },
+        background=BackgroundTask(shutil.rmtree, snapshot_dir, True),
+    )
+
+
+@router.post("/import_collection/{collection_name}")
+async def import_collection(collection_name: str, file: UploadFile = File(...)):
+    """Create a collection from a snapshot archive made by `export_collection`,
+    without converting or embedding anything."""
+    collection_dir = _collection_dir(collection_name)
+    if await asyncio.to_thread(os.path.isdir, os.path.join(collection_dir, "chromadb")):
+        raise HTTPException(status_code=409, detail="Collection already exists")
+    staging_dir = os.path.abspath(os.path.join(SNAPSHOT_STAGING_DIR, uuid.uuid4().hex))
+    archive_path = os.path.join(staging_dir, "snapshot.tar")
+    snapshot_dir = os.path.join(staging_dir, "snapshot")
+    try:
+        def _stage():
+            os.makedirs(staging_dir, exist_ok=True)
+            with open(archive_path, "wb") as buffer:
+                shutil.copyfileobj(file.file, buffer, 1 << 20)
+            extract_tar(archive_path, snapshot_dir)
+            os.unlink(archive_path)
+            return check_snapshot(snapshot_dir)
+        try:
+            await asyncio.to_thread(_stage)
+        except SnapshotError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except EmbeddingMismatchError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        finally:
+            await file.close()
+        try:
+            header = await asyncio.to_thread(import_snapshot, collection_name, collection_dir, snapshot_dir)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
+    finally:
+        await asyncio.to_thread(shutil.rmtree, staging_dir, True)
+    return JSONResponse(status_code=201, content={"status": "success", **header})
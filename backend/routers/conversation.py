@@ -1,12 +1,23 @@
 import os
-import uuid
 import asyncio
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Request, status, UploadFile, File, Form
+from typing import Dict, List, Optional
 from pydantic import BaseModel
-from utils.ollama_utils import ollama_response_stream
-from utils.tinydb_utils import TinyDB_Utils, TinyDB_Utils_Global, Tiny_DB_Global_Prompt
-from utils.rag_utils import query_chroma_ranked, query_context_ranked, reciprocal_rank_fusion
-from utils.cache import get_embedding_model, get_chroma_client, get_chroma_collection
+from utils.tinydb_utils import Tiny_DB_Global_Prompt
+from utils.catalog import get_catalog, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.message_store import get_message_store
+from utils.settings_store import get_settings
+from utils.answer_cache import get_answer_cache, AnswerCache, ANSWER_CACHE_ENABLED
+from utils.rag_utils import query_collections_ranked, query_context_ranked, reciprocal_rank_fusion, rank_only
+from utils.embedding_service import aembed_query
+from utils.write_behind import get_write_behind_queue
+from utils.memory_store import get_conversation_memory
+from utils.context_packer import pack_context, CONTEXT_CANDIDATES
+from utils.metrics import span
+from utils.scheduler import get_generation_scheduler, GenerationRejected, PRIORITIES
+from utils.embedding_backends import check_compatible, EmbeddingMismatchError
+from utils.batch_qa import read_questions, run_batch, BATCH_CONCURRENCY
+from utils.sse_streams import get_stream_registry
 import json
 from fastapi.responses import StreamingResponse
 
@@ -23,23 +34,44 @@ Context:
 Question: {question}
 """
 
-prompt_template_store = {"template": DEFAULT_TEMPLATE}
+PROMPT_TEMPLATE_SETTING = "prompt_template"
+
+
+def active_template() -> str:
+    """The prompt template in use; kept in the shared settings store so every
+    worker process uses the same one."""
+    return get_settings().get(PROMPT_TEMPLATE_SETTING, DEFAULT_TEMPLATE)
 
 class PromptTemplate(BaseModel):
     template_name: str
     template: str
 
+class RetrievalWeights(BaseModel):
+    dense: float = 1.0
+    context: float = 1.0
+    lexical: float = 1.0
+
 class UserPrompt(BaseModel):
     modelName: str
     prompt: str
     conversation_id: str
     collectionName: str
+    collectionNames: Optional[List[str]] = None
+    collectionWeights: Optional[Dict[str, float]] = None
+    retrievalWeights: Optional[RetrievalWeights] = None
+    useAnswerCache: Optional[bool] = None
+    priority: Optional[str] = None
+
+    def collections(self) -> List[str]:
+        """Collections to search: `collectionNames` if given, else `collectionName`."""
+        names = self.collectionNames or ([self.collectionName] if self.collectionName else [])
+        return list(dict.fromkeys(name for name in names if name))
 
 class GetConversation(BaseModel):
     conversation_id: str
 
 def generate_rag_prompt(context: str, question: str) -> str:
-    template = prompt_template_store.get("template", DEFAULT_TEMPLATE)
+    template = active_template()
     if not context:
         context = ""
     try:
@@ -47,116 +79,266 @@ def generate_rag_prompt(context: str, question: str) -> str:
     except KeyError:
         return DEFAULT_TEMPLATE.format(context=context.strip(), question=question.strip())
 
-def save_previous_context(context: str, collection_name: str, conversation_id: str):
-    embedding_model = get_embedding_model()
-    client = get_chroma_client(os.path.join("./collections/", collection_name, "context"))
-    collection = get_chroma_collection(client, conversation_id)
-    collection.add(
-        ids=str(uuid.uuid4()),
-        embeddings=embedding_model.encode(context, normalize_embeddings=True),
-        documents=context
-    )
+def persist_turn(question, full_response, conversation_id, collectionName):
+    """Queue the model message and the turn's memory entry; the write-behind
+    queue batches them, so the caller never waits on SQLite or Chroma. Only the
+    question and answer are remembered, not the retrieved context around them."""
+    queue = get_write_behind_queue()
+    queue.append_message(conversation_id, collectionName, "model", full_response)
+    queue.add_memory(collectionName, conversation_id, question.strip() + "\n" + full_response.strip())
+
+async def generate_stream_response(stream, modelName, user_prompt, question, conversation_id, collectionName, cache_key=None,
+                                   query_embedding=None, priority="normal", client=""):
+    """Produce the answer into a resumable stream. Runs as its own task, so a
+    client that drops and resumes does not restart the generation."""
+    parts = []
+    try:
+        # Wait for a generation slot, then stream; if no client is following
+        # the stream any more this task is cancelled, and the scheduler aborts
+        # the upstream Ollama request once no other request shares it
+        generation = get_generation_scheduler().stream(modelName, user_prompt, priority, client)
+        try:
+            async for kind, value in generation:
+                if kind == "queued":
+                    stream.send({'status': 'queued', 'position': value})
+                    continue
+                parts.append(value)
+                stream.write(value)
+        finally:
+            await generation.aclose()
+        full_response = "".join(parts)
+
+        # Queue the turn for persistence; it is written in the background
+        persist_turn(question, full_response, conversation_id, collectionName)
+        if cache_key is not None and full_response and not full_response.startswith("Error: "):
+            get_answer_cache().store(cache_key, query_embedding, full_response)
+
+        # Send completion signal; the client already has the text
+        stream.send({'status': 'complete'})
+
+    except GenerationRejected as e:
+        stream.send({'status': 'error', 'error': str(e), 'code': 429, 'retry_after': e.retry_after})
+    except Exception as e:
+        stream.send({'status': 'error', 'error': str(e)})
 
-async def generate_stream_response(modelName, user_prompt, conversation_id, collectionName, db):
-    """Async generator for FastAPI streaming"""
-    full_response = ""
-    
+async def replay_cached_response(stream, answer, question, conversation_id, collectionName):
+    """Stream a cached answer in the same SSE format as a live generation."""
     try:
-        # Generate the stream
-        for chunk in ollama_response_stream(modelName, user_prompt):
-            full_response += chunk
-            # Send each chunk as JSON
-            yield f"data: {json.dumps({'chunk': chunk, 'status': 'streaming'})}\n\n"
-        
-        # Save the complete response to database
-        await asyncio.to_thread(db.save_conversation, model=full_response)
-        await asyncio.to_thread(
-            save_previous_context,
-            user_prompt.strip() + "\n" + full_response.strip(),
-            collectionName,
-            conversation_id
-        )
-        
-        # Send completion signal
-        yield f"data: {json.dumps({'status': 'complete', 'full_response': full_response})}\n\n"
-        
+        stream.write(answer)
+        persist_turn(question, answer, conversation_id, collectionName)
+        stream.send({'status': 'complete', 'cached': True})
     except Exception as e:
-        yield f"data: {json.dumps({'status': 'error', 'error': str(e)})}\n\n"
+        stream.send({'status': 'error', 'error': str(e)})
+
+def sse_response(stream, last_event_id=None, headers=None):
+    return StreamingResponse(
+        get_stream_registry().follow(stream, last_event_id),
+        media_type="text/plain",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Content-Type": "text/event-stream",
+            "X-Stream-Id": stream.stream_id,
+            **(headers or {}),
+        }
+    )
 
 @router.post("/get_response_stream")
-async def get_response_stream(prompt: UserPrompt):
+async def get_response_stream(prompt: UserPrompt, request: Request):
     """Streaming endpoint using Server-Sent Events"""
-    global_db = TinyDB_Utils_Global()
-    history = await asyncio.to_thread(global_db.get_uid_history, prompt.conversation_id)
-
-    if not history:
-        summary = prompt.prompt[:50] + "..." if len(prompt.prompt) > 50 else prompt.prompt
+    if prompt.priority is not None and prompt.priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"priority must be one of {', '.join(PRIORITIES)}"
+        )
+    try:
+        get_generation_scheduler().admit(prompt.modelName)
+    except GenerationRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    collections = prompt.collections()
+    # The conversation and its memory belong to the primary collection
+    if not prompt.collectionName and collections:
+        prompt.collectionName = collections[0]
+    for collection_name in collections:
+        try:
+            check_compatible(os.path.join("./collections", collection_name))
+        except EmbeddingMismatchError as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"{collection_name}: {e}")
+
+    summary = prompt.prompt[:50] + "..." if len(prompt.prompt) > 50 else prompt.prompt
+    with span("catalog"):
         await asyncio.to_thread(
-            global_db.save_history,
+            get_catalog().create_if_absent,
             summary,
             prompt.conversation_id,
             prompt.modelName,
             prompt.collectionName
         )
 
-    db_path = os.path.join("./collections", prompt.collectionName, "db", f"{prompt.conversation_id}.json")
-    db = TinyDB_Utils(db_path)
-    await asyncio.to_thread(db.save_conversation, user=prompt.prompt)
+    get_write_behind_queue().append_message(prompt.conversation_id, prompt.collectionName, "user", prompt.prompt)
 
-    fused_context = ""
-    if prompt.collectionName:
-        chroma_task = asyncio.to_thread(
-            query_chroma_ranked,
-            prompt.collectionName,
-            prompt.prompt,
-            5
-        )
+    top_docs = []
+    query_embedding = None
+    timed_out = []
+    if collections:
+        with span("embed_query"):
+            query_embedding = await aembed_query(prompt.prompt)
+        collections_task = query_collections_ranked(collections, prompt.prompt, query_embedding, 5)
         context_task = asyncio.to_thread(
             query_context_ranked,
             prompt.collectionName,
             prompt.conversation_id,
             prompt.prompt,
-            5
+            5,
+            query_embedding
         )
 
-        chroma_ranked, context_ranked = await asyncio.gather(chroma_task, context_task)
-        top_docs = reciprocal_rank_fusion([chroma_ranked, context_ranked], k=60, top_k=5)
-        fused_context = "\n".join(top_docs)
+        collection_results, context_ranked = await asyncio.gather(collections_task, context_task)
+        weights = prompt.retrievalWeights or RetrievalWeights()
+        collection_weights = prompt.collectionWeights or {}
+        ranked_lists = [context_ranked]
+        list_weights = [weights.context]
+        for collection_name, result in collection_results.items():
+            if result is None:
+                timed_out.append(collection_name)
+                continue
+            dense_ranked, lexical_ranked = result
+            collection_weight = collection_weights.get(collection_name, 1.0)
+            ranked_lists.extend([dense_ranked, rank_only(lexical_ranked)])
+            list_weights.extend([collection_weight * weights.dense, collection_weight * weights.lexical])
+        with span("fuse"):
+            top_docs = reciprocal_rank_fusion(
+                ranked_lists,
+                k=60,
+                top_k=CONTEXT_CANDIDATES,
+                weights=list_weights
+            )
 
-    augmented_prompt = generate_rag_prompt(fused_context, prompt.prompt)
+    with span("pack_context"):
+        packed = await asyncio.to_thread(pack_context, top_docs, prompt.modelName)
+    augmented_prompt = generate_rag_prompt(packed.text, prompt.prompt)
+    retrieval_headers = {"X-Retrieval-Timeouts": ",".join(timed_out)} if timed_out else {}
 
-    return StreamingResponse(
-        generate_stream_response(prompt.modelName, augmented_prompt, prompt.conversation_id, prompt.collectionName, db),
-        media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Content-Type": "text/event-stream",
-        }
-    )
+    use_cache = ANSWER_CACHE_ENABLED if prompt.useAnswerCache is None else prompt.useAnswerCache
+    cache_key = None
+    if use_cache and query_embedding is not None:
+        cache_key = AnswerCache.make_key(
+            [os.path.join("./collections", collection_name) for collection_name in collections],
+            prompt.modelName,
+            active_template(),
+            packed.docs
+        )
+        with span("answer_cache"):
+            cached_answer = get_answer_cache().lookup(cache_key, query_embedding)
+        if cached_answer is not None:
+            stream = get_stream_registry().start(lambda stream: replay_cached_response(
+                stream, cached_answer, prompt.prompt, prompt.conversation_id, prompt.collectionName
+            ))
+            return sse_response(stream, headers={"X-Answer-Cache": "hit", **packed.headers(), **retrieval_headers})
+
+    stream = get_stream_registry().start(lambda stream: generate_stream_response(
+        stream,
+        prompt.modelName,
+        augmented_prompt,
+        prompt.prompt,
+        prompt.conversation_id,
+        prompt.collectionName,
+        cache_key,
+        query_embedding,
+        prompt.priority or "normal",
+        request.client.host if request.client else ""
+    ))
+    return sse_response(stream, headers={**packed.headers(), **retrieval_headers})
+
+@router.get("/resume_stream/{stream_id}")
+async def resume_stream(stream_id: str, request: Request, last_event_id: Optional[int] = None):
+    """Reattach to a response stream after a dropped connection. Frames after
+    the `Last-Event-ID` header (or `last_event_id` query parameter) are
+    replayed from the stream's buffer, then it continues live."""
+    header = request.headers.get("last-event-id")
+    if header is not None:
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Last-Event-ID must be an integer")
+    stream = get_stream_registry().get(stream_id)
+    if stream is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not found or expired")
+    if not stream.can_resume(last_event_id):
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Frames after Last-Event-ID are no longer buffered")
+    return sse_response(stream, last_event_id)
+
+@router.post("/batch_responses")
+async def batch_responses(
+    request: Request,
+    file: UploadFile = File(...),
+    collectionName: str = Form(...),
+    modelName: str = Form(...),
+    concurrency: int = Form(BATCH_CONCURRENCY),
+    denseWeight: float = Form(1.0),
+    lexicalWeight: float = Form(1.0),
+):
+    """Answer a JSONL file of questions against one collection for offline
+    evaluation. Results stream back as JSONL, one line per question as it
+    finishes, with the retrieved chunk ids and timings. Nothing is added to
+    conversation history or memory."""
+    collection_dir = os.path.join("./collections", collectionName)
+    if not await asyncio.to_thread(os.path.isdir, os.path.join(collection_dir, "chromadb")):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Collection not found")
+    try:
+        check_compatible(collection_dir)
+    except EmbeddingMismatchError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    try:
+        questions = read_questions((await file.read()).splitlines())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid questions file: {e}")
+    finally:
+        await file.close()
+
+    async def results():
+        async for result in run_batch(
+            questions,
+            collectionName,
+            modelName,
+            generate_rag_prompt,
+            concurrency,
+            dense_weight=denseWeight,
+            lexical_weight=lexicalWeight,
+            client=f"batch:{request.client.host if request.client else ''}",
+        ):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
 
 @router.get("/get_conversation/{uid}")
-async def get_conversation(uid: str):
-    global_db = TinyDB_Utils_Global()
-    conversation_history_meta = await asyncio.to_thread(global_db.get_uid_history, uid)
-    if not conversation_history_meta:
+async def get_conversation(
+    uid: str,
+    before: Optional[int] = Query(None, description="Return messages older than this message id"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size; omit for the full conversation"),
+):
+    conversation_info = await asyncio.to_thread(get_catalog().get, uid)
+    if not conversation_info:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversation not found")
 
-    conversation_info = conversation_history_meta[0]
-    db_path = os.path.join("./collections", conversation_info["collectionName"], "db", f"{conversation_info['conversation_id']}.json")
-
-    exists = await asyncio.to_thread(os.path.exists, db_path)
-    if not exists:
-        return {"status": "success", "collection_conversation": []}
-
     try:
-        db = TinyDB_Utils(db_path)
-        collection_conversation = await asyncio.to_thread(db.get_collection_conversation_history)
+        # Make turns still sitting in the write-behind queue visible
+        await asyncio.to_thread(get_write_behind_queue().flush)
+        store = get_message_store()
+        collection_conversation = await asyncio.to_thread(store.get_messages, uid, before, limit)
+        has_more = False
+        if limit is not None and collection_conversation:
+            has_more = await asyncio.to_thread(store.has_older, uid, collection_conversation[0]["id"])
         return {
             "status": "success",
             "collection_conversation": collection_conversation,
             "collectionName": conversation_info["collectionName"],
-            "modelName": conversation_info["modelName"]
+            "modelName": conversation_info["modelName"],
+            "next_before": collection_conversation[0]["id"] if has_more else None
         }
     except Exception as e:
         raise HTTPException(
@@ -166,9 +348,21 @@ async def get_conversation(uid: str):
 
 
 @router.get("/get_history")
-async def get_history():
-    global_db = TinyDB_Utils_Global()
-    return await asyncio.to_thread(global_db.get_history)
+async def get_history(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    q: Optional[str] = Query(None, description="Case-insensitive prefix of the conversation summary"),
+    collection: Optional[str] = None,
+    model: Optional[str] = None,
+):
+    """Newest-first page of conversations; pass `next_cursor` back as `cursor` for the next page."""
+    try:
+        conversations, next_cursor = await asyncio.to_thread(
+            get_catalog().page, limit, cursor, q, collection, model
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"conversations": conversations, "next_cursor": next_cursor}
 
 
 @router.post("/new_prompt_template")
@@ -178,7 +372,7 @@ async def new_prompt_template(template: PromptTemplate):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Template must include {context} and {question}"
         )
-    prompt_template_store["template"] = template.template
+    await asyncio.to_thread(get_settings().set, PROMPT_TEMPLATE_SETTING, template.template)
     global_db_prompt = Tiny_DB_Global_Prompt()
     await asyncio.to_thread(global_db_prompt.save_prompt_template, template.template_name, template.template)
     return {"status": "success", "template": template.template}
@@ -194,14 +388,14 @@ async def delete_prompt_template(template_name: str):
 @router.post("/use_default_prompt")
 async def use_default_prompt():
     """Revert to the built-in DEFAULT_TEMPLATE for RAG."""
-    prompt_template_store["template"] = DEFAULT_TEMPLATE
+    await asyncio.to_thread(get_settings().delete, PROMPT_TEMPLATE_SETTING)
     return {"status": "success", "mode": "default"}
 
 
 @router.get("/get_active_prompt_mode")
 async def get_active_prompt_mode():
     try:
-        current = prompt_template_store.get("template", DEFAULT_TEMPLATE)
+        current = await asyncio.to_thread(active_template)
         mode = "default" if current == DEFAULT_TEMPLATE else "custom"
         return {"status": "success", "mode": mode}
     except Exception as e:
@@ -224,26 +418,22 @@ async def get_all_prompt_templates():
 
 @router.delete("/delete_conversation/{uid}")
 async def delete_conversation(uid: str):
-    global_db = TinyDB_Utils_Global()
     try:
-        conversation_info = await asyncio.to_thread(global_db.get_uid_history, uid)
+        conversation_info = await asyncio.to_thread(get_catalog().get, uid)
         if not conversation_info:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Conversation not found"
             )
-        conversation_info = conversation_info[0]
-        deleted = await asyncio.to_thread(global_db.delete_conversation, uid)
+        await asyncio.to_thread(get_write_behind_queue().flush)
+        deleted = await asyncio.to_thread(get_catalog().delete, uid)
         if deleted:
-            db_path = os.path.join(
-                "./collections",
+            await asyncio.to_thread(get_message_store().delete_conversation, conversation_info["conversation_id"])
+            await asyncio.to_thread(
+                get_conversation_memory().delete_conversation,
                 conversation_info["collectionName"],
-                "db",
-                f"{conversation_info['conversation_id']}.json"
+                conversation_info["conversation_id"]
             )
-            exists = await asyncio.to_thread(os.path.exists, db_path)
-            if exists:
-                await asyncio.to_thread(os.remove, db_path)
             return {"status": "success"}
         else:
             raise HTTPException(
@@ -0,0 +1,100 @@
+import hashlib
+from contextlib import contextmanager
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+
+class FakeCollection:
+    """In-memory stand-in for the parts of a Chroma collection the backend uses."""
+
+    def __init__(self, name: str = "docs"):
+        self.name = name
+        self.rows = {}
+        self.upserts = 0
+
+    def count(self) -> int:
+        return len(self.rows)
+
+    def upsert(self, ids, embeddings, documents, metadatas=None):
+        self.upserts += 1
+        metadatas = metadatas or [{} for _ in ids]
+        for chunk_id, embedding, document, metadata in zip(ids, embeddings, documents, metadatas):
+            self.rows[chunk_id] = (np.asarray(embedding, dtype=np.float32), document, metadata)
+
+    add = upsert
+
+    def delete(self, ids=None, where=None):
+        for chunk_id in list(ids or []):
+            self.rows.pop(chunk_id, None)
+        if where:
+            for chunk_id, (_, _, metadata) in list(self.rows.items()):
+                if all(metadata.get(key) == value for key, value in where.items()):
+                    del self.rows[chunk_id]
+
+    def get(self, ids=None, include=None, limit=None, offset=0, where=None):
+        chunk_ids = list(self.rows) if ids is None else [chunk_id for chunk_id in ids if chunk_id in self.rows]
+        chunk_ids = chunk_ids[offset:None if limit is None else offset + limit]
+        return {
+            "ids": chunk_ids,
+            "embeddings": np.asarray([self.rows[chunk_id][0] for chunk_id in chunk_ids]),
+            "documents": [self.rows[chunk_id][1] for chunk_id in chunk_ids],
+            "metadatas": [self.rows[chunk_id][2] for chunk_id in chunk_ids],
+        }
+
+    def sources(self) -> set:
+        return {metadata["source"] for _, _, metadata in self.rows.values()}
+
+
+class FakeEmbeddingModel:
+    """Deterministic hash-based embeddings of a fixed dimension."""
+
+    def __init__(self, dimension: int = 16):
+        self.dimension = dimension
+        self.encoded = []
+
+    def encode(self, texts, batch_size: int = 32, normalize_embeddings: bool = True, **kwargs):
+        self.encoded.extend(texts)
+        vectors = np.stack([self.vector(text) for text in texts]) if texts else np.empty((0, self.dimension))
+        return vectors.astype(np.float32)
+
+    def vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return vector / np.linalg.norm(vector)
+
+    def fingerprint(self) -> dict:
+        return {"model": "all-MiniLM-L6-v2", "backend": "torch", "precision": "fp32", "dimension": self.dimension}
+
+
+def _fake_converter_and_chunker(model):
+    """Documents are plain text; chunks are their blank-line separated paragraphs."""
+    converter = SimpleNamespace(
+        convert=lambda path: SimpleNamespace(document=open(path, "r", encoding="utf-8").read())
+    )
+    chunker = SimpleNamespace(
+        chunk=lambda dl_doc: [SimpleNamespace(text=part.strip()) for part in dl_doc.split("\n\n") if part.strip()]
+    )
+    return converter, chunker
+
+
+@pytest.fixture
+def fake_ingestion(monkeypatch):
+    """Run `utils.pipeline` in-process against a `FakeCollection` and
+    `FakeEmbeddingModel`, without docling, Chroma or a real model."""
+    from utils import pipeline
+
+    collections = {}
+    model = FakeEmbeddingModel()
+
+    @contextmanager
+    def hold(path):
+        yield path
+
+    monkeypatch.setattr(pipeline, "get_chroma_client", lambda path: path)
+    monkeypatch.setattr(pipeline, "get_chroma_collection",
+                        lambda client, name: collections.setdefault((client, name), FakeCollection(name)))
+    monkeypatch.setattr(pipeline, "hold_chroma_client", hold)
+    monkeypatch.setattr(pipeline, "get_embedding_model", lambda: model)
+    monkeypatch.setattr(pipeline, "build_converter_and_chunker", _fake_converter_and_chunker)
+    return SimpleNamespace(collections=collections, model=model)
@@ -0,0 +1,28 @@
+import numpy as np
+from utils.answer_cache import AnswerCache
+from utils.manifest import bump_generation
+
+
+def _unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_keys_cover_every_searched_collection(tmp_path):
+    docs, notes = str(tmp_path / "docs"), str(tmp_path / "notes")
+    cache = AnswerCache(threshold=0.9)
+    key = AnswerCache.make_key([docs, notes], "llama3", "template", ["context"])
+    cache.store(key, _unit(1, 0), "answer")
+
+    assert cache.lookup(AnswerCache.make_key([notes, docs], "llama3", "template", ["context"]), _unit(1, 0.1)) == "answer"
+    assert cache.lookup(AnswerCache.make_key([docs], "llama3", "template", ["context"]), _unit(1, 0)) is None
+
+
+def test_ingesting_into_any_searched_collection_invalidates(tmp_path):
+    docs, notes = str(tmp_path / "docs"), str(tmp_path / "notes")
+    cache = AnswerCache(threshold=0.9)
+    cache.store(AnswerCache.make_key([docs, notes], "llama3", "template", ["context"]), _unit(1, 0), "answer")
+
+    bump_generation(notes)
+
+    assert cache.lookup(AnswerCache.make_key([docs, notes], "llama3", "template", ["context"]), _unit(1, 0)) is None
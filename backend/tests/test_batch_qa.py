@@ -0,0 +1,41 @@
+import asyncio
+from types import SimpleNamespace
+from utils import batch_qa
+from utils import scheduler as scheduler_module
+from utils.scheduler import GenerationScheduler
+
+
+def test_concurrency_is_capped_at_the_model_limit(monkeypatch):
+    active = {"now": 0, "max": 0, "max_queued": 0}
+
+    async def fake_stream(model, prompt):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        active["max_queued"] = max(active["max_queued"], scheduler.stats()["llama3"]["queued"])
+        try:
+            await asyncio.sleep(0.01)
+            yield "answer"
+        finally:
+            active["now"] -= 1
+
+    scheduler = GenerationScheduler(max_concurrency=2, queue_timeout=0)
+    monkeypatch.setattr(scheduler_module, "async_ollama_response_stream", fake_stream)
+    monkeypatch.setattr(batch_qa, "get_generation_scheduler", lambda: scheduler)
+    monkeypatch.setattr(batch_qa, "embed_queries", lambda texts: [[1.0, 0.0] for _ in texts])
+    monkeypatch.setattr(batch_qa, "query_collection_batch",
+                        lambda name, texts, embeddings, n: [([("id1", "doc", 0.9)], []) for _ in texts])
+    monkeypatch.setattr(batch_qa, "pack_context", lambda docs, model: SimpleNamespace(text="doc", docs=docs, tokens=1))
+    questions = [{"id": index, "question": f"question {index}"} for index in range(8)]
+
+    async def run():
+        return [result async for result in batch_qa.run_batch(
+            questions, "docs", "llama3", lambda context, question: question, concurrency=50
+        )]
+
+    results = asyncio.run(run())
+
+    assert sorted(result["index"] for result in results) == list(range(8))
+    assert all(result["answer"] == "answer" and "error" not in result for result in results)
+    assert active["max"] == 2
+    # The excess waits in the batch, not in the scheduler's queue
+    assert active["max_queued"] == 0
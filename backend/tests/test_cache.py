@@ -0,0 +1,76 @@
+import sys
+import threading
+import types
+import pytest
+from utils import cache
+from utils.cache import ResourceRegistry
+
+
+def _opener(name, size=1, version=None):
+    return lambda: (name, size, version)
+
+
+def test_failed_open_does_not_leave_its_key_locked():
+    registry = ResourceRegistry("test", max_entries=2)
+
+    def broken():
+        raise OSError("disk gone")
+
+    with pytest.raises(OSError):
+        registry.get("a", broken)
+    assert registry._opening == {}
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("value", registry.get("a", _opener("a"))), daemon=True)
+    thread.start()
+    thread.join(5)
+    assert result == {"value": "a"}
+
+
+def test_held_entries_are_not_evicted():
+    evicted = []
+    registry = ResourceRegistry("test", max_entries=1, on_evict=lambda key, value, version: evicted.append(key))
+
+    with registry.holding("a", _opener("a")) as value:
+        assert value == "a"
+        registry.get("b", _opener("b"))
+        assert evicted == []
+        assert registry.get("a", _opener("reopened")) == "a"
+    registry.get("c", _opener("c"))
+    assert "a" in evicted
+
+
+def test_stale_versions_are_reopened():
+    registry = ResourceRegistry("test", max_entries=4)
+    assert registry.get("a", _opener("v1", version=1), version=1) == "v1"
+    assert registry.get("a", _opener("v2", version=2), version=2) == "v2"
+    assert registry.stats()["invalidations"] == 1
+
+
+def test_finding_a_missing_collection_does_not_create_it(monkeypatch, tmp_path):
+    try:
+        from chromadb.errors import NotFoundError
+    except ImportError:
+        NotFoundError = type("NotFoundError", (Exception,), {})
+        monkeypatch.setitem(sys.modules, "chromadb", types.ModuleType("chromadb"))
+        monkeypatch.setitem(sys.modules, "chromadb.errors", types.SimpleNamespace(NotFoundError=NotFoundError))
+    monkeypatch.setattr(cache, "_chroma_collections", ResourceRegistry("chroma_collections", max_entries=4))
+
+    class Client:
+        def __init__(self):
+            self.collections = {}
+
+        def get_settings(self):
+            return types.SimpleNamespace(persist_directory=str(tmp_path))
+
+        def get_collection(self, name):
+            if name not in self.collections:
+                raise NotFoundError(f"Collection {name} does not exist")
+            return self.collections[name]
+
+    client = Client()
+    assert cache.find_chroma_collection(client, "c1") is None
+    assert client.collections == {}
+
+    client.collections["c1"] = "collection"
+    assert cache.find_chroma_collection(client, "c1") == "collection"
@@ -0,0 +1,76 @@
+import json
+import pytest
+from utils.catalog import ConversationCatalog, encode_cursor
+
+
+def _catalog(tmp_path) -> ConversationCatalog:
+    return ConversationCatalog(db_path=str(tmp_path / "rag.sqlite3"), legacy_path=str(tmp_path / "history.json"))
+
+
+def _insert(catalog, conversation_id: str, summary: str, created_at: float, collection="docs", model="llama3"):
+    catalog.conn.execute(
+        "INSERT INTO conversations (conversation_id, summary, summary_lc, model, collection, created_at, date_and_time) "
+        "VALUES (?, ?, ?, ?, ?, ?, '')",
+        (conversation_id, summary, summary.lower(), model, collection, created_at),
+    )
+
+
+def _walk(catalog, limit: int, **filters) -> list:
+    seen, cursor = [], None
+    while True:
+        conversations, cursor = catalog.page(limit=limit, cursor=cursor, **filters)
+        seen.append([c["conversation_id"] for c in conversations])
+        if cursor is None:
+            return seen
+
+
+def _entry(conversation_id: str, summary: str, date: str) -> dict:
+    return {"DateAndTime": date, "conversation_summary": summary, "conversation_id": conversation_id,
+            "modelName": "llama3", "collectionName": "docs"}
+
+
+def test_legacy_history_is_imported_once_keeping_insertion_order(tmp_path):
+    same_second = "2024-01-01 10:00:00"
+    records = {str(key): _entry(f"c{key}", f"Summary {key}", same_second) for key in range(1, 12)}
+    records["12"] = _entry("c12", "Undated", "yesterday")
+    (tmp_path / "history.json").write_text(json.dumps({"_default": records}))
+
+    catalog = _catalog(tmp_path)
+    conversations, _ = catalog.page(limit=20)
+    # Numeric key order survives within the same second; the undated one sorts as now
+    assert [c["conversation_id"] for c in conversations] == ["c12"] + [f"c{key}" for key in range(11, 0, -1)]
+    assert catalog.get("c3") == _entry("c3", "Summary 3", same_second)
+
+    catalog.delete("c3")
+    assert _catalog(tmp_path).get("c3") is None
+
+
+def test_pages_with_tied_timestamps_are_complete_and_disjoint(tmp_path):
+    catalog = _catalog(tmp_path)
+    for index in range(7):
+        _insert(catalog, f"id{index}", f"summary {index}", created_at=100.0 if index < 5 else 50.0)
+
+    pages = _walk(catalog, limit=2)
+
+    assert [len(page) for page in pages] == [2, 2, 2, 1]
+    assert [cid for page in pages for cid in page] == ["id4", "id3", "id2", "id1", "id0", "id6", "id5"]
+
+
+def test_prefix_search_combines_with_filters_and_paging(tmp_path):
+    catalog = _catalog(tmp_path)
+    _insert(catalog, "a", "Docker setup", 1.0)
+    _insert(catalog, "b", "docker networking", 2.0)
+    _insert(catalog, "c", "Using docker", 3.0)
+    _insert(catalog, "d", "DOCKER compose", 4.0, collection="notes")
+    _insert(catalog, "e", "docker volumes", 5.0, model="mistral")
+
+    assert _walk(catalog, limit=1, q="DoCk") == [["e"], ["d"], ["b"], ["a"]]
+    assert _walk(catalog, limit=10, q="docker", collection="docs", model="llama3") == [["b", "a"]]
+    assert catalog.page(q="zebra") == ([], None)
+
+
+def test_invalid_cursors_are_rejected(tmp_path):
+    catalog = _catalog(tmp_path)
+    with pytest.raises(ValueError):
+        catalog.page(cursor="not a cursor")
+    assert catalog.page(cursor=encode_cursor(0.0, "")) == ([], None)
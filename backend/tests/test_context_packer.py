@@ -0,0 +1,29 @@
+import pytest
+from utils.context_packer import TokenCounter, DEFAULT_CHARS_PER_TOKEN, MAX_CHARS_PER_TOKEN
+
+
+def test_calibrates_from_reported_prompt_tokens():
+    counter = TokenCounter(tokenizer_name=None)
+    prompt = "x" * 3000
+    counter.observe("m", prompt, 1000)
+    assert counter.count(prompt, "m") == 1000
+
+
+def test_ignores_counts_from_kv_cache_hits():
+    counter = TokenCounter(tokenizer_name=None)
+    prompt = "x" * 4000
+    counter.observe("m", prompt, 1000)
+    # The same prompt prefix was cached, so Ollama only evaluated a few tokens
+    for _ in range(20):
+        counter.observe("m", prompt, 12)
+    assert counter.count(prompt, "m") == 1000
+
+
+def test_ratio_is_clamped_to_a_plausible_range():
+    counter = TokenCounter(tokenizer_name=None)
+    prompt = "x" * 1000
+    for tokens in [126] * 30 + [110] * 30:
+        counter.observe("m", prompt, tokens)
+    assert max(counter._ratios.values()) == pytest.approx(MAX_CHARS_PER_TOKEN, rel=1e-3)
+    assert counter._ratios["m"] <= MAX_CHARS_PER_TOKEN
+    assert TokenCounter(tokenizer_name=None).count(prompt, "m") == len(prompt) / DEFAULT_CHARS_PER_TOKEN
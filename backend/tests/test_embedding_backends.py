@@ -0,0 +1,76 @@
+import os
+import sys
+import pytest
+from utils import memory_store
+from utils.embedding_backends import (
+    check_compatible, read_fingerprint, write_fingerprint, load_backend, EmbeddingMismatchError, LEGACY_FINGERPRINT
+)
+from conftest import FakeCollection, FakeEmbeddingModel
+
+CURRENT = {"model": "all-MiniLM-L6-v2", "backend": "onnx", "precision": "fp32"}
+
+
+def test_model_ids_are_compared_by_hub_id(tmp_path):
+    write_fingerprint(str(tmp_path), {"model": "sentence-transformers/all-MiniLM-L6-v2", "precision": "fp32"})
+    assert check_compatible(str(tmp_path), CURRENT)["model"] == "sentence-transformers/all-MiniLM-L6-v2"
+
+    legacy = tmp_path / "legacy"
+    (legacy / "chromadb").mkdir(parents=True)
+    current = dict(CURRENT, model="sentence-transformers/all-MiniLM-L6-v2")
+    assert check_compatible(str(legacy), current) == LEGACY_FINGERPRINT
+
+
+def test_other_models_and_precisions_are_rejected(tmp_path):
+    write_fingerprint(str(tmp_path), {"model": "all-MiniLM-L6-v2", "backend": "torch", "precision": "fp32"})
+    with pytest.raises(EmbeddingMismatchError):
+        check_compatible(str(tmp_path), dict(CURRENT, model="BAAI/bge-small-en-v1.5"))
+    with pytest.raises(EmbeddingMismatchError):
+        check_compatible(str(tmp_path), dict(CURRENT, backend="onnx-int8", precision="int8"))
+
+
+@pytest.fixture
+def memory(tmp_path, monkeypatch):
+    collections = {}
+    model = FakeEmbeddingModel()
+    monkeypatch.setattr(memory_store, "get_chroma_client", lambda path: path)
+    monkeypatch.setattr(memory_store, "get_chroma_collection",
+                        lambda client, name: collections.setdefault((client, name), FakeCollection(name)))
+    monkeypatch.setattr(memory_store, "find_chroma_collection", lambda client, name: collections.get((client, name)))
+    monkeypatch.setattr(memory_store, "get_embedding_model", lambda: model)
+    return memory_store.ConversationMemory(collections_dir=str(tmp_path)), model
+
+
+def test_conversation_memory_records_and_checks_its_fingerprint(memory):
+    memory, model = memory
+    memory.add_turns("docs", "c1", ["hello\nworld"], [model.vector("hello")])
+    context_dir = memory.context_dir("docs")
+    assert read_fingerprint(context_dir) == model.fingerprint()
+    assert memory.search("docs", "c1", model.vector("hello"), 1)[0][0] == "hello\nworld"
+
+    write_fingerprint(context_dir, {"model": "BAAI/bge-small-en-v1.5", "backend": "torch", "precision": "fp32"})
+    memory._forget_matrix("docs", "c1")
+    with pytest.raises(EmbeddingMismatchError):
+        memory.search("docs", "c1", model.vector("hello"), 1)
+    with pytest.raises(EmbeddingMismatchError):
+        memory.add_turns("docs", "c1", ["again"], [model.vector("again")])
+
+
+def test_context_stores_without_a_fingerprint_count_as_legacy(memory, monkeypatch):
+    memory, model = memory
+    context_dir = memory.context_dir("docs")
+    memory.add_turns("docs", "c1", ["hello"], [model.vector("hello")])
+    os.remove(os.path.join(context_dir, "embedding.json"))
+    open(os.path.join(context_dir, "chroma.sqlite3"), "w").close()
+
+    monkeypatch.setattr(memory_store, "check_compatible",
+                        lambda path, store: check_compatible(path, dict(CURRENT, model="BAAI/bge-small-en-v1.5"), store))
+    memory._forget_matrix("docs", "c1")
+    with pytest.raises(EmbeddingMismatchError):
+        memory.search("docs", "c1", model.vector("hello"), 1)
+
+
+@pytest.mark.parametrize("name", ["onnx", "onnx-int8"])
+def test_onnx_backends_point_at_the_extra_when_it_is_missing(name, monkeypatch):
+    monkeypatch.setitem(sys.modules, "onnxruntime", None)
+    with pytest.raises(ImportError, match=r"uv sync --extra onnx"):
+        load_backend(name, "all-MiniLM-L6-v2", 0).load()
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import pytest
+from utils import embedding_service
+from utils.embedding_service import QueryEmbeddingService
+from conftest import FakeEmbeddingModel
+
+
+class _RecordingModel(FakeEmbeddingModel):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+        self.error = None
+
+    def encode(self, texts, **kwargs):
+        self.calls.append(list(texts))
+        if self.error is not None:
+            raise self.error
+        return super().encode(texts, **kwargs)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = _RecordingModel()
+    monkeypatch.setattr(embedding_service, "get_embedding_model", lambda: model)
+    return model
+
+
+def _embed_concurrently(service, texts):
+    async def scenario():
+        return await asyncio.gather(*(service.aembed(text) for text in texts))
+    return asyncio.run(scenario())
+
+
+def test_concurrent_queries_share_one_encode_without_duplicates(model):
+    service = QueryEmbeddingService(batch_window=0.05)
+    texts = ["alpha", "beta", "alpha", "gamma", "beta"]
+
+    vectors = _embed_concurrently(service, texts)
+
+    assert model.calls == [["alpha", "beta", "gamma"]]
+    for text, vector in zip(texts, vectors):
+        assert vector.tolist() == pytest.approx(model.vector(text).tolist(), abs=1e-6)
+
+
+def test_batches_are_split_at_the_maximum_size(model):
+    service = QueryEmbeddingService(batch_window=0.05, max_batch_size=2)
+    _embed_concurrently(service, ["a", "b", "c"])
+    assert [len(call) for call in model.calls] == [2, 1]
+
+
+def test_cached_queries_skip_the_model(model):
+    service = QueryEmbeddingService(batch_window=0, cache_size=2)
+    first = service.embed("alpha")
+    service.embed("beta")
+
+    assert service.embed("alpha").tolist() == first.tolist()
+    assert len(model.calls) == 2
+
+    # "beta" is now the least recently used and makes room for "gamma"
+    service.embed("gamma")
+    service.embed("beta")
+    assert model.calls[-1] == ["beta"]
+
+
+def test_an_encode_failure_reaches_every_waiter(model):
+    model.error = RuntimeError("model crashed")
+    service = QueryEmbeddingService(batch_window=0.05)
+    futures = [service.submit(text) for text in ("alpha", "alpha", "beta")]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model crashed"):
+            future.result(timeout=5)
+    assert len(model.calls) == 1
+
+    # The worker survives the failure and nothing failed was cached
+    model.error = None
+    assert service.embed("alpha") is not None
+    assert model.calls[-1] == ["alpha"]
+
+
+def test_blocking_callers_from_many_threads_are_coalesced(model):
+    service = QueryEmbeddingService(batch_window=0.1)
+    barrier = threading.Barrier(8)
+    results = {}
+
+    def call(index):
+        barrier.wait()
+        results[index] = service.embed(f"query {index % 4}")
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(results) == 8
+    assert sum(len(call) for call in model.calls) == 4
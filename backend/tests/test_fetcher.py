@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from utils.fetcher import Fetcher
+
+
+class _Origin(ThreadingHTTPServer):
+    """Local stand-in for a web server; `routes` maps a path to a handler
+    `(request) -> (status, headers, body)`."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.routes = {}
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+    def hits(self, path: str) -> int:
+        return sum(1 for request_path, _ in self.requests if request_path == path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            status, headers, body = server.routes[self.path](self)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            if "Content-Length" not in headers and "Transfer-Encoding" not in headers:
+                self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if headers.get("Transfer-Encoding") == "chunked":
+                for start in range(0, len(body), 4096):
+                    piece = body[start:start + 4096]
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    server = _Origin()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_fetcher(tmp_path):
+    fetchers = []
+
+    def make(**kwargs):
+        kwargs.setdefault("backoff", 0.01)
+        fetcher = Fetcher(cache_dir=str(tmp_path / "url_cache"), **kwargs)
+        fetchers.append(fetcher)
+        return fetcher
+
+    yield make
+    for fetcher in fetchers:
+        fetcher.close()
+
+
+@pytest.fixture
+def target(tmp_path):
+    path = tmp_path / "files"
+    path.mkdir()
+    return path
+
+
+def test_per_host_limit_caps_concurrent_requests(origin, make_fetcher, target):
+    def slow(request):
+        time.sleep(0.1)
+        return 200, {"Content-Type": "text/html"}, request.path.encode()
+
+    urls = []
+    for index in range(8):
+        origin.routes[f"/page{index}"] = slow
+        urls.append(origin.url(f"/page{index}"))
+
+    results = make_fetcher(per_host_limit=2).fetch_many(str(target), urls)
+
+    assert all(filename for filename, _ in results)
+    assert origin.max_active == 2
+    assert sorted(os.listdir(target)) == sorted(filename for filename, _ in results)
+
+
+def test_retries_transient_errors_with_backoff(origin, make_fetcher, target):
+    attempts = []
+
+    def flaky(request):
+        attempts.append(time.perf_counter())
+        if len(attempts) < 3:
+            return 503, {}, b"busy"
+        return 200, {"Content-Type": "text/html"}, b"<p>ok</p>"
+
+    origin.routes["/flaky"] = flaky
+    [(filename, url)] = make_fetcher(retries=2, backoff=0.05).fetch_many(str(target), [origin.url("/flaky")])
+
+    assert url == origin.url("/flaky")
+    assert (target / filename).read_bytes() == b"<p>ok</p>"
+    assert len(attempts) == 3
+    # Exponential: ~0.05s before the second attempt, ~0.1s before the third
+    assert attempts[1] - attempts[0] >= 0.04
+    assert attempts[2] - attempts[1] >= 0.09
+
+
+def test_honours_retry_after_and_gives_up_after_retries(origin, make_fetcher, target):
+    origin.routes["/limited"] = lambda request: (429, {"Retry-After": "0"}, b"")
+    origin.routes["/missing"] = lambda request: (404, {}, b"")
+
+    results = make_fetcher(retries=2, backoff=10).fetch_many(
+        str(target), [origin.url("/limited"), origin.url("/missing")]
+    )
+
+    assert results == [(None, None), (None, None)]
+    assert origin.hits("/limited") == 3
+    # Client errors other than 408/429 are not retried
+    assert origin.hits("/missing") == 1
+
+
+def test_rejects_bodies_over_the_size_limit(origin, make_fetcher, target, tmp_path):
+    body = b"x" * 20000
+    origin.routes["/declared"] = lambda request: (200, {}, body)
+    origin.routes["/chunked"] = lambda request: (200, {"Transfer-Encoding": "chunked"}, body)
+    origin.routes["/small"] = lambda request: (200, {}, b"small")
+
+    results = make_fetcher(max_bytes=10000).fetch_many(
+        str(target), [origin.url("/declared"), origin.url("/chunked"), origin.url("/small")]
+    )
+
+    assert results[:2] == [(None, None), (None, None)]
+    assert results[2][0] is not None
+    assert os.listdir(target) == [results[2][0]]
+    # No partial downloads are left behind in the cache
+    assert not [name for name in os.listdir(tmp_path / "url_cache") if name.endswith(".part")]
+
+
+def test_conditional_get_reuses_the_cached_body(origin, make_fetcher, target):
+    def page(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return 304, {"ETag": '"v1"'}, b""
+        return 200, {"ETag": '"v1"', "Content-Type": "text/html"}, b"<p>v1</p>"
+
+    origin.routes["/page"] = page
+    fetcher = make_fetcher()
+    [(first, _)] = fetcher.fetch_many(str(target), [origin.url("/page")])
+    os.remove(target / first)
+    [(second, _)] = fetcher.fetch_many(str(target), [origin.url("/page")])
+
+    assert first == second
+    assert (target / second).read_bytes() == b"<p>v1</p>"
+    assert origin.requests[1][1].get("If-None-Match") == '"v1"'
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+import pytest
+from utils import jobs
+from utils.jobs import JobManager
+
+
+class _FakePipeline:
+    """Reports every staged file as processed, or fails on `fail_on`."""
+
+    def __init__(self):
+        self.runs = []
+        self.fail_on = None
+        self.gate = None
+
+    def __call__(self, staging_dir, collection_dir, collection_name, progress=None, should_cancel=None):
+        self.runs.append(sorted(os.listdir(staging_dir)))
+        if self.gate is not None:
+            self.gate.wait(5)
+        stats = {"processed": 0, "cancelled": False}
+        for name in sorted(os.listdir(staging_dir)):
+            if should_cancel():
+                stats["cancelled"] = True
+                break
+            if name == self.fail_on:
+                progress(name, "failed", error="unreadable")
+                raise RuntimeError(f"{name} is unreadable")
+            progress(name, "processed", chunks=2)
+            stats["processed"] += 1
+        return stats
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    fake = _FakePipeline()
+    monkeypatch.setattr(jobs, "run_pipeline", fake)
+    return fake
+
+
+def _manager(tmp_path, **kwargs) -> JobManager:
+    return JobManager(db_path=str(tmp_path / "rag.sqlite3"), workers=1,
+                      legacy_path=str(tmp_path / "ingest_jobs.json"), **kwargs)
+
+
+def _stage(tmp_path, name: str, files: list) -> str:
+    staging_dir = tmp_path / "staging" / name
+    staging_dir.mkdir(parents=True)
+    for filename in files:
+        (staging_dir / filename).write_text(filename)
+    return str(staging_dir)
+
+
+def _submit(manager, tmp_path, name: str, files: list) -> dict:
+    return manager.submit("docs", str(tmp_path / "docs"), _stage(tmp_path, name, files), files, [])
+
+
+def _wait(manager, job_id: str, statuses=("completed", "cancelled", "failed")) -> dict:
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} is still {job['status']}")
+
+
+def test_submitted_jobs_run_to_completion(tmp_path, pipeline):
+    manager = _manager(tmp_path)
+    job = _submit(manager, tmp_path, "one", ["a.txt", "b.txt"])
+    assert job["status"] == "queued"
+
+    done = _wait(manager, job["job_id"])
+    assert done["status"] == "completed"
+    assert done["chunks_added"] == 4
+    assert done["files"] == {
+        "a.txt": {"status": "processed", "chunks": 2, "error": None},
+        "b.txt": {"status": "processed", "chunks": 2, "error": None},
+    }
+    assert not os.path.exists(job["staging_dir"])
+    assert [j["job_id"] for j in manager.list("docs")] == [job["job_id"]]
+    assert manager.list("other") == []
+
+
+def test_cancelled_jobs_stop_before_the_next_file(tmp_path, pipeline):
+    manager = _manager(tmp_path)
+    pipeline.gate = threading.Event()
+    job = _submit(manager, tmp_path, "one", ["a.txt", "b.txt"])
+    _wait(manager, job["job_id"], ("running",))
+
+    assert manager.cancel(job["job_id"])
+    pipeline.gate.set()
+    done = _wait(manager, job["job_id"])
+    assert done["status"] == "cancelled"
+    assert done["files"]["a.txt"]["status"] == "pending"
+    assert not manager.cancel(job["job_id"])
+
+
+def test_interrupted_jobs_resume_after_a_restart(tmp_path, pipeline):
+    manager = _manager(tmp_path)
+    pipeline.gate = threading.Event()
+    job = _submit(manager, tmp_path, "one", ["a.txt"])
+    _wait(manager, job["job_id"], ("running",))
+
+    # The server stops while the job is running: it stays active on disk
+    manager.shutdown()
+    pipeline.gate.set()
+    time.sleep(0.1)
+    pipeline.gate = None
+
+    restarted = _manager(tmp_path)
+    assert restarted.get(job["job_id"])["status"] == "running"
+    assert restarted.resume() == 1
+    assert _wait(restarted, job["job_id"])["status"] == "completed"
+    assert len(pipeline.runs) == 2
+
+
+def test_failed_jobs_keep_their_files_and_can_be_retried(tmp_path, pipeline):
+    manager = _manager(tmp_path)
+    pipeline.fail_on = "b.txt"
+    job = _submit(manager, tmp_path, "one", ["a.txt", "b.txt"])
+
+    failed = _wait(manager, job["job_id"])
+    assert failed["status"] == "failed"
+    assert failed["error"] == "b.txt is unreadable"
+    assert failed["files"]["b.txt"] == {"status": "failed", "chunks": 0, "error": "unreadable"}
+    assert sorted(os.listdir(job["staging_dir"])) == ["a.txt", "b.txt"]
+
+    pipeline.fail_on = None
+    assert manager.retry(job["job_id"])
+    retried = _wait(manager, job["job_id"])
+    assert retried["status"] == "completed" and retried["error"] is None
+    assert retried["files"]["b.txt"]["status"] == "processed"
+    assert not os.path.exists(job["staging_dir"])
+    assert not manager.retry(job["job_id"])
+
+
+def test_only_the_newest_finished_jobs_are_kept(tmp_path, pipeline):
+    manager = _manager(tmp_path, history=2)
+    pipeline.fail_on = "bad.txt"
+    failed = _submit(manager, tmp_path, "failed", ["bad.txt"])
+    _wait(manager, failed["job_id"])
+
+    kept = [_wait(manager, _submit(manager, tmp_path, f"job{index}", ["a.txt"])["job_id"]) for index in range(2)]
+
+    assert manager.get(failed["job_id"]) is None
+    assert not os.path.exists(failed["staging_dir"])
+    assert {job["job_id"] for job in manager.list()} == {job["job_id"] for job in kept}
+    count = manager.conn.execute("SELECT COUNT(*) FROM ingest_job_files WHERE job_id = ?", (failed["job_id"],))
+    assert count.fetchone()[0] == 0
+
+
+def test_legacy_tinydb_jobs_are_imported_once(tmp_path, pipeline):
+    legacy = {"_default": {
+        "1": {"job_id": "old", "collection": "docs", "collection_dir": "./collections/docs", "staging_dir": None,
+              "status": "completed", "created_at": "2024-01-01 10:00:00", "urls": ["https://example.com"],
+              "files": {"a.txt": {"status": "processed", "chunks": 3, "error": None}},
+              "chunks_added": 3, "stats": {"processed": 1}, "error": None},
+    }}
+    (tmp_path / "ingest_jobs.json").write_text(json.dumps(legacy))
+
+    manager = _manager(tmp_path)
+    job = manager.get("old")
+    assert job["status"] == "completed"
+    assert job["urls"] == ["https://example.com"]
+    assert job["stats"] == {"processed": 1}
+    assert job["files"] == {"a.txt": {"status": "processed", "chunks": 3, "error": None}}
+
+    manager.conn.execute("DELETE FROM ingest_jobs")
+    assert _manager(tmp_path).get("old") is None
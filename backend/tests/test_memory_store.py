@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import uuid
+import pytest
+from utils import memory_store
+from utils.memory_store import ConversationMemory
+from conftest import FakeCollection, FakeEmbeddingModel
+
+
+class _FakeClient:
+    def __init__(self):
+        self.collections = {}
+
+    def get_or_create_collection(self, name: str) -> FakeCollection:
+        return self.collections.setdefault(name, FakeCollection(name))
+
+    def list_collections(self) -> list:
+        return list(self.collections.values())
+
+    def delete_collection(self, name: str):
+        del self.collections[name]
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    clients = {}
+    model = FakeEmbeddingModel()
+    monkeypatch.setattr(memory_store, "get_chroma_client", lambda path: clients.setdefault(path, _FakeClient()))
+    monkeypatch.setattr(memory_store, "get_chroma_collection", lambda client, name: client.get_or_create_collection(name))
+    monkeypatch.setattr(memory_store, "find_chroma_collection", lambda client, name: client.collections.get(name))
+    monkeypatch.setattr(memory_store, "drop_chroma_collection", lambda path, name: None)
+    monkeypatch.setattr(memory_store, "get_embedding_model", lambda: model)
+    return clients
+
+
+def _memory(tmp_path, **kwargs) -> ConversationMemory:
+    return ConversationMemory(collections_dir=str(tmp_path), **kwargs)
+
+
+def _turn(index: int) -> str:
+    return f"Question {index}?\nAnswer {index} first sentence. Answer {index} second sentence."
+
+
+def _add(memory, conversation_id: str, index: int):
+    memory.add_turns("docs", conversation_id, [_turn(index)], [FakeEmbeddingModel().vector(_turn(index))])
+
+
+def _entries(collection) -> dict:
+    kinds = {"turn": [], "summary": []}
+    for _, document, metadata in sorted(collection.rows.values(), key=lambda row: row[2]["created_at"]):
+        kinds[metadata["kind"]].append(document)
+    return kinds
+
+
+def test_old_turns_are_compacted_into_a_bounded_number_of_summaries(tmp_path, clients):
+    memory = _memory(tmp_path, max_turns=4, keep_recent=2, turns_per_summary=2, max_summaries=2)
+
+    for index in range(5):
+        _add(memory, "c1", index)
+    collection = clients[memory.context_dir("docs")].collections["c1"]
+    entries = _entries(collection)
+    assert entries["turn"] == [_turn(index) for index in (2, 3, 4)]
+    assert entries["summary"] == ["Question 0?\nAnswer 0 first sentence. Answer 0 second sentence.\n"
+                                  "Question 1?\nAnswer 1 first sentence. Answer 1 second sentence."]
+
+    for index in range(5, 20):
+        _add(memory, "c1", index)
+        entries = _entries(collection)
+        assert len(entries["turn"]) <= 4 and len(entries["summary"]) <= 2
+        assert entries["turn"][-1] == _turn(index)
+    # The oldest summaries are the ones dropped
+    assert entries["summary"][-1].startswith("Question 14?")
+
+
+def test_search_scores_entries_and_sees_new_turns(tmp_path, clients):
+    memory = _memory(tmp_path)
+    _add(memory, "c1", 0)
+    model = FakeEmbeddingModel()
+
+    [(document, score)] = memory.search("docs", "c1", model.vector(_turn(0)), n_results=5)
+    assert document == _turn(0) and score == pytest.approx(1.0, abs=1e-5)
+
+    # Adding a turn drops the cached matrix
+    _add(memory, "c1", 1)
+    assert memory.search("docs", "c1", model.vector(_turn(1)), n_results=1)[0][0] == _turn(1)
+
+
+def test_searching_a_conversation_without_memory_does_not_create_it(tmp_path, clients):
+    memory = _memory(tmp_path)
+    assert memory.search("docs", "c1", [1.0, 0.0]) == []
+
+    _add(memory, "c1", 0)
+    assert memory.search("docs", "unknown", FakeEmbeddingModel().vector("x")) == []
+    assert set(clients[memory.context_dir("docs")].collections) == {"c1"}
+
+
+def test_deleting_a_conversation_removes_its_collection(tmp_path, clients):
+    memory = _memory(tmp_path)
+    _add(memory, "c1", 0)
+    _add(memory, "c2", 0)
+    vector = FakeEmbeddingModel().vector(_turn(0))
+    assert memory.search("docs", "c1", vector)
+
+    assert memory.delete_conversation("docs", "c1")
+    assert set(clients[memory.context_dir("docs")].collections) == {"c2"}
+    assert memory.search("docs", "c1", vector) == []
+    assert not memory.delete_conversation("docs", "c1")
+    assert not memory.delete_conversation("missing", "c1")
+
+
+def test_vacuum_drops_unknown_conversations_and_orphaned_segments(tmp_path, clients):
+    memory = _memory(tmp_path)
+    _add(memory, "keep", 0)
+    _add(memory, "gone", 0)
+    context_dir = memory.context_dir("docs")
+    live, orphan = str(uuid.uuid4()), str(uuid.uuid4())
+    for name in (live, orphan, "not-a-segment"):
+        os.makedirs(os.path.join(context_dir, name))
+        with open(os.path.join(context_dir, name, "data_level0.bin"), "wb") as f:
+            f.write(b"\0" * 4096)
+    conn = sqlite3.connect(os.path.join(context_dir, "chroma.sqlite3"))
+    conn.execute("CREATE TABLE segments (id TEXT PRIMARY KEY)")
+    conn.execute("INSERT INTO segments VALUES (?)", (live,))
+    conn.commit()
+    conn.close()
+
+    stats = memory.vacuum(is_known_conversation=lambda name: name == "keep")
+
+    assert stats["collections_deleted"] == 1 and stats["segments_removed"] == 1
+    assert stats["bytes_freed"] >= 4096
+    assert set(clients[context_dir].collections) == {"keep"}
+    assert sorted(name for name in os.listdir(context_dir) if os.path.isdir(os.path.join(context_dir, name))) == \
+        sorted([live, "not-a-segment"])
@@ -0,0 +1,59 @@
+import json
+from utils.message_store import MessageStore
+
+
+def _write_legacy(collections_dir, collection_name: str, conversation_id: str, messages: list):
+    db_dir = collections_dir / collection_name / "db"
+    db_dir.mkdir(parents=True, exist_ok=True)
+    table = {str(index + 1): message for index, message in enumerate(messages)}
+    (db_dir / f"{conversation_id}.json").write_text(json.dumps({"_default": table}))
+
+
+def _store(tmp_path) -> MessageStore:
+    return MessageStore(db_path=str(tmp_path / "rag.sqlite3"), collections_dir=str(tmp_path / "collections"))
+
+
+def _contents(messages: list) -> list:
+    return [{role: text for role, text in message.items() if role != "id"} for message in messages]
+
+
+def test_legacy_conversations_are_imported_in_order(tmp_path):
+    collections_dir = tmp_path / "collections"
+    # Keys sort numerically, not as strings
+    messages = [{"user": f"question {index}"} if index % 2 == 0 else {"model": f"answer {index}"} for index in range(12)]
+    _write_legacy(collections_dir, "docs", "c1", messages)
+    _write_legacy(collections_dir, "notes", "c2", [{"user": "hi", "model": "hello"}])
+    (collections_dir / "notes" / "db" / "broken.json").write_text("{not json")
+
+    store = _store(tmp_path)
+
+    assert _contents(store.get_messages("c1")) == messages
+    assert _contents(store.get_messages("c2")) == [{"user": "hi"}, {"model": "hello"}]
+    assert store.get_messages("broken") == []
+    collection = store.conn.execute("SELECT DISTINCT collection FROM messages WHERE conversation_id = 'c2'")
+    assert collection.fetchone()[0] == "notes"
+
+
+def test_the_import_runs_once_and_never_duplicates_messages(tmp_path):
+    _write_legacy(tmp_path / "collections", "docs", "c1", [{"user": "hi"}, {"model": "hello"}])
+    store = _store(tmp_path)
+    store.append("c1", "docs", "user", "later")
+
+    # A second start does not import again
+    assert len(_store(tmp_path).get_messages("c1")) == 3
+
+    # Even if the marker is lost, conversations that already have rows are skipped
+    store.conn.execute("DELETE FROM migrations")
+    assert len(_store(tmp_path).get_messages("c1")) == 3
+
+
+def test_history_pages_walk_backwards_from_a_message_id(tmp_path):
+    store = _store(tmp_path)
+    ids = [store.append("c1", "docs", "user" if index % 2 == 0 else "model", str(index)) for index in range(5)]
+
+    latest = store.get_messages("c1", limit=2)
+    assert [message["id"] for message in latest] == ids[3:]
+    older = store.get_messages("c1", before=latest[0]["id"], limit=2)
+    assert [message["id"] for message in older] == ids[1:3]
+    assert store.has_older("c1", older[0]["id"])
+    assert not store.has_older("c1", ids[0])
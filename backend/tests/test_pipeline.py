@@ -0,0 +1,172 @@
+import json
+import threading
+import pytest
+from utils.manifest import CollectionManifest, chunk_id, MANIFEST_FILENAME
+from utils.pipeline import run_pipeline
+
+
+def _write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    return input_dir, tmp_path / "collection"
+
+
+def _ingest(input_dir, output_dir, **kwargs):
+    return run_pipeline(str(input_dir), str(output_dir), "docs", workers=0, **kwargs)
+
+
+def _collection(fake_ingestion):
+    [collection] = fake_ingestion.collections.values()
+    return collection
+
+
+def test_unchanged_files_are_skipped_and_changed_chunks_replaced(fake_ingestion, dirs):
+    input_dir, output_dir = dirs
+    _write(input_dir / "a.txt", "alpha one\n\nalpha two")
+    _write(input_dir / "b.txt", "beta")
+
+    stats = _ingest(input_dir, output_dir)
+    assert (stats["files_processed"], stats["chunks_added"]) == (2, 3)
+
+    stats = _ingest(input_dir, output_dir)
+    assert (stats["files_processed"], stats["files_skipped"], stats["chunks_added"]) == (0, 2, 0)
+
+    fake_ingestion.model.encoded.clear()
+    _write(input_dir / "a.txt", "alpha one\n\nalpha three")
+    stats = _ingest(input_dir, output_dir)
+    assert (stats["files_processed"], stats["chunks_added"], stats["chunks_deleted"]) == (1, 1, 1)
+    # Only the new chunk is embedded again
+    assert fake_ingestion.model.encoded == ["alpha three"]
+    collection = _collection(fake_ingestion)
+    assert sorted(document for _, document, _ in collection.rows.values()) == ["alpha one", "alpha three", "beta"]
+    assert CollectionManifest(str(output_dir)).chunk_ids("a.txt") == [
+        chunk_id("a.txt", "alpha one"), chunk_id("a.txt", "alpha three")
+    ]
+
+
+def test_prune_removes_sources_missing_from_the_input(fake_ingestion, dirs):
+    input_dir, output_dir = dirs
+    _write(input_dir / "a.txt", "alpha")
+    _write(input_dir / "b.txt", "beta")
+    _ingest(input_dir, output_dir)
+
+    (input_dir / "b.txt").unlink()
+    stats = _ingest(input_dir, output_dir)
+    assert stats["chunks_deleted"] == 0
+    assert _collection(fake_ingestion).sources() == {"a.txt", "b.txt"}
+
+    stats = _ingest(input_dir, output_dir, prune=True)
+    assert stats["chunks_deleted"] == 1
+    assert _collection(fake_ingestion).sources() == {"a.txt"}
+    assert CollectionManifest(str(output_dir)).sources() == ["a.txt"]
+
+
+def test_same_named_files_in_subfolders_are_tracked_separately(fake_ingestion, dirs):
+    input_dir, output_dir = dirs
+    _write(input_dir / "one" / "notes.txt", "first notes")
+    _write(input_dir / "two" / "notes.txt", "second notes")
+
+    stats = _ingest(input_dir, output_dir)
+    assert stats["files_processed"] == 2
+    assert sorted(CollectionManifest(str(output_dir)).sources()) == ["one/notes.txt", "two/notes.txt"]
+
+    stats = _ingest(input_dir, output_dir, prune=True)
+    assert (stats["files_skipped"], stats["chunks_deleted"]) == (2, 0)
+    assert sorted(document for _, document, _ in _collection(fake_ingestion).rows.values()) == [
+        "first notes", "second notes"
+    ]
+
+
+def test_basename_keys_from_version_1_manifests_are_replaced(fake_ingestion, dirs):
+    input_dir, output_dir = dirs
+    _write(input_dir / "one" / "notes.txt", "first notes")
+    _write(input_dir / "top.txt", "top")
+    _ingest(input_dir, output_dir)
+    collection = _collection(fake_ingestion)
+
+    # Rewrite the state as version 1 left it: entries and chunk ids keyed by basename
+    collection.rows.clear()
+    legacy_ids = {"notes.txt": chunk_id("notes.txt", "first notes"), "top.txt": chunk_id("top.txt", "top")}
+    for source, legacy_id in legacy_ids.items():
+        document = "first notes" if source == "notes.txt" else "top"
+        collection.upsert([legacy_id], [fake_ingestion.model.vector(document)], [document], [{"source": source}])
+    manifest_path = output_dir / MANIFEST_FILENAME
+    files = json.loads(manifest_path.read_text())["files"]
+    manifest_path.write_text(json.dumps({"version": 1, "files": {
+        "notes.txt": {"sha256": files["one/notes.txt"]["sha256"], "chunk_ids": [legacy_ids["notes.txt"]]},
+        "top.txt": {"sha256": files["top.txt"]["sha256"], "chunk_ids": [legacy_ids["top.txt"]]},
+    }}))
+
+    stats = _ingest(input_dir, output_dir)
+
+    assert (stats["files_processed"], stats["files_skipped"]) == (1, 1)
+    assert sorted(collection.rows) == sorted([chunk_id("one/notes.txt", "first notes"), legacy_ids["top.txt"]])
+    manifest = CollectionManifest(str(output_dir))
+    assert manifest.version == 2
+    assert sorted(manifest.sources()) == ["one/notes.txt", "top.txt"]
+
+
+def _run_in_thread(function, timeout=10):
+    result = {}
+
+    def target():
+        try:
+            result["value"] = function()
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "ingestion hung"
+    return result
+
+
+def test_embed_stage_failure_fails_the_run_instead_of_hanging(fake_ingestion, dirs, monkeypatch):
+    from utils import pipeline
+
+    input_dir, output_dir = dirs
+    _write(input_dir / "first.txt", "first")
+    _ingest(input_dir, output_dir)
+
+    def broken_model():
+        raise RuntimeError("model files missing")
+
+    monkeypatch.setattr(pipeline, "get_embedding_model", broken_model)
+    # More files than the bounded queues hold
+    for index in range(pipeline.QUEUE_SIZE * 4):
+        _write(input_dir / f"doc{index}.txt", f"document {index}")
+    reports = []
+
+    result = _run_in_thread(lambda: _ingest(
+        input_dir, output_dir, progress=lambda source, status, chunks=0, error=None: reports.append((source, status))
+    ))
+
+    assert str(result["error"]) == "model files missing"
+    failed = {source for source, status in reports if status == "failed"}
+    assert failed == {f"doc{index}.txt" for index in range(pipeline.QUEUE_SIZE * 4)}
+    assert "doc0.txt" not in CollectionManifest(str(output_dir)).sources()
+
+
+def test_a_failed_embedding_batch_only_fails_its_files(fake_ingestion, dirs):
+    input_dir, output_dir = dirs
+    _write(input_dir / "good.txt", "fine")
+    _write(input_dir / "bad.txt", "poison")
+    encode = fake_ingestion.model.encode
+
+    def flaky_encode(texts, **kwargs):
+        if "poison" in texts:
+            raise ValueError("cannot embed")
+        return encode(texts, **kwargs)
+
+    fake_ingestion.model.encode = flaky_encode
+    stats = _run_in_thread(lambda: _ingest(input_dir, output_dir, embed_batch_chunks=1))["value"]
+
+    assert (stats["files_processed"], stats["files_failed"]) == (1, 1)
+    assert CollectionManifest(str(output_dir)).sources() == ["good.txt"]
@@ -0,0 +1,25 @@
+from utils.rag_utils import reciprocal_rank_fusion, rank_only
+
+
+def test_lexical_hits_are_fused_by_rank_only():
+    dense = [("strong dense", 0.82), ("second dense", 0.78), ("third dense", 0.74)]
+    # A single weak term match is still the top BM25 hit of its query
+    lexical = [("weak lexical", 0.4)]
+
+    fused = reciprocal_rank_fusion([dense, rank_only(lexical)], k=60, top_k=4)
+
+    assert fused[:3] == ["strong dense", "second dense", "third dense"]
+    assert fused[3] == "weak lexical"
+
+
+def test_documents_found_by_both_retrievers_rank_first():
+    dense = [("dense only", 0.8), ("both", 0.79)]
+    lexical = [("both", 12.5), ("lexical only", 9.1)]
+
+    fused = reciprocal_rank_fusion([dense, rank_only(lexical)], k=60, top_k=3)
+
+    assert fused[0] == "both"
+
+
+def test_rank_only_keeps_the_order():
+    assert rank_only([("a", 7.0), ("b", 3.0)]) == [("a", 0.0), ("b", 0.0)]
@@ -0,0 +1,158 @@
+import os
+import stat
+import tempfile
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+import pytest
+from utils import retrieval_ipc
+from utils.retrieval_ipc import RemoteCallError, RetrievalClient, remote_object, remote_procedure
+from utils.metrics import merge_metrics
+
+
+class _Counter:
+    def __init__(self):
+        self.value = 0
+
+    def add(self, amount: int) -> int:
+        self.value += amount
+        return self.value
+
+    def reset(self):
+        self.value = 0
+
+
+@pytest.fixture
+def socket_path(monkeypatch):
+    # Unix socket paths are limited to ~100 bytes, so not under tmp_path
+    directory = tempfile.mkdtemp(prefix="rag-ipc-")
+    path = os.path.join(directory, "retrieval.sock")
+    monkeypatch.setattr(retrieval_ipc, "_procedures", {})
+    monkeypatch.setattr(retrieval_ipc, "_objects", {})
+    monkeypatch.setattr(retrieval_ipc, "_client", None)
+    monkeypatch.setenv("RAG_RETRIEVAL_SOCKET", path)
+    monkeypatch.delenv("RAG_RETRIEVAL_AUTHKEY", raising=False)
+    yield path
+    retrieval_ipc.remove_socket(path)
+    os.rmdir(directory)
+
+
+@pytest.fixture
+def server(socket_path):
+    """The retrieval server's accept loop on a thread of this process."""
+    listener = retrieval_ipc.open_listener(socket_path)
+    authkey = retrieval_ipc._authkey(socket_path)
+    rejected = []
+    stopped = threading.Event()
+
+    def accept():
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError as e:
+                rejected.append(e)
+                continue
+            if stopped.is_set():
+                conn.close()
+                return
+            threading.Thread(target=retrieval_ipc._handle, args=(conn,), daemon=True).start()
+
+    thread = threading.Thread(target=accept, daemon=True)
+    thread.start()
+    yield rejected
+    # Wake the blocked accept with one last connection
+    stopped.set()
+    Client(socket_path, family="AF_UNIX", authkey=authkey).close()
+    thread.join(5)
+    listener.close()
+
+
+def test_procedures_and_allowed_methods_are_forwarded(server):
+    threads = []
+    counter = _Counter()
+
+    @remote_procedure("test.tagged")
+    def tagged(tag, suffix=""):
+        threads.append(threading.get_ident())
+        return f"{tag}{suffix}"
+
+    @remote_procedure("test.fail")
+    def fail():
+        raise ValueError("bad input")
+
+    @remote_object("counter", ("add",))
+    def get_counter():
+        return counter
+
+    assert retrieval_ipc.is_remote()
+    assert tagged("a", suffix="!") == "a!"
+    assert threads and threads[0] != threading.get_ident()
+    with pytest.raises(RemoteCallError, match="ValueError: bad input"):
+        fail()
+
+    proxy = get_counter()
+    assert proxy is not counter
+    assert proxy.add(2) == 2 and proxy.add(3) == 5
+    assert counter.value == 5
+
+
+def test_methods_outside_the_allowlist_are_refused_on_both_ends(server):
+    counter = _Counter()
+
+    @remote_object("counter", ("add",))
+    def get_counter():
+        return counter
+
+    with pytest.raises(AttributeError):
+        get_counter().reset
+    # A worker that sends the call anyway is refused by the server
+    with pytest.raises(RemoteCallError, match="KeyError"):
+        retrieval_ipc.get_retrieval_client().call("counter.reset")
+    with pytest.raises(RemoteCallError, match="KeyError"):
+        retrieval_ipc.get_retrieval_client().call("counter.__init__")
+    assert counter.value == 0
+
+
+def test_the_server_writes_a_private_key_file_for_its_workers(server, socket_path):
+    key_file = socket_path + ".key"
+    assert stat.S_IMODE(os.stat(key_file).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+
+    @remote_procedure("test.echo")
+    def echo(value):
+        return value
+
+    assert echo(1) == 1
+
+
+def test_connections_without_the_key_are_rejected(server, socket_path, monkeypatch):
+    @remote_procedure("test.echo")
+    def echo(value):
+        return value
+
+    with pytest.raises(AuthenticationError):
+        Client(socket_path, family="AF_UNIX", authkey=b"rag-retrieval")
+    monkeypatch.setenv("RAG_RETRIEVAL_AUTHKEY", "not the server's key")
+    with pytest.raises(AuthenticationError):
+        RetrievalClient(socket_path).call("test.echo", 1)
+
+    # Without a key from either source a worker refuses to connect at all
+    monkeypatch.delenv("RAG_RETRIEVAL_AUTHKEY")
+    os.unlink(socket_path + ".key")
+    with pytest.raises(AuthenticationError, match="RAG_RETRIEVAL_AUTHKEY"):
+        RetrievalClient(socket_path).call("test.echo", 1)
+    assert len(server) == 2
+
+
+def test_server_metrics_are_merged_into_the_worker_exposition():
+    worker = ('# HELP rag_x_total X.\n# TYPE rag_x_total counter\nrag_x_total{model="a"} 2\n'
+              '# HELP rag_y_seconds Y.\n# TYPE rag_y_seconds histogram\n')
+    server = ('# HELP rag_x_total X.\n# TYPE rag_x_total counter\nrag_x_total{model="a"} 3\nrag_x_total{model="b"} 1.5\n'
+              '# HELP rag_y_seconds Y.\n# TYPE rag_y_seconds histogram\nrag_y_seconds_bucket{le="+Inf"} 4\n'
+              'rag_y_seconds_sum 0.25\nrag_y_seconds_count 4\n')
+
+    assert merge_metrics(worker, server) == (
+        '# HELP rag_x_total X.\n# TYPE rag_x_total counter\nrag_x_total{model="a"} 5\nrag_x_total{model="b"} 1.5\n'
+        '# HELP rag_y_seconds Y.\n# TYPE rag_y_seconds histogram\nrag_y_seconds_bucket{le="+Inf"} 4\n'
+        'rag_y_seconds_sum 0.25\nrag_y_seconds_count 4\n'
+    )
@@ -0,0 +1,161 @@
+import asyncio
+import pytest
+from utils import scheduler as scheduler_module
+from utils.scheduler import GenerationScheduler, GenerationRejected, _worker_share
+
+
+class _FakeOllama:
+    """Streams each prompt's words once its gate is opened."""
+
+    def __init__(self):
+        self.gates = {}
+        self.started = []
+        self.cancelled = []
+
+    def gate(self, prompt: str) -> asyncio.Event:
+        return self.gates.setdefault(prompt, asyncio.Event())
+
+    async def stream(self, model, prompt):
+        self.started.append(prompt)
+        try:
+            await self.gate(prompt).wait()
+            for word in prompt.split():
+                yield word
+        except asyncio.CancelledError:
+            self.cancelled.append(prompt)
+            raise
+
+
+@pytest.fixture
+def ollama(monkeypatch):
+    fake = _FakeOllama()
+    monkeypatch.setattr(scheduler_module, "async_ollama_response_stream", fake.stream)
+    return fake
+
+
+async def _settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+async def _collect(generation) -> list:
+    return [value async for kind, value in generation if kind == "chunk"]
+
+
+def _start(scheduler, prompt, **kwargs) -> asyncio.Task:
+    return asyncio.get_running_loop().create_task(_collect(scheduler.stream("llama3", prompt, **kwargs)))
+
+
+def test_disconnect_before_the_generation_starts_frees_its_slot(ollama):
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, queue_timeout=0)
+        first = _start(scheduler, "first")
+        await _settle()
+        second = _start(scheduler, "second")
+        await _settle()
+        assert scheduler.stats()["llama3"]["queued"] == 1
+
+        # The first generation finishing dispatches the second in the same
+        # step that the second's client disconnects
+        ollama.gate("first").set()
+        second.cancel()
+        assert await first == ["first"]
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        await _settle()
+        assert "second" not in ollama.started
+        assert scheduler.stats()["llama3"]["running"] == 0
+
+        ollama.gate("third").set()
+        assert await asyncio.wait_for(_start(scheduler, "third"), 1) == ["third"]
+
+    asyncio.run(scenario())
+
+
+def test_clients_are_interleaved_and_priorities_jump_the_queue(ollama):
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, queue_timeout=0)
+        tasks = [_start(scheduler, "hold", client="x")]
+        await _settle()
+        for prompt in ("a1", "a2", "a3"):
+            tasks.append(_start(scheduler, prompt, client="a"))
+        tasks.append(_start(scheduler, "b1", client="b"))
+        tasks.append(_start(scheduler, "urgent", priority="high", client="c"))
+        await _settle()
+
+        for prompt in ("hold", "urgent", "a1", "b1", "a2", "a3"):
+            assert ollama.started[-1] == prompt
+            ollama.gate(prompt).set()
+            await _settle()
+        await asyncio.gather(*tasks)
+        assert ollama.started == ["hold", "urgent", "a1", "b1", "a2", "a3"]
+
+    asyncio.run(scenario())
+
+
+def test_requests_queued_past_their_deadline_are_rejected(ollama):
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, queue_timeout=0.05)
+        running = _start(scheduler, "hold")
+        await _settle()
+        with pytest.raises(GenerationRejected) as rejected:
+            await asyncio.wait_for(_start(scheduler, "late"), 1)
+        assert rejected.value.retry_after >= 1
+        assert scheduler.stats()["llama3"]["queued"] == 0
+        ollama.gate("hold").set()
+        await running
+        assert "late" not in ollama.started
+
+    asyncio.run(scenario())
+
+
+def test_identical_prompts_share_one_generation(ollama):
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, queue_timeout=0)
+        first = _start(scheduler, "same prompt")
+        await _settle()
+        second = _start(scheduler, "same prompt")
+        await _settle()
+        ollama.gate("same prompt").set()
+        assert await first == await second == ["same", "prompt"]
+        assert ollama.started == ["same prompt"]
+
+        # Aborted upstream only once the last subscriber leaves
+        first, second = _start(scheduler, "left alone"), _start(scheduler, "left alone")
+        await _settle()
+        first.cancel()
+        await _settle()
+        assert ollama.cancelled == []
+        second.cancel()
+        await _settle()
+        assert ollama.cancelled == ["left alone"]
+        assert scheduler.stats()["llama3"]["running"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_low_priority_generations_do_not_fill_the_interactive_queue(ollama):
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, max_queue=2, queue_timeout=0)
+        tasks = [_start(scheduler, "hold")]
+        await _settle()
+        tasks += [_start(scheduler, f"batch {index}", priority="low", client="batch") for index in range(5)]
+        await _settle()
+        scheduler.admit("llama3")
+
+        tasks += [_start(scheduler, "chat 1"), _start(scheduler, "chat 2")]
+        await _settle()
+        with pytest.raises(GenerationRejected):
+            scheduler.admit("llama3")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+def test_limits_are_split_between_api_workers():
+    assert _worker_share(8, workers=4) == 2
+    assert _worker_share(2, workers=4) == 1
+    assert _worker_share(0, workers=4) == 0
+    assert _worker_share(64, workers=1) == 64
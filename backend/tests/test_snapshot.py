@@ -0,0 +1,124 @@
+import json
+import os
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from utils import snapshot
+from utils.embedding_backends import read_fingerprint, write_fingerprint, EmbeddingMismatchError
+from utils.lexical_index import get_lexical_index
+from utils.manifest import MANIFEST_FILENAME, read_generation
+from utils.vector_index import get_vector_index
+from conftest import FakeCollection, FakeEmbeddingModel
+
+FINGERPRINT = {"model": "all-MiniLM-L6-v2", "backend": "torch", "precision": "fp32", "dimension": 16}
+
+
+@pytest.fixture
+def chroma(monkeypatch):
+    """Fake Chroma clients keyed by path; a client creates its directory like
+    `PersistentClient` does."""
+    collections = {}
+
+    def get_client(path):
+        os.makedirs(path, exist_ok=True)
+        return SimpleNamespace(path=os.path.abspath(path), get_max_batch_size=lambda: 7)
+
+    monkeypatch.setattr(snapshot, "get_chroma_client", get_client)
+    monkeypatch.setattr(snapshot, "get_chroma_collection",
+                        lambda client, name: collections.setdefault((client.path, name), FakeCollection(name)))
+    monkeypatch.setattr(snapshot, "drop_chroma_client", lambda path: None)
+    return lambda collection_dir, name: collections[(os.path.abspath(os.path.join(collection_dir, "chromadb")), name)]
+
+
+@pytest.fixture
+def source(tmp_path, chroma):
+    collection_dir = str(tmp_path / "collections" / "docs")
+    client = snapshot.get_chroma_client(os.path.join(collection_dir, "chromadb"))
+    collection = snapshot.get_chroma_collection(client, "docs")
+    model = FakeEmbeddingModel()
+    texts = [f"paragraph {index} about topic {index % 5}" for index in range(23)]
+    collection.upsert(
+        [f"id{index}" for index in range(23)],
+        model.encode(texts),
+        texts,
+        [{"source": f"file{index % 3}.txt", "collection": "docs"} for index in range(23)],
+    )
+    write_fingerprint(collection_dir, FINGERPRINT)
+    with open(os.path.join(collection_dir, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+        json.dump({"version": 2, "files": {}}, f)
+    return collection_dir, collection, model
+
+
+def test_export_and_import_round_trip_through_a_tar(tmp_path, chroma, source):
+    collection_dir, original, model = source
+    snapshot_dir, tar_path = str(tmp_path / "snap"), str(tmp_path / "snap.tar")
+    header = snapshot.export_collection("docs", collection_dir, snapshot_dir, page_size=5)
+    assert (header["count"], header["dimensions"], header["embedding"]) == (23, 16, FINGERPRINT)
+    snapshot.write_tar(snapshot_dir, tar_path)
+    extracted = str(tmp_path / "extracted")
+    snapshot.extract_tar(tar_path, extracted)
+
+    copy_dir = str(tmp_path / "collections" / "copy")
+    result = snapshot.import_collection("copy", copy_dir, extracted)
+
+    assert (result["collection"], result["source_collection"]) == ("copy", "docs")
+    copy = chroma(copy_dir, "copy")
+    assert sorted(copy.rows) == sorted(original.rows)
+    for chunk_id, (embedding, document, metadata) in original.rows.items():
+        copied_embedding, copied_document, copied_metadata = copy.rows[chunk_id]
+        np.testing.assert_array_equal(copied_embedding, embedding)
+        assert copied_document == document
+        assert copied_metadata == {**metadata, "collection": "copy"}
+    assert read_fingerprint(copy_dir) == FINGERPRINT
+    assert os.path.exists(os.path.join(copy_dir, MANIFEST_FILENAME))
+
+    # Both indexes are built from the same pass
+    index = get_vector_index(copy_dir)
+    assert index.usable(read_generation(copy_dir))
+    assert index.search(model.vector("paragraph 4 about topic 4"), 1)[0][0] == "paragraph 4 about topic 4"
+    lexical_hits = get_lexical_index(copy_dir).search("paragraph 12", 1)
+    assert lexical_hits[0][0] == "id12"
+
+
+def test_float16_snapshots_keep_vectors_close(tmp_path, chroma, source):
+    collection_dir, original, _ = source
+    snapshot_dir = str(tmp_path / "snap")
+    snapshot.export_collection("docs", collection_dir, snapshot_dir, dtype="float16")
+    assert np.load(os.path.join(snapshot_dir, snapshot.EMBEDDINGS_FILENAME)).dtype == np.float16
+
+    copy_dir = str(tmp_path / "collections" / "copy")
+    snapshot.import_collection("copy", copy_dir, snapshot_dir)
+    copy = chroma(copy_dir, "copy")
+    for chunk_id, (embedding, _, _) in original.rows.items():
+        np.testing.assert_allclose(copy.rows[chunk_id][0], embedding, atol=1e-3)
+
+
+def test_import_refuses_other_models_and_existing_collections(tmp_path, chroma, source):
+    collection_dir, _, _ = source
+    snapshot_dir = str(tmp_path / "snap")
+    snapshot.export_collection("docs", collection_dir, snapshot_dir)
+
+    with pytest.raises(FileExistsError):
+        snapshot.import_collection("docs", collection_dir, snapshot_dir)
+
+    header_path = os.path.join(snapshot_dir, snapshot.HEADER_FILENAME)
+    with open(header_path, "r", encoding="utf-8") as f:
+        header = json.load(f)
+    header["embedding"] = dict(FINGERPRINT, model="BAAI/bge-small-en-v1.5")
+    with open(header_path, "w", encoding="utf-8") as f:
+        json.dump(header, f)
+    with pytest.raises(EmbeddingMismatchError):
+        snapshot.import_collection("copy", str(tmp_path / "collections" / "copy"), snapshot_dir)
+
+
+def test_a_failed_import_removes_what_it_wrote(tmp_path, chroma, source):
+    collection_dir, _, _ = source
+    snapshot_dir = str(tmp_path / "snap")
+    snapshot.export_collection("docs", collection_dir, snapshot_dir)
+    with open(os.path.join(snapshot_dir, snapshot.CHUNKS_FILENAME), "a", encoding="utf-8") as f:
+        f.write(json.dumps({"id": "extra", "document": "extra", "metadata": {}}) + "\n")
+
+    copy_dir = str(tmp_path / "collections" / "copy")
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.import_collection("copy", copy_dir, snapshot_dir)
+    assert not os.path.exists(copy_dir)
@@ -0,0 +1,125 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from routers import conversation
+from utils.sse_streams import ResumableStream, StreamRegistry, SSE_BUFFER_FRAMES
+
+
+def _parse(frame: str) -> tuple:
+    fields = dict(line.split(": ", 1) for line in frame.strip().split("\n"))
+    return int(fields["id"]) if "id" in fields else None, json.loads(fields["data"])
+
+
+async def _drain(subscription) -> list:
+    return [_parse(frame) async for frame in subscription]
+
+
+def test_writes_are_coalesced_by_time_and_size():
+    async def scenario():
+        stream = ResumableStream("s", flush_interval=0.02, flush_chars=10)
+        stream.write("ab")
+        stream.write("cd")
+        assert stream.next_id == 0
+        await asyncio.sleep(0.05)
+        stream.write("0123456789")
+        stream.send({"status": "complete"})
+        stream.close()
+        return await _drain(stream.subscribe())
+
+    assert asyncio.run(scenario()) == [
+        (0, {"chunk": "abcd", "status": "streaming"}),
+        (1, {"chunk": "0123456789", "status": "streaming"}),
+        (2, {"status": "complete"}),
+    ]
+
+
+def test_resuming_replays_only_later_frames_then_follows_live():
+    async def scenario():
+        stream = ResumableStream("s", flush_chars=1)
+        for word in ("one", "two", "three"):
+            stream.write(word)
+        resumed = asyncio.get_running_loop().create_task(_drain(stream.subscribe(last_event_id=1)))
+        await asyncio.sleep(0)
+        stream.write("four")
+        stream.close()
+        return await resumed
+
+    assert [(frame_id, payload["chunk"]) for frame_id, payload in asyncio.run(scenario())] == [(2, "three"), (3, "four")]
+
+
+def test_frames_that_left_the_buffer_cannot_be_resumed():
+    async def scenario():
+        stream = ResumableStream("s", capacity=3, flush_chars=1)
+        for index in range(5):
+            stream.write(str(index))
+        stream.close()
+        assert stream.can_resume(1) and not stream.can_resume(0) and not stream.can_resume(None)
+        # A subscriber already behind gets an error frame instead of a gap
+        return await _drain(stream.subscribe(last_event_id=0))
+
+    assert asyncio.run(scenario()) == [(None, {"status": "error", "error": "Stream fell behind its buffer", "code": 410})]
+
+
+def test_resume_endpoint_answers_410_and_404(monkeypatch):
+    async def scenario():
+        registry = StreamRegistry(resume_window=1, retention=1)
+        monkeypatch.setattr(conversation, "get_stream_registry", lambda: registry)
+
+        async def produce(stream):
+            for index in range(SSE_BUFFER_FRAMES + 2):
+                stream.send({"chunk": str(index), "status": "streaming"})
+
+        stream = registry.start(produce)
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as gone:
+            await conversation.resume_stream(stream.stream_id, SimpleNamespace(headers={"last-event-id": "0"}))
+        assert gone.value.status_code == 410
+
+        response = await conversation.resume_stream(stream.stream_id, SimpleNamespace(headers={"last-event-id": "1"}))
+        assert response.headers["x-stream-id"] == stream.stream_id
+        with pytest.raises(HTTPException) as missing:
+            await conversation.resume_stream("unknown", SimpleNamespace(headers={}))
+        assert missing.value.status_code == 404
+
+    asyncio.run(scenario())
+
+
+def test_producer_outlives_a_disconnect_until_the_resume_window_ends():
+    async def scenario():
+        registry = StreamRegistry(resume_window=0.05, retention=1)
+        release = asyncio.Event()
+
+        async def produce(stream):
+            stream.send({"chunk": "first", "status": "streaming"})
+            await release.wait()
+            stream.send({"status": "complete"})
+
+        stream = registry.start(produce)
+        follower = registry.follow(stream)
+        assert _parse(await follower.__anext__())[1]["chunk"] == "first"
+        await follower.aclose()
+
+        # Reconnecting inside the window picks up where the client left off
+        await asyncio.sleep(0.01)
+        resumed = asyncio.get_running_loop().create_task(_drain(registry.follow(stream, last_event_id=0)))
+        await asyncio.sleep(0.1)
+        assert not stream.done
+        release.set()
+        assert await resumed == [(1, {"status": "complete"})]
+
+        # Nobody comes back: the producer is cancelled
+        async def produce_forever(stream):
+            stream.send({"chunk": "first", "status": "streaming"})
+            await asyncio.Event().wait()
+
+        abandoned = registry.start(produce_forever)
+        follower = registry.follow(abandoned)
+        await follower.__anext__()
+        await follower.aclose()
+        await asyncio.sleep(0.1)
+        assert abandoned.done
+        assert _parse(abandoned.frames[-1][1])[1]["status"] == "error"
+
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from utils import vector_index
+from utils.vector_index import ExactVectorIndex
+from conftest import FakeCollection
+
+
+@pytest.fixture
+def collection():
+    rng = np.random.default_rng(7)
+    collection = FakeCollection()
+    ids = [f"chunk{row}" for row in range(300)]
+    # Unnormalized on purpose: the index normalizes rows itself
+    embeddings = rng.standard_normal((300, 24)) * rng.uniform(0.5, 3, (300, 1))
+    collection.upsert(ids, embeddings, [f"document {row}" for row in range(300)])
+    return collection, embeddings
+
+
+def _brute_force(embeddings, query, n_results):
+    matrix = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = matrix @ (query / np.linalg.norm(query))
+    order = np.argsort(-scores, kind="stable")[:n_results]
+    return [(f"document {row}", float(scores[row])) for row in order]
+
+
+@pytest.mark.parametrize("block_rows", [16384, 64, 7])
+def test_matches_brute_force_across_blocks(tmp_path, collection, monkeypatch, block_rows):
+    collection, embeddings = collection
+    monkeypatch.setattr(vector_index, "BLOCK_ROWS", block_rows)
+    index = ExactVectorIndex(str(tmp_path / "vectors"))
+    assert index.build(collection, "1", page_size=50)
+    queries = np.random.default_rng(11).standard_normal((5, 24))
+
+    for query, hits in zip(queries, index.search_many(queries, 10)):
+        expected = _brute_force(embeddings, query, 10)
+        assert [document for document, _ in hits] == [document for document, _ in expected]
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected], abs=1e-5)
+
+    [hits] = index.search_many_hits(queries[:1], 3)
+    assert [(chunk_id, document) for chunk_id, document, _ in hits] == [
+        (document.replace("document ", "chunk"), document) for document, _ in _brute_force(embeddings, queries[0], 3)
+    ]
+
+
+def test_float16_index_keeps_the_ranking(tmp_path, collection):
+    collection, embeddings = collection
+    index = ExactVectorIndex(str(tmp_path / "vectors"))
+    index.build(collection, "1", dtype="float16")
+    query = np.random.default_rng(3).standard_normal(24)
+
+    hits = index.search(query, 5)
+    expected = _brute_force(embeddings, query, 5)
+    assert [score for _, score in hits] == pytest.approx([score for _, score in expected], abs=2e-3)
+
+
+def test_only_usable_at_its_generation_and_size(tmp_path, collection):
+    collection, _ = collection
+    index = ExactVectorIndex(str(tmp_path / "vectors"))
+    assert not index.usable("1")
+
+    index.build(collection, "1")
+    assert index.usable("1") and not index.usable("2")
+    # A fresh reader picks up the published build
+    assert ExactVectorIndex(str(tmp_path / "vectors")).usable("1")
+
+    assert not index.build(collection, "2", max_vectors=100)
+    assert index.state["backend"] == "hnsw"
+    assert not index.usable("2")
@@ -0,0 +1,77 @@
+import pytest
+from utils import write_behind
+from utils.metrics import WRITE_BEHIND_FAILURES
+from utils.write_behind import WriteBehindQueue
+
+
+class FlakyStore:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+        self.rows = []
+
+    def append_many(self, messages):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise OSError("database is locked")
+        self.rows.extend(messages)
+
+
+def _count(kind, outcome):
+    return WRITE_BEHIND_FAILURES._values.get((kind, outcome), 0)
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    queues = []
+
+    def make(store, **kwargs):
+        monkeypatch.setattr(write_behind, "get_message_store", lambda: store)
+        queue = WriteBehindQueue(interval=0.01, **kwargs)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.close()
+
+
+def test_failed_messages_are_retried_in_order(queue):
+    store = FlakyStore(failures=2)
+    retried = _count("messages", "retried")
+    q = queue(store, retries=3)
+
+    q.append_message("c1", "docs", "user", "first")
+    assert q.flush(timeout=5)
+    q.append_message("c1", "docs", "assistant", "second")
+    assert q.flush(timeout=5)
+
+    assert [content for _, _, _, content in store.rows] == ["first", "second"]
+    assert _count("messages", "retried") - retried == 2
+
+
+def test_messages_are_dropped_and_counted_after_the_retries(queue):
+    store = FlakyStore(failures=100)
+    dropped = _count("messages", "dropped")
+    q = queue(store, retries=2)
+
+    q.append_message("c1", "docs", "user", "lost")
+    assert q.flush(timeout=5)
+
+    assert store.calls == 3
+    assert store.rows == []
+    assert _count("messages", "dropped") - dropped == 1
+    # The queue keeps working afterwards
+    store.failures = 0
+    q.append_message("c1", "docs", "user", "kept")
+    assert q.flush(timeout=5)
+    assert [content for _, _, _, content in store.rows] == ["kept"]
+
+
+def test_close_writes_what_is_left(queue):
+    store = FlakyStore(failures=1)
+    q = queue(store, retries=3)
+    q.append_message("c1", "docs", "user", "last words")
+    q.close()
+    assert [content for _, _, _, content in store.rows] == ["last words"]
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+from utils.manifest import read_generation
+
+ANSWER_CACHE_ENABLED = os.environ.get("RAG_ANSWER_CACHE", "0") == "1"
+SIMILARITY_THRESHOLD = float(os.environ.get("RAG_ANSWER_CACHE_THRESHOLD", 0.95))
+TTL_SECONDS = float(os.environ.get("RAG_ANSWER_CACHE_TTL", 3600))
+MAX_ENTRIES = int(os.environ.get("RAG_ANSWER_CACHE_MAX_ENTRIES", 2000))
+
+
+def fingerprint(texts: List[str]) -> str:
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+    return digest.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("key", "embedding", "answer", "created")
+
+    def __init__(self, key, embedding, answer):
+        self.key = key
+        self.embedding = embedding
+        self.answer = answer
+        self.created = time.monotonic()
+
+
+class AnswerCache:
+    """Semantic cache of generated answers.
+
+    Entries are bucketed by (searched collections with their ingestion
+    generations, model, prompt template, fingerprint of the retrieved context),
+    and a lookup is a hit when the cosine similarity between the normalized
+    query embeddings reaches `threshold`. Ingesting into any of the collections
+    changes the key, so new documents invalidate the answer. Entries expire
+    after `ttl` seconds and the least recently used are evicted beyond
+    `max_entries`.
+    """
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._buckets = {}
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(collection_dirs: List[str], model: str, template: str, context_docs: List[str]):
+        collections = tuple(
+            (path, read_generation(path)) for path in sorted({os.path.abspath(d) for d in collection_dirs})
+        )
+        template_hash = hashlib.sha256(template.encode("utf-8")).hexdigest()
+        return (collections, model, template_hash, fingerprint(context_docs))
+
+    def lookup(self, key, query_embedding) -> Optional[str]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        now = time.monotonic()
+        with self._lock:
+            best, best_score = None, -1.0
+            for entry in list(self._buckets.get(key, ())):
+                if now - entry.created > self.ttl:
+                    self._remove(entry)
+                    continue
+                score = float(np.dot(entry.embedding, query))
+                if score > best_score:
+                    best, best_score = entry, score
+            if best is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+            self._lru.move_to_end(id(best))
+            self.hits += 1
+            return best.answer
+
+    def store(self, key, query_embedding, answer: str):
+        entry = _Entry(key, np.asarray(query_embedding, dtype=np.float32), answer)
+        with self._lock:
+            self._buckets.setdefault(key, []).append(entry)
+            self._lru[id(entry)] = entry
+            while len(self._lru) > self.max_entries:
+                _, oldest = self._lru.popitem(last=False)
+                self._remove(oldest)
+
+    def _remove(self, entry: _Entry):
+        self._lru.pop(id(entry), None)
+        bucket = self._buckets.get(entry.key)
+        if bucket is not None:
+            try:
+                bucket.remove(entry)
+            except ValueError:
+                pass
+            if not bucket:
+                del self._buckets[entry.key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._lru), "hits": self.hits, "misses": self.misses}
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache()
+    return _cache
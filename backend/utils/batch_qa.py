@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import AsyncIterator, Callable, Iterable, List
+from utils.context_packer import pack_context, CONTEXT_CANDIDATES
+from utils.embedding_service import embed_queries
+from utils.rag_utils import query_collection_batch, reciprocal_rank_fusion, rank_only
+from utils.scheduler import get_generation_scheduler, GenerationRejected
+
+BATCH_CONCURRENCY = int(os.environ.get("RAG_BATCH_CONCURRENCY", 2))
+BATCH_PRIORITY = os.environ.get("RAG_BATCH_PRIORITY", "low")
+BATCH_MAX_QUESTIONS = int(os.environ.get("RAG_BATCH_MAX_QUESTIONS", 5000))
+BATCH_RETRIES = 3
+
+
+def read_questions(lines: Iterable[str], max_questions: int = BATCH_MAX_QUESTIONS) -> List[dict]:
+    """Parse JSONL questions: one `{"question": "...", "id": ...}` object per
+    line, `id` optional. Raises `ValueError` naming the offending line."""
+    questions = []
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"line {number}: {e}")
+        if not isinstance(record, dict) or not isinstance(record.get("question"), str) or not record["question"].strip():
+            raise ValueError(f'line {number}: expected an object with a non-empty "question"')
+        questions.append({"id": record.get("id", len(questions)), "question": record["question"]})
+        if len(questions) > max_questions:
+            raise ValueError(f"more than {max_questions} questions")
+    return questions
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+async def _generate(model: str, prompt: str, client: str) -> tuple:
+    """The full answer and the seconds until its first chunk (queueing
+    included), retrying when the scheduler turns the request away."""
+    for attempt in range(BATCH_RETRIES + 1):
+        chunks = []
+        first_chunk = 0.0
+        started = time.perf_counter()
+        stream = get_generation_scheduler().stream(model, prompt, BATCH_PRIORITY, client)
+        try:
+            async for kind, value in stream:
+                if kind == "chunk":
+                    if not chunks:
+                        first_chunk = time.perf_counter() - started
+                    chunks.append(value)
+            return "".join(chunks), first_chunk
+        except GenerationRejected as e:
+            if attempt == BATCH_RETRIES:
+                raise
+            await asyncio.sleep(e.retry_after)
+        finally:
+            await stream.aclose()
+
+
+async def run_batch(questions: List[dict], collection_name: str, model: str,
+                    build_prompt: Callable[[str, str], str], concurrency: int = BATCH_CONCURRENCY,
+                    n_results: int = 5, dense_weight: float = 1.0, lexical_weight: float = 1.0,
+                    client: str = "batch") -> AsyncIterator[dict]:
+    """Answer `questions` against one collection, yielding a result per question
+    as soon as it is done (so not in input order; each carries its `index`).
+
+    All questions are embedded in one batched encode and retrieved with one
+    multi-query call; generation then runs at most `concurrency` at a time,
+    capped at the model's scheduler limit, through the generation scheduler
+    at `RAG_BATCH_PRIORITY`, so interactive
+    chats keep precedence. Nothing is written to conversation history,
+    conversational memory or the answer cache.
+    """
+    if not questions:
+        return
+    texts = [question["question"] for question in questions]
+    started = time.perf_counter()
+    embeddings = await asyncio.to_thread(embed_queries, texts)
+    embedded = time.perf_counter()
+    hits = await asyncio.to_thread(query_collection_batch, collection_name, texts, embeddings, n_results)
+    retrieved = time.perf_counter()
+    batch_timings = {"embed_batch_ms": _ms(embedded - started), "retrieve_batch_ms": _ms(retrieved - embedded)}
+    # More would only queue in the scheduler, past their deadline if the batch is long
+    semaphore = asyncio.Semaphore(max(1, min(concurrency, get_generation_scheduler().limit(model))))
+
+    async def answer(index: int) -> dict:
+        question = questions[index]
+        dense, lexical = hits[index]
+        result = {"index": index, "id": question["id"], "question": question["question"]}
+        async with semaphore:
+            try:
+                chunk_ids = {doc.strip(): chunk_id for chunk_id, doc, _ in dense + lexical}
+                top_docs = reciprocal_rank_fusion(
+                    [[(doc, score) for _, doc, score in dense], rank_only([(doc, score) for _, doc, score in lexical])],
+                    k=60,
+                    top_k=CONTEXT_CANDIDATES,
+                    weights=[dense_weight, lexical_weight]
+                )
+                packed = await asyncio.to_thread(pack_context, top_docs, model)
+                generation_started = time.perf_counter()
+                answer_text, first_chunk = await _generate(model, build_prompt(packed.text, question["question"]), client)
+                finished = time.perf_counter()
+                result.update({
+                    "answer": answer_text,
+                    "doc_ids": [chunk_ids.get(doc) for doc in packed.docs],
+                    "dense_ids": [chunk_id for chunk_id, _, _ in dense],
+                    "lexical_ids": [chunk_id for chunk_id, _, _ in lexical],
+                    "context_tokens": packed.tokens,
+                    "timings": {
+                        **batch_timings,
+                        "first_chunk_ms": _ms(first_chunk),
+                        "generate_ms": _ms(finished - generation_started),
+                        "total_ms": _ms(finished - started),
+                    },
+                })
+                if answer_text.startswith("Error: "):
+                    result["error"] = answer_text[len("Error: "):]
+            except Exception as e:
+                result["error"] = str(e)
+        return result
+
+    tasks = [asyncio.create_task(answer(index)) for index in range(len(questions))]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # The consumer went away (e.g. the client disconnected): stop the rest
+        for task in tasks:
+            task.cancel()
+
+
+async def _run_cli(args):
+    from routers.conversation import generate_rag_prompt
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = read_questions(f, max_questions=sys.maxsize)
+    answered = 0
+    failed = 0
+    started = time.perf_counter()
+    with open(args.out, "w", encoding="utf-8") as out:
+        async for result in run_batch(questions, args.collection, args.model, generate_rag_prompt,
+                                      args.concurrency, args.results):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            answered += 1
+            failed += "error" in result
+    print(f"Answered {answered} questions ({failed} failed) in {time.perf_counter() - started:.1f}s -> {args.out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions against a collection")
+    parser.add_argument("questions", help='JSONL file, one {"question": ..., "id": ...} per line')
+    parser.add_argument("--collection", required=True)
+    parser.add_argument("--model", required=True, help="Ollama model")
+    parser.add_argument("--out", default="results.jsonl")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--results", type=int, default=5, help="Hits per retriever")
+    asyncio.run(_run_cli(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
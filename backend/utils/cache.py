@@ -1,28 +1,327 @@
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import lru_cache
-from sentence_transformers import SentenceTransformer
-import chromadb
+from typing import TYPE_CHECKING, Callable, Hashable, Optional
+from utils.embedding_backends import EmbeddingBackend, load_backend, EMBEDDING_BACKEND, EMBEDDING_MODEL
+from utils.metrics import RESOURCE_REQUESTS, RESOURCE_EVICTIONS
+from utils.retrieval_ipc import remote_procedure
 import os
+import threading
+
+# chromadb takes seconds to import, so it is loaded on first use (or by the
+# startup warm-up) instead of at import time; the same goes for the embedding
+# backends' torch / onnxruntime
+if TYPE_CHECKING:
+    import chromadb
+
+MAX_CHROMA_CLIENTS = int(os.environ.get("RAG_CHROMA_MAX_CLIENTS", 64))
+MAX_CHROMA_MEMORY_MB = int(os.environ.get("RAG_CHROMA_MAX_MEMORY_MB", 2048))
+MAX_CHROMA_COLLECTIONS = int(os.environ.get("RAG_CHROMA_MAX_COLLECTIONS", 512))
+CHROMA_CLOSE_GRACE = float(os.environ.get("RAG_CHROMA_CLOSE_GRACE", 30))
 
 @lru_cache(maxsize=1)
-def get_embedding_model(model_name: str = "all-MiniLM-L6-v2") -> SentenceTransformer:
-    return SentenceTransformer(model_name)
+def get_embedding_model(backend: str = EMBEDDING_BACKEND, model_name: str = EMBEDDING_MODEL) -> EmbeddingBackend:
+    return load_backend(backend, model_name)
+
+
+class _Entry:
+    __slots__ = ("value", "size", "version", "pins")
+
+    def __init__(self, value, size: int, version):
+        self.value = value
+        self.size = size
+        self.version = version
+        self.pins = 0
+
+
+class ResourceRegistry:
+    """Thread-safe LRU of open resources, bounded by count and estimated bytes.
+
+    `get(key, factory, version)` returns the cached resource, or calls
+    `factory()` to open it; the factory returns `(resource, size_bytes,
+    version)`. `version` is a cheap token describing what is on disk; when the
+    current one no longer matches the one recorded at open time the entry is
+    stale and is reopened. Each key is
+    opened by one thread at a time, without blocking lookups of other keys.
+
+    Evicted and invalidated resources are handed to `on_evict(key, resource,
+    version)` outside the lock. Entries held with `holding` are never evicted.
+    """
+
+    def __init__(self, name: str, max_entries: int, max_bytes: int = 0,
+                 on_evict: Optional[Callable[[Hashable, object, object], None]] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._opening = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, factory: Callable[[], tuple], version=None):
+        return self._get(key, factory, version, pin=False)[0]
+
+    @contextmanager
+    def holding(self, key, factory: Callable[[], tuple], version=None):
+        """`get` the resource and keep it from being evicted while the block
+        runs. The pin is taken in the same critical section that returns the
+        entry, so it cannot be evicted in between."""
+        value, entry = self._get(key, factory, version, pin=True)
+        try:
+            yield value
+        finally:
+            with self._lock:
+                entry.pins -= 1
+
+    def _hit(self, key, version, pin: bool):
+        entry = self._entries.get(key)
+        if entry is None or entry.version != version:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        RESOURCE_REQUESTS.inc(1, self.name, "hit")
+        if pin:
+            entry.pins += 1
+        return entry
+
+    def _get(self, key, factory: Callable[[], tuple], version, pin: bool) -> tuple:
+        stale = None
+        with self._lock:
+            entry = self._hit(key, version, pin)
+            if entry is not None:
+                return entry.value, entry
+            if key in self._entries:
+                stale = self._remove(key)
+                self.invalidations += 1
+            open_lock = self._opening.setdefault(key, threading.Lock())
+        self._release([stale] if stale else [])
+
+        with open_lock:
+            try:
+                with self._lock:
+                    entry = self._hit(key, version, pin)
+                    if entry is not None:
+                        return entry.value, entry
+                value, size, opened_version = factory()
+                with self._lock:
+                    self.misses += 1
+                    RESOURCE_REQUESTS.inc(1, self.name, "miss")
+                    entry = _Entry(value, size, opened_version)
+                    if pin:
+                        entry.pins += 1
+                    self._entries[key] = entry
+                    self._bytes += size
+                    evicted = self._evict(keep=key)
+            finally:
+                # Also after a failed open, so the next caller does not wait
+                # on a lock nobody will remove
+                with self._lock:
+                    if self._opening.get(key) is open_lock:
+                        del self._opening[key]
+        self._release(evicted)
+        return value, entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        return key, entry.value, entry.version
+
+    def _evict(self, keep) -> list:
+        evicted = []
+        candidates = iter(list(self._entries.items()))
+        while len(self._entries) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+            key, entry = next(candidates, (None, None))
+            if key is None:
+                break
+            if key == keep or entry.pins:
+                continue
+            evicted.append(self._remove(key))
+        self.evictions += len(evicted)
+        if evicted:
+            RESOURCE_EVICTIONS.inc(len(evicted), self.name)
+        return evicted
+
+    def _release(self, removed: list):
+        if self.on_evict is None:
+            return
+        for key, value, version in removed:
+            try:
+                self.on_evict(key, value, version)
+            except Exception as e:
+                print(f"Error releasing {self.name} resource {key}: {e}")
+
+    def invalidate(self, key) -> bool:
+        with self._lock:
+            if key not in self._entries:
+                return False
+            removed = [self._remove(key)]
+            self.invalidations += 1
+        self._release(removed)
+        return True
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        with self._lock:
+            removed = [self._remove(key) for key in list(self._entries) if predicate(key)]
+            self.invalidations += len(removed)
+        self._release(removed)
+        return len(removed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def _index_bytes(path: str) -> int:
+    """Rough resident size of a Chroma client: its HNSW segment files, which
+    are loaded into memory when a collection is first queried."""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.is_dir():
+            continue
+        for root, _, files in os.walk(entry.path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+    return total
+
 
-_chroma_clients = {}
-_chroma_collections = {}
+def _client_version(path: str):
+    """Identity of the database on disk; changes when the directory is deleted
+    or rebuilt, so a cached client never points at removed files."""
+    try:
+        return os.stat(os.path.join(path, "chroma.sqlite3")).st_ino
+    except OSError:
+        return None
 
-def get_chroma_client(path: str) -> chromadb.PersistentClient:
+
+# Evicted clients are stopped after a grace period, so queries that fetched
+# the client just before eviction can finish. Reopening the path within the
+# grace period revives the same client instead of starting a second system on
+# the same files.
+_closing = {}
+_closing_lock = threading.Lock()
+
+
+def _close_chroma_client(path: str, client, version):
+    _chroma_collections.invalidate_where(lambda key: key[0] == path)
+    if version != _client_version(path):
+        # The files were deleted or replaced: stop now, so reopening the path
+        # gets a fresh system rather than Chroma's cached one
+        _stop_chroma_client(path, client)
+        return
+    timer = threading.Timer(CHROMA_CLOSE_GRACE, _stop_chroma_client, (path, client))
+    timer.daemon = True
+    with _closing_lock:
+        _closing[path] = (client, timer, version)
+    timer.start()
+
+
+def _stop_chroma_client(path: str, client):
+    with _closing_lock:
+        if path in _closing:
+            if _closing[path][0] is not client:
+                return
+            del _closing[path]
+    try:
+        from chromadb.api.shared_system_client import SharedSystemClient
+        SharedSystemClient._identifier_to_system.pop(getattr(client, "_identifier", path), None)
+        client._system.stop()
+    except Exception as e:
+        print(f"Error closing Chroma client {path}: {e}")
+
+
+def _open_chroma_client(path: str):
+    with _closing_lock:
+        closing = _closing.pop(path, None)
+    if closing is not None:
+        client, timer, version = closing
+        timer.cancel()
+        if version == _client_version(path):
+            return client, _index_bytes(path), version
+        _stop_chroma_client(path, client)
+    import chromadb
+    os.makedirs(path, exist_ok=True)
+    client = chromadb.PersistentClient(path=path)
+    return client, _index_bytes(path), _client_version(path)
+
+
+_chroma_clients = ResourceRegistry(
+    "chroma_clients", MAX_CHROMA_CLIENTS, MAX_CHROMA_MEMORY_MB * 1024 * 1024, on_evict=_close_chroma_client
+)
+_chroma_collections = ResourceRegistry("chroma_collections", MAX_CHROMA_COLLECTIONS)
+
+
+def get_chroma_client(path: str) -> "chromadb.PersistentClient":
     abs_path = os.path.abspath(path)
-    if abs_path not in _chroma_clients:
-        os.makedirs(abs_path, exist_ok=True)
-        _chroma_clients[abs_path] = chromadb.PersistentClient(path=abs_path)
-    return _chroma_clients[abs_path]
-
-
-def get_chroma_collection(client: chromadb.PersistentClient, name: str, metadata: dict = None):
-    key = (id(client), name)
-    if key not in _chroma_collections:
-        _chroma_collections[key] = client.get_or_create_collection(
-            name=name,
-            metadata=metadata or {"hnsw:space": "cosine"}
+    return _chroma_clients.get(abs_path, lambda: _open_chroma_client(abs_path), _client_version(abs_path))
+
+
+def get_chroma_collection(client: "chromadb.PersistentClient", name: str, metadata: dict = None):
+    path = os.path.abspath(client.get_settings().persist_directory)
+    return _chroma_collections.get(
+        (path, name),
+        lambda: (client.get_or_create_collection(name=name, metadata=metadata or {"hnsw:space": "cosine"}), 0, id(client)),
+        id(client),
+    )
+
+
+def find_chroma_collection(client: "chromadb.PersistentClient", name: str):
+    """Like `get_chroma_collection`, but None for a collection that does not
+    exist instead of creating it."""
+    from chromadb.errors import NotFoundError
+    path = os.path.abspath(client.get_settings().persist_directory)
+    try:
+        return _chroma_collections.get(
+            (path, name),
+            lambda: (client.get_collection(name=name), 0, id(client)),
+            id(client),
         )
-    return _chroma_collections[key]
\ No newline at end of file
+    except NotFoundError:
+        return None
+
+
+@contextmanager
+def hold_chroma_client(path: str):
+    """Open the client at `path` and keep it from being evicted, e.g. for the
+    length of an ingestion run that holds on to it."""
+    abs_path = os.path.abspath(path)
+    with _chroma_clients.holding(abs_path, lambda: _open_chroma_client(abs_path), _client_version(abs_path)) as client:
+        yield client
+
+
+def drop_chroma_collection(path: str, name: str):
+    """Forget a cached collection handle, e.g. before the collection is deleted."""
+    _chroma_collections.invalidate((os.path.abspath(path), name))
+
+
+def drop_chroma_client(path: str):
+    """Close the client at `path` and forget its collection handles, e.g.
+    before its directory is removed or replaced."""
+    _chroma_clients.invalidate(os.path.abspath(path))
+
+
+@remote_procedure("resource_stats")
+def resource_stats() -> dict:
+    return {"chroma_clients": _chroma_clients.stats(), "chroma_collections": _chroma_collections.stats()}
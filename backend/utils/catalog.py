@@ -0,0 +1,164 @@
+import base64
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from utils.sqlite_utils import SQLiteDatabase, SQLITE_DB_PATH
+
+LEGACY_HISTORY_PATH = "./db/conversations_history.json"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(created_at: float, conversation_id: str) -> str:
+    raw = json.dumps([created_at, conversation_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(created_at), str(conversation_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+class ConversationCatalog(SQLiteDatabase):
+    """Global index of conversations backing the sidebar.
+
+    Keyed by `conversation_id`, with secondary indexes on collection, model and
+    creation time, plus a lower-cased summary column for indexed prefix search.
+    Pages are walked newest-first with an opaque (created_at, id) keyset cursor,
+    so every lookup stays O(log n) however many conversations exist.
+    """
+
+    def __init__(self, db_path=SQLITE_DB_PATH, legacy_path=LEGACY_HISTORY_PATH):
+        super().__init__(db_path)
+        self.migrate_tinydb_history(legacy_path)
+
+    def init_schema(self, conn: sqlite3.Connection):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                conversation_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                summary_lc TEXT NOT NULL,
+                model TEXT NOT NULL,
+                collection TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                date_and_time TEXT NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_created ON conversations (created_at, conversation_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_collection ON conversations (collection, created_at, conversation_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_model ON conversations (model, created_at, conversation_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_summary ON conversations (summary_lc)")
+        conn.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)")
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        return {
+            "DateAndTime": row["date_and_time"],
+            "conversation_summary": row["summary"],
+            "conversation_id": row["conversation_id"],
+            "modelName": row["model"],
+            "collectionName": row["collection"],
+        }
+
+    def create_if_absent(self, summary: str, conversation_id: str, modelName: str, collectionName: str) -> bool:
+        """Register a conversation; a no-op returning False if it already exists."""
+        now = datetime.datetime.now()
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO conversations "
+            "(conversation_id, summary, summary_lc, model, collection, created_at, date_and_time) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (conversation_id, summary, summary.lower(), modelName, collectionName,
+             now.timestamp(), now.strftime("%Y-%m-%d %H:%M:%S")),
+        )
+        return cursor.rowcount == 1
+
+    def get(self, conversation_id: str) -> Optional[dict]:
+        row = self.conn.execute(
+            "SELECT * FROM conversations WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def page(self, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, q: Optional[str] = None,
+             collection: Optional[str] = None, model: Optional[str] = None):
+        """Return `(conversations, next_cursor)`, newest first."""
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        clauses = []
+        params = []
+        if collection:
+            clauses.append("collection = ?")
+            params.append(collection)
+        if model:
+            clauses.append("model = ?")
+            params.append(model)
+        if q:
+            prefix = q.lower()
+            clauses.append("summary_lc >= ? AND summary_lc < ?")
+            params.extend([prefix, prefix + "\U0010ffff"])
+        if cursor:
+            created_at, conversation_id = decode_cursor(cursor)
+            clauses.append("(created_at, conversation_id) < (?, ?)")
+            params.extend([created_at, conversation_id])
+        query = "SELECT * FROM conversations"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY created_at DESC, conversation_id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = self.conn.execute(query, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["conversation_id"])
+        return [self._to_dict(row) for row in rows], next_cursor
+
+    def delete(self, conversation_id: str) -> bool:
+        cursor = self.conn.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+        return cursor.rowcount > 0
+
+    def migrate_tinydb_history(self, legacy_path: str):
+        """One-time import of the legacy `db/conversations_history.json` TinyDB file."""
+        with self.transaction() as conn:
+            done = conn.execute("SELECT 1 FROM migrations WHERE name = 'tinydb_history'").fetchone()
+            if done:
+                return
+            records = {}
+            if os.path.exists(legacy_path):
+                try:
+                    with open(legacy_path, "r", encoding="utf-8") as f:
+                        records = json.load(f).get("_default", {})
+                except (OSError, ValueError) as e:
+                    print(f"Skipping unreadable history file {legacy_path}: {e}")
+            for key, r in sorted(records.items(), key=lambda item: int(item[0])):
+                try:
+                    created = datetime.datetime.strptime(r["DateAndTime"], "%Y-%m-%d %H:%M:%S")
+                    # Keep insertion order for conversations created in the same second
+                    created_at = created.timestamp() + int(key) * 1e-6
+                except (KeyError, ValueError):
+                    created_at = time.time()
+                conn.execute(
+                    "INSERT OR IGNORE INTO conversations "
+                    "(conversation_id, summary, summary_lc, model, collection, created_at, date_and_time) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (r["conversation_id"], r["conversation_summary"], r["conversation_summary"].lower(),
+                     r["modelName"], r["collectionName"], created_at, r.get("DateAndTime", "")),
+                )
+            conn.execute("INSERT INTO migrations (name) VALUES ('tinydb_history')")
+
+
+_catalog: Optional[ConversationCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> ConversationCatalog:
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = ConversationCatalog()
+    return _catalog
@@ -0,0 +1,157 @@
+import math
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import List, Optional
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("RAG_CONTEXT_TOKEN_BUDGET", 1500))
+CONTEXT_CANDIDATES = int(os.environ.get("RAG_CONTEXT_CANDIDATES", 5))
+DEDUP_THRESHOLD = float(os.environ.get("RAG_CONTEXT_DEDUP_THRESHOLD", 0.8))
+TOKENIZER_NAME = os.environ.get("RAG_CONTEXT_TOKENIZER")
+SHINGLE_SIZE = 5
+DEFAULT_CHARS_PER_TOKEN = 4.0
+# Plausible range for real tokenizers; calibration never leaves it
+MIN_CHARS_PER_TOKEN = 1.5
+MAX_CHARS_PER_TOKEN = 8.0
+# A reported count below this share of the estimate is taken for a cache hit
+CACHE_HIT_FRACTION = 0.5
+
+_WORD_RE = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=1)
+def _load_tokenizer(name: str):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(name)
+
+
+class TokenCounter:
+    """Counts prompt tokens.
+
+    With `RAG_CONTEXT_TOKENIZER` set, the named Hugging Face tokenizer (the one
+    matching the Ollama model) gives exact counts. Otherwise counts are
+    estimated from a characters-per-token ratio that is calibrated per model
+    from the `prompt_eval_count` Ollama reports after every generation.
+
+    Ollama only counts the prompt tokens it had to evaluate, so a prompt whose
+    prefix was still in the KV cache reports far fewer. Those samples would
+    push the ratio up and make the budget under-count, so reports well below
+    the current estimate are ignored and the ratio is clamped.
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = TOKENIZER_NAME):
+        self.tokenizer_name = tokenizer_name
+        self._ratios = {}
+        self._lock = threading.Lock()
+
+    def _tokenizer(self):
+        if not self.tokenizer_name:
+            return None
+        try:
+            return _load_tokenizer(self.tokenizer_name)
+        except Exception as e:
+            print(f"Error loading tokenizer {self.tokenizer_name}, estimating token counts instead: {e}")
+            self.tokenizer_name = None
+            return None
+
+    def count(self, text: str, model: Optional[str] = None) -> int:
+        if not text:
+            return 0
+        tokenizer = self._tokenizer()
+        if tokenizer is not None:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        with self._lock:
+            ratio = self._ratios.get(model, DEFAULT_CHARS_PER_TOKEN)
+        return math.ceil(len(text) / ratio)
+
+    def observe(self, model: str, prompt: str, prompt_tokens: int):
+        """Refine the model's ratio from a prompt whose real token count is known."""
+        if not prompt or not prompt_tokens:
+            return
+        with self._lock:
+            previous = self._ratios.get(model)
+            estimate = len(prompt) / (previous or DEFAULT_CHARS_PER_TOKEN)
+            if prompt_tokens < estimate * CACHE_HIT_FRACTION:
+                return
+            ratio = min(MAX_CHARS_PER_TOKEN, max(MIN_CHARS_PER_TOKEN, len(prompt) / prompt_tokens))
+            self._ratios[model] = ratio if previous is None else 0.8 * previous + 0.2 * ratio
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> frozenset:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return frozenset([tuple(words)]) if words else frozenset()
+    return frozenset(tuple(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def overlap(a: frozenset, b: frozenset) -> float:
+    """Share of the smaller shingle set found in the other one, so a chunk that
+    is quoted inside a longer one counts as a duplicate of it."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+class PackedContext:
+    def __init__(self, docs: List[str], tokens: int, tokens_before: int, duplicates: int, over_budget: int):
+        self.docs = docs
+        self.text = "\n".join(docs)
+        self.tokens = tokens
+        self.tokens_before = tokens_before
+        self.tokens_saved = max(0, tokens_before - tokens)
+        self.duplicates = duplicates
+        self.over_budget = over_budget
+
+    def headers(self) -> dict:
+        return {
+            "X-Context-Tokens": str(self.tokens),
+            "X-Context-Tokens-Saved": str(self.tokens_saved),
+        }
+
+
+def pack_context(docs: List[str], model: Optional[str] = None, budget: int = CONTEXT_TOKEN_BUDGET,
+                 dedup_threshold: float = DEDUP_THRESHOLD, counter: Optional["TokenCounter"] = None) -> PackedContext:
+    """Fit ranked chunks into a token budget.
+
+    `docs` is in rank order. Near-duplicates of a higher-ranked chunk are
+    dropped, then chunks are taken greedily by rank while they fit; a chunk
+    too large for the remaining budget is skipped so smaller, lower-ranked ones
+    can still fill it.
+    """
+    counter = counter or get_token_counter()
+    tokens_before = counter.count("\n".join(docs), model)
+    kept = []
+    kept_shingles = []
+    used = 0
+    duplicates = 0
+    over_budget = 0
+    for doc in docs:
+        doc = doc.strip()
+        if not doc:
+            continue
+        doc_shingles = shingles(doc)
+        if any(overlap(doc_shingles, other) >= dedup_threshold for other in kept_shingles):
+            duplicates += 1
+            continue
+        tokens = counter.count(doc, model) + (1 if kept else 0)
+        if used + tokens > budget:
+            over_budget += 1
+            continue
+        kept.append(doc)
+        kept_shingles.append(doc_shingles)
+        used += tokens
+    return PackedContext(kept, used, tokens_before, duplicates, over_budget)
+
+
+_counter: Optional[TokenCounter] = None
+_counter_lock = threading.Lock()
+
+
+def get_token_counter() -> TokenCounter:
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                _counter = TokenCounter()
+    return _counter
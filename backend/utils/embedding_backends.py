@@ -0,0 +1,244 @@
+import json
+import os
+import platform
+import threading
+from typing import Callable, Dict, List, Optional
+
+EMBEDDING_MODEL = os.environ.get("RAG_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_BACKEND = os.environ.get("RAG_EMBEDDING_BACKEND", "torch")
+EMBEDDING_THREADS = int(os.environ.get("RAG_EMBEDDING_THREADS", 0))
+ONNX_FILE_NAME = os.environ.get("RAG_EMBEDDING_ONNX_FILE")
+ONNX_EXPORT_DIR = os.environ.get("RAG_EMBEDDING_ONNX_DIR", "./db/onnx")
+FINGERPRINT_FILENAME = "embedding.json"
+
+# Collections ingested before fingerprints existed were all built with this
+LEGACY_FINGERPRINT = {"model": "all-MiniLM-L6-v2", "backend": "torch", "precision": "fp32"}
+
+
+class EmbeddingMismatchError(ValueError):
+    """A collection was built with a different embedding model or precision."""
+
+
+def hf_model_id(model_name: str) -> str:
+    """Hub id of a sentence-transformers model, e.g. for loading its tokenizer."""
+    if "/" in model_name or os.path.isdir(model_name):
+        return model_name
+    return f"sentence-transformers/{model_name}"
+
+
+class EmbeddingBackend:
+    """A loaded embedding model.
+
+    Every backend exposes the SentenceTransformer-style `encode(texts,
+    batch_size=..., normalize_embeddings=...)` used throughout the codebase.
+    `precision` identifies the vector space: backends with the same model and
+    precision produce interchangeable vectors, so a collection built with one
+    can be queried with the other.
+    """
+
+    name = "base"
+    precision = "fp32"
+
+    def __init__(self, model_name: str, threads: int = 0):
+        self.model_name = model_name
+        self.threads = threads
+        self.model = self.load()
+
+    def load(self):
+        raise NotImplementedError
+
+    def encode(self, texts, batch_size: int = 32, normalize_embeddings: bool = True, **kwargs):
+        return self.model.encode(texts, batch_size=batch_size, normalize_embeddings=normalize_embeddings, **kwargs)
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def fingerprint(self) -> dict:
+        return {"model": self.model_name, "backend": self.name, "precision": self.precision, "dimension": self.dimension}
+
+
+class TorchBackend(EmbeddingBackend):
+    name = "torch"
+
+    def load(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        return SentenceTransformer(self.model_name)
+
+
+class OnnxBackend(EmbeddingBackend):
+    """ONNX Runtime on CPU through sentence-transformers' `backend="onnx"`."""
+
+    name = "onnx"
+
+    def _model_kwargs(self, file_name: Optional[str] = None) -> dict:
+        kwargs = {"provider": "CPUExecutionProvider"}
+        if file_name:
+            kwargs["file_name"] = file_name
+        if self.threads:
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+            kwargs["session_options"] = options
+        return kwargs
+
+    def _require_onnx(self):
+        try:
+            import onnxruntime  # noqa: F401
+            import optimum.onnxruntime  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                f"The {self.name} embedding backend needs onnxruntime and optimum; install the backend's "
+                "`onnx` extra (`uv sync --extra onnx` or `pip install '.[onnx]'`)"
+            ) from e
+
+    def load(self):
+        self._require_onnx()
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.model_name, backend="onnx", model_kwargs=self._model_kwargs(ONNX_FILE_NAME))
+
+
+def _quantization_target() -> str:
+    """Pick the dynamic int8 variant matching this CPU's instruction set."""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    flags = ""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            flags = f.read()
+    except OSError:
+        pass
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+
+class OnnxInt8Backend(OnnxBackend):
+    """Dynamically quantized int8 ONNX model.
+
+    Uses the pre-quantized file published with the model when there is one
+    (`onnx/model_qint8_<target>.onnx`, or `model_quint8_avx2.onnx`), and
+    otherwise quantizes the ONNX export once into `RAG_EMBEDDING_ONNX_DIR`.
+    """
+
+    name = "onnx-int8"
+    precision = "int8"
+
+    def load(self):
+        self._require_onnx()
+        from sentence_transformers import SentenceTransformer
+        target = _quantization_target()
+        file_name = ONNX_FILE_NAME or (
+            "onnx/model_quint8_avx2.onnx" if target == "avx2" else f"onnx/model_qint8_{target}.onnx"
+        )
+        try:
+            return SentenceTransformer(self.model_name, backend="onnx", model_kwargs=self._model_kwargs(file_name))
+        except Exception as e:
+            print(f"No published {file_name} for {self.model_name} ({e}); quantizing locally")
+        return self._quantize_locally(target)
+
+    def _quantize_locally(self, target: str):
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+        local_dir = os.path.join(ONNX_EXPORT_DIR, self.model_name.replace("/", "__"))
+        file_name = f"onnx/model_qint8_{target}.onnx"
+        if not os.path.exists(os.path.join(local_dir, file_name)):
+            model = SentenceTransformer(self.model_name, backend="onnx", model_kwargs=self._model_kwargs())
+            model.save_pretrained(local_dir)
+            export_dynamic_quantized_onnx_model(model, target, local_dir, file_suffix=f"qint8_{target}")
+        return SentenceTransformer(local_dir, backend="onnx", model_kwargs=self._model_kwargs(file_name))
+
+
+_backends: Dict[str, Callable[..., EmbeddingBackend]] = {
+    "torch": TorchBackend,
+    "onnx": OnnxBackend,
+    "onnx-int8": OnnxInt8Backend,
+}
+
+
+def register_backend(name: str, factory: Callable[..., EmbeddingBackend]):
+    _backends[name] = factory
+
+
+def available_backends() -> List[str]:
+    return sorted(_backends)
+
+
+def load_backend(name: str = EMBEDDING_BACKEND, model_name: str = EMBEDDING_MODEL,
+                 threads: int = EMBEDDING_THREADS) -> EmbeddingBackend:
+    factory = _backends.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown embedding backend {name!r}; choose one of {', '.join(available_backends())}")
+    return factory(model_name, threads)
+
+
+def configured_fingerprint() -> dict:
+    """Fingerprint of the configured backend, known without loading it."""
+    factory = _backends.get(EMBEDDING_BACKEND, EmbeddingBackend)
+    return {"model": EMBEDDING_MODEL, "backend": EMBEDDING_BACKEND, "precision": factory.precision}
+
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def read_fingerprint(collection_dir: str) -> Optional[dict]:
+    path = os.path.join(collection_dir, FINGERPRINT_FILENAME)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _fingerprints_lock:
+        cached = _fingerprints.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        fingerprint = json.load(f)
+    with _fingerprints_lock:
+        _fingerprints[path] = (mtime, fingerprint)
+    return fingerprint
+
+
+def write_fingerprint(collection_dir: str, fingerprint: dict):
+    os.makedirs(collection_dir, exist_ok=True)
+    path = os.path.join(collection_dir, FINGERPRINT_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(fingerprint, f)
+    os.replace(tmp_path, path)
+
+
+def same_vector_space(stored: dict, current: dict) -> bool:
+    """True if vectors of the two fingerprints can be compared. Model names are
+    compared by hub id, so `all-MiniLM-L6-v2` and
+    `sentence-transformers/all-MiniLM-L6-v2` are the same model."""
+    return (hf_model_id(stored.get("model") or "") == hf_model_id(current.get("model") or "")
+            and stored.get("precision") == current.get("precision"))
+
+
+def check_compatible(collection_dir: str, current: Optional[dict] = None, store: str = "chromadb") -> dict:
+    """Raise `EmbeddingMismatchError` unless vectors from the current backend
+    can be compared with the collection's; returns the collection fingerprint.
+
+    A directory without a fingerprint whose `store` (the Chroma data under it)
+    already exists predates fingerprints and is checked against
+    `LEGACY_FINGERPRINT`.
+    """
+    current = current or configured_fingerprint()
+    stored = read_fingerprint(collection_dir)
+    if stored is None:
+        if not os.path.exists(os.path.join(collection_dir, store)):
+            return current
+        stored = LEGACY_FINGERPRINT
+    if not same_vector_space(stored, current):
+        raise EmbeddingMismatchError(
+            f"Collection was built with {stored.get('model')} ({stored.get('backend')}, {stored.get('precision')}) "
+            f"but the server embeds with {current.get('model')} ({current.get('backend')}, {current.get('precision')}); "
+            "re-ingest the collection or change RAG_EMBEDDING_MODEL/RAG_EMBEDDING_BACKEND"
+        )
+    return stored
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional
+from utils.cache import get_embedding_model
+from utils.retrieval_ipc import remote_procedure, is_remote
+
+
+class QueryEmbeddingService:
+    """Coalesces query texts from concurrent requests into micro-batched encodes.
+
+    Callers submit a text and get back a Future. A single worker thread waits up
+    to `batch_window` seconds for more texts to arrive, drops duplicates, encodes
+    the unique texts in one call and resolves every waiting Future. Recent query
+    vectors are kept in an LRU cache so repeated questions skip the model.
+    """
+
+    def __init__(self, batch_window: float = 0.005, max_batch_size: int = 64, cache_size: int = 1024):
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._worker = None
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="query-embedding", daemon=True)
+            self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        with self._lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                future = Future()
+                future.set_result(cached)
+                return future
+            waiters = self._pending.get(text)
+            if waiters is None:
+                waiters = self._pending[text] = []
+            future = Future()
+            waiters.append(future)
+            self._ensure_worker()
+            self._wakeup.notify()
+            return future
+
+    def embed(self, text: str):
+        return self.submit(text).result()
+
+    async def aembed(self, text: str):
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _take_batch(self) -> "OrderedDict[str, List[Future]]":
+        with self._lock:
+            while not self._pending:
+                self._wakeup.wait()
+            deadline = time.monotonic() + self.batch_window
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._wakeup.wait(remaining)
+            batch = OrderedDict()
+            while self._pending and len(batch) < self.max_batch_size:
+                text, waiters = self._pending.popitem(last=False)
+                batch[text] = waiters
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            texts = list(batch.keys())
+            try:
+                vectors = get_embedding_model().encode(texts, normalize_embeddings=True)
+            except Exception as e:
+                for waiters in batch.values():
+                    for future in waiters:
+                        future.set_exception(e)
+                continue
+            with self._lock:
+                for text, vector in zip(texts, vectors):
+                    self._cache[text] = vector
+                    self._cache.move_to_end(text)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            for text, vector in zip(texts, vectors):
+                for future in batch[text]:
+                    future.set_result(vector)
+
+
+_service: Optional[QueryEmbeddingService] = None
+_service_lock = threading.Lock()
+
+
+def get_query_embedding_service() -> QueryEmbeddingService:
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = QueryEmbeddingService()
+    return _service
+
+
+@remote_procedure("embed_query")
+def embed_query(text: str):
+    return get_query_embedding_service().embed(text)
+
+
+@remote_procedure("embed_queries")
+def embed_queries(texts: List[str], batch_size: int = 64):
+    """Encode many queries in one batched call, bypassing the micro-batcher
+    and its cache; for offline batches that already have all their texts."""
+    return get_embedding_model().encode(list(texts), batch_size=batch_size, normalize_embeddings=True)
+
+
+async def aembed_query(text: str):
+    if is_remote():
+        return await asyncio.to_thread(embed_query, text)
+    return await get_query_embedding_service().aembed(text)
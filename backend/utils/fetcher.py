@@ -0,0 +1,242 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Optional
+from urllib.parse import urlsplit
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+CACHE_DIR = "./db/url_cache"
+MAX_CONNECTIONS = int(os.environ.get("RAG_FETCH_MAX_CONNECTIONS", 32))
+PER_HOST_LIMIT = int(os.environ.get("RAG_FETCH_PER_HOST", 4))
+MAX_BYTES = int(os.environ.get("RAG_FETCH_MAX_BYTES", 50 * 1024 * 1024))
+TIMEOUT = float(os.environ.get("RAG_FETCH_TIMEOUT", 30))
+RETRIES = int(os.environ.get("RAG_FETCH_RETRIES", 2))
+BACKOFF = float(os.environ.get("RAG_FETCH_BACKOFF", 0.5))
+MAX_BACKOFF = 30.0
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_EXTENSIONS = {
+    "application/pdf": ".pdf",
+    "text/markdown": ".md",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": ".pptx",
+}
+
+
+class ResponseTooLarge(Exception):
+    pass
+
+
+class Fetcher:
+    """Shared URL downloader used by ingestion jobs.
+
+    One pooled (HTTP/2 when `h2` is installed) `httpx.AsyncClient` lives on a
+    dedicated event loop thread, so jobs running in worker threads share its
+    connections. Requests are capped per host, bodies are streamed to disk with
+    a size limit, and every response is cached under `db/url_cache` together
+    with its ETag/Last-Modified validators. Re-fetching a URL sends a
+    conditional request, and a 304 reuses the cached body: the file keeps the
+    same name and content hash, so the pipeline skips it as unchanged.
+    Connection errors and 408/429/5xx responses are retried `retries` times
+    with exponential backoff, or after the response's Retry-After.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, per_host_limit=PER_HOST_LIMIT, max_bytes=MAX_BYTES,
+                 retries=RETRIES, backoff=BACKOFF):
+        self.cache_dir = cache_dir
+        self.per_host_limit = per_host_limit
+        self.max_bytes = max_bytes
+        self.retries = retries
+        self.backoff = backoff
+        os.makedirs(cache_dir, exist_ok=True)
+        self._host_semaphores = {}
+        self._cache_locks = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="url-fetcher", daemon=True)
+        self._thread.start()
+        self._client = asyncio.run_coroutine_threadsafe(self._create_client(), self._loop).result()
+
+    async def _create_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        )
+
+    def fetch_many(self, target_dir: str, url_list: list) -> list:
+        """Blocking entry point: download every URL into `target_dir` and return
+        `(filename, url)` pairs, with `(None, None)` for failures."""
+        future = asyncio.run_coroutine_threadsafe(self._fetch_many(target_dir, url_list), self._loop)
+        return future.result()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _fetch_many(self, target_dir: str, url_list: list) -> list:
+        return await asyncio.gather(*[self._fetch_into(target_dir, url) for url in url_list])
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_semaphores[host]
+
+    def _cache_paths(self, url: str):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:24]
+        return key, os.path.join(self.cache_dir, f"{key}.body"), os.path.join(self.cache_dir, f"{key}.json")
+
+    async def _fetch_into(self, target_dir: str, url: str):
+        try:
+            key, body_path, meta_path = self._cache_paths(url)
+            lock = self._cache_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                try:
+                    meta = await self._fetch_with_retries(url, body_path, meta_path)
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    # Fall back to the last good copy when the origin is unreachable
+                    meta = await asyncio.to_thread(_read_meta, meta_path)
+                    if meta is None or not os.path.exists(body_path):
+                        raise
+                    print(f"Using cached copy of {url}: {str(e)}")
+            filename = _url_filename(key, url, meta.get("content_type"))
+            await asyncio.to_thread(shutil.copyfile, body_path, os.path.join(target_dir, filename))
+            return filename, url
+        except Exception as e:
+            print(f"Failed to fetch {url}: {str(e)}")
+            return None, None
+
+    async def _fetch_with_retries(self, url: str, body_path: str, meta_path: str) -> dict:
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._fetch_cached(url, body_path, meta_path)
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if attempt == self.retries or not _retryable(e):
+                    raise
+                # Sleep outside the host semaphore, so other URLs keep going
+                await asyncio.sleep(_retry_delay(e, self.backoff * 2 ** attempt))
+
+    async def _fetch_cached(self, url: str, body_path: str, meta_path: str) -> dict:
+        meta = await asyncio.to_thread(_read_meta, meta_path)
+        headers = {}
+        if meta and os.path.exists(body_path):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        else:
+            meta = None
+
+        async with self._host_semaphore(url):
+            async with self._client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304 and meta is not None:
+                    meta["validated_at"] = _now()
+                    await asyncio.to_thread(_write_meta, meta_path, meta)
+                    return meta
+                response.raise_for_status()
+                content_length = response.headers.get("Content-Length")
+                if content_length and int(content_length) > self.max_bytes:
+                    raise ResponseTooLarge(f"{content_length} bytes exceeds limit of {self.max_bytes}")
+                tmp_path = body_path + ".part"
+                size = 0
+                digest = hashlib.sha256()
+                f = await asyncio.to_thread(open, tmp_path, "wb")
+                try:
+                    async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise ResponseTooLarge(f"body exceeds limit of {self.max_bytes} bytes")
+                        digest.update(chunk)
+                        await asyncio.to_thread(f.write, chunk)
+                except BaseException:
+                    await asyncio.to_thread(f.close)
+                    await asyncio.to_thread(_remove_quietly, tmp_path)
+                    raise
+                await asyncio.to_thread(f.close)
+                await asyncio.to_thread(os.replace, tmp_path, body_path)
+
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": response.headers.get("Content-Type", "").split(";")[0].strip().lower(),
+            "sha256": digest.hexdigest(),
+            "size": size,
+            "fetched_at": _now(),
+            "validated_at": _now(),
+        }
+        await asyncio.to_thread(_write_meta, meta_path, meta)
+        return meta
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUSES
+    return True
+
+
+def _retry_delay(error: Exception, backoff: float) -> float:
+    if isinstance(error, httpx.HTTPStatusError):
+        retry_after = error.response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+    return min(backoff, MAX_BACKOFF)
+
+
+def _now() -> str:
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _read_meta(meta_path: str) -> Optional[dict]:
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_meta(meta_path: str, meta: dict):
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _url_filename(key: str, url: str, content_type: Optional[str]) -> str:
+    """Stable per-URL file name, so the manifest recognises re-fetched pages."""
+    name = urlsplit(url).path.rstrip("/").split("/")[-1] or "page"
+    extension = _EXTENSIONS.get(content_type or "", ".html")
+    if not name.endswith(extension):
+        name += extension
+    return f"url_{key[:12]}_{name}"
+
+
+_fetcher: Optional[Fetcher] = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> Fetcher:
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = Fetcher()
+    return _fetcher
@@ -0,0 +1,359 @@
+import copy
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from utils.fetcher import get_fetcher
+from utils.pipeline import run_pipeline
+from utils.retrieval_ipc import remote_object
+from utils.sqlite_utils import SQLiteDatabase, SQLITE_DB_PATH
+
+LEGACY_JOBS_PATH = "./db/ingest_jobs.json"
+JOB_WORKERS = int(os.environ.get("RAG_INGEST_JOB_WORKERS", 1))
+JOB_HISTORY = int(os.environ.get("RAG_INGEST_JOB_HISTORY", 200))
+PROGRESS_FLUSH_INTERVAL = 1.0
+
+ACTIVE_STATUSES = ("queued", "running")
+_JOB_COLUMNS = ("job_id", "collection", "collection_dir", "staging_dir", "status", "created_at", "started_at",
+                "finished_at", "urls", "chunks_added", "chunks_per_second", "elapsed_seconds", "stats", "error")
+_JSON_COLUMNS = ("urls", "stats")
+
+
+def _now() -> str:
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class JobManager(SQLiteDatabase):
+    """Persistent queue of ingestion jobs.
+
+    Jobs live in the shared SQLite store, one row per job and one per file, so
+    they outlive the HTTP request that created them and are re-queued after a
+    restart; the pipeline is idempotent, so re-running a half-finished job
+    only redoes files that were not recorded in the manifest. Progress
+    flushes only write the job row and the files that changed since the last
+    one, and the newest `history` finished jobs are kept.
+
+    A failed job keeps its staging directory, so it can be inspected and
+    `retry`-ed; it is removed once the job completes, is cancelled, or ages
+    out of the history. A dedicated, bounded thread pool runs the jobs so
+    large ingests never occupy the default `asyncio.to_thread` executor used
+    by chat requests.
+    """
+
+    def __init__(self, db_path=SQLITE_DB_PATH, workers=JOB_WORKERS, history=JOB_HISTORY,
+                 legacy_path=LEGACY_JOBS_PATH):
+        super().__init__(db_path)
+        self.history = history
+        self._lock = threading.Lock()
+        self._live = {}
+        self._last_flush = {}
+        self._dirty = {}
+        self._cancelled = set()
+        self._stopping = False
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingest-job")
+        self.migrate_tinydb_jobs(legacy_path)
+
+    def init_schema(self, conn: sqlite3.Connection):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                job_id TEXT PRIMARY KEY,
+                collection TEXT NOT NULL,
+                collection_dir TEXT NOT NULL,
+                staging_dir TEXT,
+                status TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                urls TEXT NOT NULL,
+                chunks_added INTEGER NOT NULL DEFAULT 0,
+                chunks_per_second REAL NOT NULL DEFAULT 0,
+                elapsed_seconds REAL NOT NULL DEFAULT 0,
+                stats TEXT,
+                error TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_created ON ingest_jobs (created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_job_files (
+                job_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                PRIMARY KEY (job_id, name)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)")
+
+    def submit(self, collection_name: str, collection_dir: str, staging_dir: str, files: list, urls: list) -> dict:
+        record = {
+            "job_id": uuid.uuid4().hex,
+            "collection": collection_name,
+            "collection_dir": collection_dir,
+            "staging_dir": staging_dir,
+            "status": "queued",
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "urls": list(urls),
+            "files": {name: {"status": "pending", "chunks": 0, "error": None} for name in files},
+            "chunks_added": 0,
+            "chunks_per_second": 0.0,
+            "elapsed_seconds": 0.0,
+            "stats": None,
+            "error": None,
+        }
+        self._save(record)
+        self._executor.submit(self._run, record["job_id"])
+        return record
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            live = self._live.get(job_id)
+            if live is not None:
+                return copy.deepcopy(live)
+        records = self._load("WHERE job_id = ?", (job_id,))
+        return records[0] if records else None
+
+    def list(self, collection_name: Optional[str] = None) -> list:
+        if collection_name:
+            records = self._load("WHERE collection = ? ORDER BY created_at DESC, rowid DESC", (collection_name,))
+        else:
+            records = self._load("ORDER BY created_at DESC, rowid DESC")
+        with self._lock:
+            live = copy.deepcopy(self._live)
+        return [live.get(r["job_id"], r) for r in records]
+
+    def cancel(self, job_id: str) -> bool:
+        record = self.get(job_id)
+        if record is None or record["status"] not in ACTIVE_STATUSES:
+            return False
+        with self._lock:
+            self._cancelled.add(job_id)
+        return True
+
+    def retry(self, job_id: str) -> bool:
+        """Re-queue a failed job on the files still in its staging directory."""
+        record = self.get(job_id)
+        if record is None or record["status"] != "failed" or not os.path.isdir(record["staging_dir"] or ""):
+            return False
+        record.update({"status": "queued", "finished_at": None, "error": None})
+        for entry in record["files"].values():
+            if entry["status"] == "failed":
+                entry.update({"status": "pending", "chunks": 0, "error": None})
+        self._save(record)
+        self._executor.submit(self._run, job_id)
+        return True
+
+    def resume(self):
+        """Re-queue jobs that were queued or running when the server stopped."""
+        pending = self._load("WHERE status IN (?, ?) ORDER BY created_at, rowid", ACTIVE_STATUSES)
+        for record in pending:
+            record["status"] = "queued"
+            self._save(record)
+            self._executor.submit(self._run, record["job_id"])
+        return len(pending)
+
+    def shutdown(self):
+        """Stop dispatching new files. Interrupted jobs keep their active status
+        and are picked up again by `resume()` on the next start."""
+        self._stopping = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _load(self, where: str = "", params: tuple = ()) -> list:
+        rows = self.conn.execute(f"SELECT * FROM ingest_jobs {where}", params).fetchall()
+        records = []
+        for row in rows:
+            record = {column: row[column] for column in _JOB_COLUMNS}
+            for column in _JSON_COLUMNS:
+                record[column] = json.loads(record[column]) if record[column] is not None else None
+            record["files"] = {}
+            records.append(record)
+        if records:
+            by_id = {record["job_id"]: record for record in records}
+            placeholders = ",".join("?" * len(by_id))
+            files = self.conn.execute(
+                f"SELECT * FROM ingest_job_files WHERE job_id IN ({placeholders}) ORDER BY job_id, name", list(by_id)
+            ).fetchall()
+            for row in files:
+                by_id[row["job_id"]]["files"][row["name"]] = {
+                    "status": row["status"], "chunks": row["chunks"], "error": row["error"]
+                }
+        return records
+
+    def _save(self, record: dict, files: Optional[list] = None):
+        """Write the job row and `files` (every file if None) in one transaction."""
+        with self._lock:
+            job_row = tuple(
+                json.dumps(record[column]) if column in _JSON_COLUMNS and record[column] is not None else record[column]
+                for column in _JOB_COLUMNS
+            )
+            names = record["files"] if files is None else files
+            file_rows = [
+                (record["job_id"], name, entry["status"], entry["chunks"], entry["error"])
+                for name in names
+                for entry in [record["files"].get(name)]
+                if entry is not None
+            ]
+        columns = ", ".join(_JOB_COLUMNS)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in _JOB_COLUMNS[1:])
+        with self.transaction() as conn:
+            conn.execute(
+                f"INSERT INTO ingest_jobs ({columns}) VALUES ({', '.join('?' * len(_JOB_COLUMNS))}) "
+                f"ON CONFLICT (job_id) DO UPDATE SET {updates}",
+                job_row,
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO ingest_job_files (job_id, name, status, chunks, error) VALUES (?, ?, ?, ?, ?)",
+                file_rows,
+            )
+
+    def _trim_history(self):
+        """Forget finished jobs beyond the newest `history`, with whatever
+        staging directories failed ones kept."""
+        with self.transaction() as conn:
+            expired = conn.execute(
+                "SELECT job_id, staging_dir FROM ingest_jobs WHERE status NOT IN (?, ?) "
+                "ORDER BY created_at DESC, rowid DESC LIMIT -1 OFFSET ?",
+                (*ACTIVE_STATUSES, max(0, self.history)),
+            ).fetchall()
+            for row in expired:
+                conn.execute("DELETE FROM ingest_job_files WHERE job_id = ?", (row["job_id"],))
+                conn.execute("DELETE FROM ingest_jobs WHERE job_id = ?", (row["job_id"],))
+        for row in expired:
+            if row["staging_dir"] and os.path.exists(row["staging_dir"]):
+                shutil.rmtree(row["staging_dir"], ignore_errors=True)
+
+    def _is_cancelled(self, job_id: str) -> bool:
+        with self._lock:
+            return self._stopping or job_id in self._cancelled
+
+    def _progress(self, record: dict, started: float):
+        def report(source, status, chunks=0, error=None):
+            with self._lock:
+                entry = record["files"].setdefault(source, {"status": "pending", "chunks": 0, "error": None})
+                entry.update({"status": status, "chunks": chunks, "error": error})
+                record["chunks_added"] += chunks
+                elapsed = time.monotonic() - started
+                record["elapsed_seconds"] = round(elapsed, 2)
+                record["chunks_per_second"] = round(record["chunks_added"] / elapsed, 2) if elapsed > 0 else 0.0
+                dirty = self._dirty.setdefault(record["job_id"], set())
+                dirty.add(source)
+                now = time.monotonic()
+                flush = now - self._last_flush.get(record["job_id"], 0.0) >= PROGRESS_FLUSH_INTERVAL
+                if flush:
+                    self._last_flush[record["job_id"]] = now
+                    self._dirty[record["job_id"]] = set()
+            if flush:
+                self._save(record, sorted(dirty))
+        return report
+
+    def _run(self, job_id: str):
+        record = self.get(job_id)
+        if record is None or self._stopping:
+            return
+        if self._is_cancelled(job_id):
+            self._finish(record, "cancelled")
+            return
+        started = time.monotonic()
+        record.update({"status": "running", "started_at": _now(), "chunks_added": 0, "error": None})
+        with self._lock:
+            self._live[job_id] = record
+        self._save(record)
+
+        try:
+            staging_dir = record["staging_dir"]
+            os.makedirs(staging_dir, exist_ok=True)
+            if record["urls"]:
+                results = get_fetcher().fetch_many(staging_dir, record["urls"])
+                with self._lock:
+                    for filename, url in results:
+                        if filename and url:
+                            record["files"].setdefault(filename, {"status": "pending", "chunks": 0, "error": None})
+            stats = run_pipeline(
+                staging_dir,
+                record["collection_dir"],
+                record["collection"],
+                progress=self._progress(record, started),
+                should_cancel=lambda: self._is_cancelled(job_id),
+            )
+            record["stats"] = stats
+            if self._stopping:
+                with self._lock:
+                    self._live.pop(job_id, None)
+                self._save(record)
+                return
+            self._finish(record, "cancelled" if stats.get("cancelled") else "completed")
+        except Exception as e:
+            print(f"Ingestion job {job_id} failed: {str(e)}")
+            record["error"] = str(e)
+            self._finish(record, "failed")
+
+    def _finish(self, record: dict, status: str):
+        record["status"] = status
+        record["finished_at"] = _now()
+        staging_dir = record.get("staging_dir")
+        # A failed job keeps its files for inspection and `retry`
+        if status != "failed" and staging_dir and os.path.exists(staging_dir):
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        with self._lock:
+            self._live.pop(record["job_id"], None)
+            self._last_flush.pop(record["job_id"], None)
+            self._dirty.pop(record["job_id"], None)
+            self._cancelled.discard(record["job_id"])
+        self._save(record)
+        self._trim_history()
+
+    def migrate_tinydb_jobs(self, legacy_path: str):
+        """One-time import of the legacy `db/ingest_jobs.json` TinyDB file."""
+        with self.transaction() as conn:
+            done = conn.execute("SELECT 1 FROM migrations WHERE name = 'tinydb_jobs'").fetchone()
+            if done:
+                return
+            records = {}
+            if os.path.exists(legacy_path):
+                try:
+                    with open(legacy_path, "r", encoding="utf-8") as f:
+                        records = json.load(f).get("_default", {})
+                except (OSError, ValueError) as e:
+                    print(f"Skipping unreadable jobs file {legacy_path}: {e}")
+            columns = ", ".join(_JOB_COLUMNS)
+            for _, r in sorted(records.items(), key=lambda item: int(item[0])):
+                if not r.get("job_id"):
+                    continue
+                row = {column: r.get(column) for column in _JOB_COLUMNS}
+                row["urls"] = row["urls"] or []
+                row.update({"chunks_added": row["chunks_added"] or 0, "chunks_per_second": row["chunks_per_second"] or 0.0,
+                            "elapsed_seconds": row["elapsed_seconds"] or 0.0, "created_at": row["created_at"] or _now()})
+                conn.execute(
+                    f"INSERT OR IGNORE INTO ingest_jobs ({columns}) VALUES ({', '.join('?' * len(_JOB_COLUMNS))})",
+                    tuple(json.dumps(row[c]) if c in _JSON_COLUMNS and row[c] is not None else row[c]
+                          for c in _JOB_COLUMNS),
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO ingest_job_files (job_id, name, status, chunks, error) VALUES (?, ?, ?, ?, ?)",
+                    [(r["job_id"], name, entry.get("status", "pending"), entry.get("chunks", 0), entry.get("error"))
+                     for name, entry in (r.get("files") or {}).items()],
+                )
+            conn.execute("INSERT INTO migrations (name) VALUES ('tinydb_jobs')")
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+@remote_object("jobs", ("submit", "list", "get", "cancel", "retry"))
+def get_job_manager() -> JobManager:
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager()
+    return _manager
@@ -0,0 +1,328 @@
+import json
+import math
+import os
+import re
+import shutil
+import threading
+from collections import Counter, defaultdict
+from typing import List, Tuple
+import numpy as np
+
+INDEX_DIRNAME = "bm25"
+SEGMENTS_FILENAME = "segments.json"
+MAX_SEGMENTS = 8
+K1 = 1.2
+B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._\-/:#][a-z0-9]+)*")
+_SPLIT_RE = re.compile(r"[._\-/:#]")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased terms. Identifiers such as `ERR-404`, `v1.2.3` or `AB-12/C`
+    are kept whole and also split into their parts, so both match."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        parts = _SPLIT_RE.split(token)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p and p not in _STOPWORDS)
+    return tokens
+
+
+class _Segment:
+    """Immutable on-disk segment.
+
+    `<name>.json` holds the chunk ids and a term -> [start, count] dictionary;
+    the postings are parallel `docs` (uint32 ordinals) and `tfs` (uint16) arrays
+    plus per-document lengths, all memory-mapped from `.npy` files.
+    """
+
+    def __init__(self, index_dir: str, name: str, deleted: list):
+        self.name = name
+        with open(os.path.join(index_dir, f"{name}.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.doc_ids = meta["doc_ids"]
+        self.terms = meta["terms"]
+        self.docs = np.load(os.path.join(index_dir, f"{name}.docs.npy"), mmap_mode="r")
+        self.tfs = np.load(os.path.join(index_dir, f"{name}.tfs.npy"), mmap_mode="r")
+        self.lens = np.load(os.path.join(index_dir, f"{name}.lens.npy"), mmap_mode="r")
+        self.deleted = set(deleted)
+        self.live = np.ones(len(self.doc_ids), dtype=bool)
+        if self.deleted:
+            self.live[list(self.deleted)] = False
+
+    def postings(self, term: str):
+        entry = self.terms.get(term)
+        if entry is None:
+            return None, None
+        start, count = entry
+        return self.docs[start:start + count], self.tfs[start:start + count]
+
+    def live_documents(self):
+        """Yield `(chunk_id, term Counter, length)` for live documents; used when merging."""
+        counts = [Counter() for _ in self.doc_ids]
+        for term, (start, count) in self.terms.items():
+            for ordinal, tf in zip(self.docs[start:start + count].tolist(), self.tfs[start:start + count].tolist()):
+                if self.live[ordinal]:
+                    counts[ordinal][term] = tf
+        for ordinal, chunk_id in enumerate(self.doc_ids):
+            if self.live[ordinal]:
+                yield chunk_id, counts[ordinal], int(self.lens[ordinal])
+
+
+def _write_segment(index_dir: str, name: str, documents: list):
+    """`documents` is a list of `(chunk_id, term Counter, length)`."""
+    postings = defaultdict(list)
+    for ordinal, (_, counts, _) in enumerate(documents):
+        for term, tf in counts.items():
+            postings[term].append((ordinal, tf))
+    terms = {}
+    docs = []
+    tfs = []
+    for term in sorted(postings):
+        plist = postings[term]
+        terms[term] = [len(docs), len(plist)]
+        docs.extend(ordinal for ordinal, _ in plist)
+        tfs.extend(min(tf, 65535) for _, tf in plist)
+    np.save(os.path.join(index_dir, f"{name}.docs.npy"), np.asarray(docs, dtype=np.uint32))
+    np.save(os.path.join(index_dir, f"{name}.tfs.npy"), np.asarray(tfs, dtype=np.uint16))
+    np.save(os.path.join(index_dir, f"{name}.lens.npy"), np.asarray([length for _, _, length in documents], dtype=np.uint32))
+    with open(os.path.join(index_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+        json.dump({"doc_ids": [chunk_id for chunk_id, _, _ in documents], "terms": terms}, f, separators=(",", ":"))
+
+
+class _Snapshot:
+    def __init__(self, segments: list):
+        self.segments = segments
+        self.locations = {}
+        total_length = 0
+        self.doc_count = 0
+        for segment in segments:
+            for ordinal, chunk_id in enumerate(segment.doc_ids):
+                if segment.live[ordinal]:
+                    self.locations[chunk_id] = (segment, ordinal)
+            self.doc_count += int(segment.live.sum())
+            total_length += int(segment.lens[segment.live].sum()) if len(segment.doc_ids) else 0
+        self.avgdl = total_length / self.doc_count if self.doc_count else 0.0
+
+
+class LexicalIndex:
+    """Per-collection BM25 index stored under `collections/<name>/bm25`.
+
+    Updates are buffered with `add`/`delete` and made durable by `commit`, which
+    writes one new immutable segment and records deletions as per-segment
+    tombstones in `segments.json`; once there are more than `MAX_SEGMENTS`
+    segments they are merged into one. Readers work on an immutable snapshot
+    that is swapped atomically, so queries never block on ingestion.
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._pending_adds = {}
+        self._pending_deletes = set()
+        self._state_mtime = None
+        self._state = self._read_state()
+        self._snapshot = self._load_snapshot()
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.index_dir, SEGMENTS_FILENAME))
+
+    def _state_path(self) -> str:
+        return os.path.join(self.index_dir, SEGMENTS_FILENAME)
+
+    def _read_state(self) -> dict:
+        path = self._state_path()
+        try:
+            self._state_mtime = os.stat(path).st_mtime_ns
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            self._state_mtime = None
+            return {"version": 1, "segments": [], "next_segment": 1}
+
+    def _maybe_reload(self):
+        """Pick up commits made by another process (or a rebuilt index)."""
+        try:
+            mtime = os.stat(self._state_path()).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._state_mtime:
+            with self._lock:
+                self._state = self._read_state()
+                self._snapshot = self._load_snapshot()
+
+    def _load_snapshot(self) -> _Snapshot:
+        return _Snapshot([
+            _Segment(self.index_dir, entry["name"], entry["deleted"]) for entry in self._state["segments"]
+        ])
+
+    def add(self, ids: list, texts: list):
+        with self._lock:
+            for chunk_id, text in zip(ids, texts):
+                self._pending_deletes.add(chunk_id)
+                self._pending_adds[chunk_id] = text
+
+    def delete(self, ids: list):
+        with self._lock:
+            for chunk_id in ids:
+                self._pending_adds.pop(chunk_id, None)
+                self._pending_deletes.add(chunk_id)
+
+    def commit(self):
+        self._maybe_reload()
+        with self._lock:
+            adds, self._pending_adds = self._pending_adds, {}
+            deletes, self._pending_deletes = self._pending_deletes, set()
+        if not adds and not deletes and self.exists():
+            return
+        os.makedirs(self.index_dir, exist_ok=True)
+        state = json.loads(json.dumps(self._state))
+        snapshot = self._snapshot
+        deleted_by_segment = {entry["name"]: set(entry["deleted"]) for entry in state["segments"]}
+        for chunk_id in deletes:
+            location = snapshot.locations.get(chunk_id)
+            if location is not None:
+                segment, ordinal = location
+                deleted_by_segment[segment.name].add(ordinal)
+        for entry in state["segments"]:
+            entry["deleted"] = sorted(deleted_by_segment[entry["name"]])
+
+        if adds:
+            name = f"seg_{state['next_segment']:06d}"
+            state["next_segment"] += 1
+            documents = []
+            for chunk_id, text in adds.items():
+                tokens = tokenize(text)
+                documents.append((chunk_id, Counter(tokens), len(tokens)))
+            _write_segment(self.index_dir, name, documents)
+            state["segments"].append({"name": name, "deleted": []})
+
+        obsolete = []
+        if len(state["segments"]) > MAX_SEGMENTS:
+            state, obsolete = self._merge(state)
+        self._write_state(state)
+        self._state = state
+        self._state_mtime = os.stat(self._state_path()).st_mtime_ns
+        self._snapshot = self._load_snapshot()
+        for name in obsolete:
+            for suffix in (".json", ".docs.npy", ".tfs.npy", ".lens.npy"):
+                try:
+                    os.remove(os.path.join(self.index_dir, name + suffix))
+                except OSError:
+                    pass
+
+    def _merge(self, state: dict):
+        segments = [_Segment(self.index_dir, entry["name"], entry["deleted"]) for entry in state["segments"]]
+        documents = [doc for segment in segments for doc in segment.live_documents()]
+        name = f"seg_{state['next_segment']:06d}"
+        state["next_segment"] += 1
+        _write_segment(self.index_dir, name, documents)
+        obsolete = [segment.name for segment in segments]
+        state["segments"] = [{"name": name, "deleted": []}]
+        return state, obsolete
+
+    def _write_state(self, state: dict):
+        path = self._state_path()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @property
+    def doc_count(self) -> int:
+        return self._snapshot.doc_count
+
+    def search(self, query_text: str, n_results: int = 5) -> List[Tuple[str, float]]:
+        self._maybe_reload()
+        snapshot = self._snapshot
+        terms = list(dict.fromkeys(tokenize(query_text)))
+        if not terms or not snapshot.doc_count:
+            return []
+        n_docs = snapshot.doc_count
+        idf = {}
+        for term in terms:
+            df = 0
+            for segment in snapshot.segments:
+                docs, _ = segment.postings(term)
+                if docs is not None:
+                    df += int(segment.live[docs].sum())
+            if df:
+                idf[term] = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        if not idf:
+            return []
+
+        candidates = []
+        for segment in snapshot.segments:
+            scores = None
+            for term, term_idf in idf.items():
+                docs, tfs = segment.postings(term)
+                if docs is None:
+                    continue
+                if scores is None:
+                    scores = np.zeros(len(segment.doc_ids), dtype=np.float32)
+                tf = tfs.astype(np.float32)
+                norm = K1 * (1 - B + B * segment.lens[docs].astype(np.float32) / snapshot.avgdl)
+                scores[docs] += term_idf * tf * (K1 + 1) / (tf + norm)
+            if scores is None:
+                continue
+            scores[~segment.live] = 0
+            k = min(n_results, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            candidates.extend(
+                (float(scores[i]), segment.doc_ids[i]) for i in top if scores[i] > 0
+            )
+        candidates.sort(reverse=True)
+        return [(chunk_id, score) for score, chunk_id in candidates[:n_results]]
+
+    def rebuild(self, ids: list, texts: list):
+        """Replace the whole index with the given documents."""
+        with self._lock:
+            self._pending_adds = {}
+            self._pending_deletes = set()
+        if os.path.exists(self.index_dir):
+            shutil.rmtree(self.index_dir)
+        self._state = self._read_state()
+        self._snapshot = self._load_snapshot()
+        self.add(ids, texts)
+        self.commit()
+
+
+def build_from_collection(index: LexicalIndex, collection, page_size: int = 1000):
+    """Index every chunk already stored in a Chroma collection."""
+    ids = []
+    texts = []
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        texts.extend(page["documents"])
+        offset += len(page["ids"])
+    index.rebuild(ids, texts)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(collection_dir: str) -> LexicalIndex:
+    index_dir = os.path.abspath(os.path.join(collection_dir, INDEX_DIRNAME))
+    with _indexes_lock:
+        index = _indexes.get(index_dir)
+        if index is None:
+            index = _indexes[index_dir] = LexicalIndex(index_dir)
+        return index
+
+
+def drop_lexical_index(collection_dir: str):
+    index_dir = os.path.abspath(os.path.join(collection_dir, INDEX_DIRNAME))
+    with _indexes_lock:
+        _indexes.pop(index_dir, None)
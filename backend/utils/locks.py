@@ -0,0 +1,12 @@
+import threading
+
+_collection_locks = {}
+_collection_locks_guard = threading.Lock()
+
+
+def get_collection_lock(collection_name: str) -> threading.Lock:
+    """Serializes writers (ingestion, index builds) on one collection."""
+    with _collection_locks_guard:
+        if collection_name not in _collection_locks:
+            _collection_locks[collection_name] = threading.Lock()
+        return _collection_locks[collection_name]
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import time
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 2
+GENERATION_FILENAME = "generation"
+
+
+def file_sha256(path, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def bump_generation(collection_dir: str):
+    """Mark the collection's content as changed; caches keyed on it go stale."""
+    os.makedirs(collection_dir, exist_ok=True)
+    path = os.path.join(collection_dir, GENERATION_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp_path, path)
+
+
+def read_generation(collection_dir: str) -> str:
+    try:
+        with open(os.path.join(collection_dir, GENERATION_FILENAME), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return "0"
+
+
+def chunk_id(source: str, text: str) -> str:
+    """Deterministic Chroma id for a chunk: the same text from the same source
+    always maps to the same id, so re-ingesting it is an idempotent upsert."""
+    return hashlib.sha256(f"{source}\x00{text}".encode("utf-8")).hexdigest()[:32]
+
+
+class CollectionManifest:
+    """Per-collection record of ingested files and the chunk ids they produced.
+
+    Stored as `collections/<name>/manifest.json`:
+        {"version": 2, "files": {"<source>": {"sha256": "...", "chunk_ids": [...]}}}
+
+    A source is the file's path relative to the ingested folder, with `/`
+    separators. Version 1 manifests keyed files by basename.
+    """
+
+    def __init__(self, collection_dir: str):
+        self.path = os.path.join(collection_dir, MANIFEST_FILENAME)
+        self.files = {}
+        self.version = MANIFEST_VERSION
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.version = data.get("version", 1)
+
+    def get(self, source: str):
+        return self.files.get(source)
+
+    def is_unchanged(self, source: str, sha256: str) -> bool:
+        entry = self.files.get(source)
+        return entry is not None and entry.get("sha256") == sha256
+
+    def chunk_ids(self, source: str) -> list:
+        entry = self.files.get(source)
+        return list(entry.get("chunk_ids", [])) if entry else []
+
+    def set(self, source: str, sha256: str, chunk_ids: list):
+        self.files[source] = {"sha256": sha256, "chunk_ids": list(chunk_ids)}
+
+    def remove(self, source: str):
+        self.files.pop(source, None)
+
+    def sources(self) -> list:
+        return list(self.files.keys())
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
+        self.version = MANIFEST_VERSION
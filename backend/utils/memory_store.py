@@ -0,0 +1,319 @@
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import numpy as np
+from utils.cache import (
+    get_embedding_model, get_chroma_client, get_chroma_collection, find_chroma_collection, drop_chroma_collection
+)
+from utils.embedding_backends import check_compatible, read_fingerprint, write_fingerprint
+from utils.locks import get_collection_lock
+from utils.retrieval_ipc import remote_object
+from utils.vector_index import EXACT_MAX_VECTORS, top_k
+
+COLLECTIONS_DIR = "./collections"
+MAX_TURNS = int(os.environ.get("RAG_MEMORY_MAX_TURNS", 20))
+KEEP_RECENT_TURNS = int(os.environ.get("RAG_MEMORY_RECENT_TURNS", 8))
+TURNS_PER_SUMMARY = int(os.environ.get("RAG_MEMORY_TURNS_PER_SUMMARY", 4))
+MAX_SUMMARIES = int(os.environ.get("RAG_MEMORY_MAX_SUMMARIES", 8))
+SUMMARY_CHARS_PER_TURN = int(os.environ.get("RAG_MEMORY_SUMMARY_CHARS", 300))
+VACUUM_INTERVAL = float(os.environ.get("RAG_MEMORY_VACUUM_INTERVAL", 6 * 3600))
+CACHED_CONVERSATIONS = int(os.environ.get("RAG_MEMORY_CACHED_CONVERSATIONS", 1024))
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_UUID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def condense_turn(text: str, max_chars: int = SUMMARY_CHARS_PER_TURN) -> str:
+    """Keep the question line and the leading sentences of the answer."""
+    question, _, answer = text.strip().partition("\n")
+    question = question.strip()[:max_chars]
+    budget = max_chars - len(question)
+    kept = []
+    for sentence in _SENTENCE_RE.split(" ".join(answer.split())):
+        if not sentence or len(sentence) + 1 > budget:
+            break
+        kept.append(sentence)
+        budget -= len(sentence) + 1
+    return question + "\n" + " ".join(kept) if kept else question
+
+
+class ConversationMemory:
+    """Bounded per-conversation memory under `collections/<name>/context`.
+
+    Every turn is stored as a `turn` entry. Once a conversation holds more than
+    `max_turns` of them, the older ones (all but roughly the `keep_recent`
+    newest) are merged, `turns_per_summary` at a time, into condensed `summary`
+    entries, and only the newest `max_summaries`
+    summaries are kept, so each conversation's collection stays at a fixed size
+    however long it runs. Deleted conversations lose their collection, and
+    `vacuum` reclaims the disk space left behind.
+
+    Because a conversation is that small, `search` scores it exactly against an
+    in-memory matrix of its entries instead of querying Chroma's HNSW index.
+    The newest `cached_conversations` matrices are kept, and a conversation's
+    is dropped whenever its entries change.
+
+    Like a collection, each context store records the embedding fingerprint it
+    was written with, and is neither written to nor searched with vectors of
+    another model (`EmbeddingMismatchError`).
+    """
+
+    def __init__(self, collections_dir=COLLECTIONS_DIR, max_turns=MAX_TURNS, keep_recent=KEEP_RECENT_TURNS,
+                 turns_per_summary=TURNS_PER_SUMMARY, max_summaries=MAX_SUMMARIES,
+                 cached_conversations=CACHED_CONVERSATIONS):
+        self.collections_dir = collections_dir
+        self.max_turns = max_turns
+        self.keep_recent = min(keep_recent, max_turns)
+        self.turns_per_summary = max(1, turns_per_summary)
+        self.max_summaries = max_summaries
+        self.cached_conversations = cached_conversations
+        self._matrices = OrderedDict()
+        self._matrices_lock = threading.Lock()
+
+    def context_dir(self, collection_name: str) -> str:
+        return os.path.join(self.collections_dir, collection_name, "context")
+
+    @staticmethod
+    def _lock(collection_name: str) -> threading.Lock:
+        return get_collection_lock(f"{collection_name}/context")
+
+    @staticmethod
+    def _check_embedding(context_dir: str):
+        check_compatible(context_dir, store="chroma.sqlite3")
+
+    def add_turns(self, collection_name: str, conversation_id: str, texts: list, embeddings: list):
+        now = time.time()
+        context_dir = self.context_dir(collection_name)
+        with self._lock(collection_name):
+            self._check_embedding(context_dir)
+            if read_fingerprint(context_dir) is None:
+                write_fingerprint(context_dir, get_embedding_model().fingerprint())
+            collection = get_chroma_collection(get_chroma_client(context_dir), conversation_id)
+            collection.add(
+                ids=[str(uuid.uuid4()) for _ in texts],
+                embeddings=list(embeddings),
+                documents=list(texts),
+                metadatas=[{"kind": "turn", "created_at": now + i * 1e-6} for i in range(len(texts))]
+            )
+            self._compact(collection)
+            self._forget_matrix(collection_name, conversation_id)
+
+    def search(self, collection_name: str, conversation_id: str, query_embedding,
+               n_results: int = 5) -> List[Tuple[str, float]]:
+        """Top `n_results` `(document, cosine)` entries of a conversation's memory."""
+        key = (collection_name, conversation_id)
+        with self._matrices_lock:
+            entry = self._matrices.get(key)
+            if entry is not None:
+                self._matrices.move_to_end(key)
+        if entry is None:
+            context_dir = self.context_dir(collection_name)
+            if not os.path.exists(context_dir):
+                return []
+            # Loaded under the context lock so a concurrent write cannot be
+            # cached half-applied; it invalidates the entry after this returns
+            with self._lock(collection_name):
+                self._check_embedding(context_dir)
+                # Searching a conversation without memory must not create it
+                collection = find_chroma_collection(get_chroma_client(context_dir), conversation_id)
+                if collection is None:
+                    return []
+                if collection.count() > EXACT_MAX_VECTORS:
+                    results = collection.query(query_embeddings=[query_embedding], n_results=n_results,
+                                               include=["documents", "distances"])
+                    documents = results.get("documents", [[]])[0]
+                    distances = results.get("distances", [[]])[0]
+                    return [(doc, 1 - dist) for doc, dist in zip(documents, distances)]
+                data = collection.get(include=["embeddings", "documents"])
+                matrix = np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["ids"]), -1)
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                entry = (matrix / np.where(norms == 0, 1, norms), list(data["documents"]))
+                with self._matrices_lock:
+                    self._matrices[key] = entry
+                    while len(self._matrices) > self.cached_conversations:
+                        self._matrices.popitem(last=False)
+        matrix, documents = entry
+        if not len(documents):
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        scores = matrix @ (query / (np.linalg.norm(query) or 1))
+        return [(documents[i], float(scores[i])) for i in top_k(scores, n_results)]
+
+    def _forget_matrix(self, collection_name: str, conversation_id: str):
+        with self._matrices_lock:
+            self._matrices.pop((collection_name, conversation_id), None)
+
+    def _compact(self, collection):
+        entries = collection.get(include=["documents", "metadatas"])
+        turns = []
+        summaries = []
+        for entry_id, document, metadata in zip(entries["ids"], entries["documents"], entries["metadatas"]):
+            metadata = metadata or {}
+            target = summaries if metadata.get("kind") == "summary" else turns
+            target.append((metadata.get("created_at", 0.0), entry_id, document))
+        turns.sort(key=lambda entry: entry[0])
+        summaries.sort(key=lambda entry: entry[0])
+
+        merged = (len(turns) - self.keep_recent) // self.turns_per_summary * self.turns_per_summary
+        if len(turns) > self.max_turns and merged > 0:
+            old = turns[:merged]
+            groups = [old[i:i + self.turns_per_summary] for i in range(0, len(old), self.turns_per_summary)]
+            texts = ["\n".join(condense_turn(document) for _, _, document in group) for group in groups]
+            embeddings = get_embedding_model().encode(texts, normalize_embeddings=True)
+            new_summaries = [(group[-1][0], str(uuid.uuid4()), text) for group, text in zip(groups, texts)]
+            collection.add(
+                ids=[entry_id for _, entry_id, _ in new_summaries],
+                embeddings=list(embeddings),
+                documents=texts,
+                metadatas=[{"kind": "summary", "created_at": created_at} for created_at, _, _ in new_summaries]
+            )
+            collection.delete(ids=[entry_id for _, entry_id, _ in old])
+            summaries.extend(new_summaries)
+
+        if len(summaries) > self.max_summaries:
+            expired = summaries[:len(summaries) - self.max_summaries]
+            collection.delete(ids=[entry_id for _, entry_id, _ in expired])
+
+    def delete_conversation(self, collection_name: str, conversation_id: str) -> bool:
+        context_dir = self.context_dir(collection_name)
+        if not os.path.exists(context_dir):
+            return False
+        with self._lock(collection_name):
+            self._forget_matrix(collection_name, conversation_id)
+            client = get_chroma_client(context_dir)
+            drop_chroma_collection(context_dir, conversation_id)
+            try:
+                client.delete_collection(conversation_id)
+            except Exception:
+                return False
+        return True
+
+    def vacuum(self, is_known_conversation=None) -> dict:
+        """Drop memory of conversations that no longer exist, remove segment
+        directories Chroma left behind, and compact each context database."""
+        stats = {"collections_deleted": 0, "segments_removed": 0, "bytes_freed": 0}
+        if not os.path.isdir(self.collections_dir):
+            return stats
+        for collection_name in sorted(os.listdir(self.collections_dir)):
+            context_dir = self.context_dir(collection_name)
+            if not os.path.isdir(context_dir):
+                continue
+            with self._lock(collection_name):
+                before = _dir_size(context_dir)
+                client = get_chroma_client(context_dir)
+                if is_known_conversation is not None:
+                    for collection in client.list_collections():
+                        name = getattr(collection, "name", collection)
+                        if not is_known_conversation(name):
+                            self._forget_matrix(collection_name, name)
+                            drop_chroma_collection(context_dir, name)
+                            client.delete_collection(name)
+                            stats["collections_deleted"] += 1
+                stats["segments_removed"] += _remove_orphaned_segments(context_dir)
+                _vacuum_sqlite(os.path.join(context_dir, "chroma.sqlite3"))
+                stats["bytes_freed"] += max(0, before - _dir_size(context_dir))
+        return stats
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove_orphaned_segments(context_dir: str) -> int:
+    """Chroma keeps each vector segment in a UUID-named directory; remove the
+    ones its catalog no longer references."""
+    db_path = os.path.join(context_dir, "chroma.sqlite3")
+    if not os.path.exists(db_path):
+        return 0
+    try:
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            live = {row[0] for row in conn.execute("SELECT id FROM segments")}
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Error reading Chroma segments in {context_dir}: {e}")
+        return 0
+    removed = 0
+    for name in os.listdir(context_dir):
+        path = os.path.join(context_dir, name)
+        if _UUID_RE.match(name) and name not in live and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def _vacuum_sqlite(db_path: str):
+    if not os.path.exists(db_path):
+        return
+    try:
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Error vacuuming {db_path}: {e}")
+
+
+class _VacuumThread(threading.Thread):
+    def __init__(self, memory: ConversationMemory, is_known_conversation, interval: float):
+        super().__init__(name="memory-vacuum", daemon=True)
+        self.memory = memory
+        self.is_known_conversation = is_known_conversation
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                stats = self.memory.vacuum(self.is_known_conversation)
+                if stats["collections_deleted"] or stats["segments_removed"]:
+                    print(f"Memory vacuum: {stats}")
+            except Exception as e:
+                print(f"Error during memory vacuum: {e}")
+
+
+_memory: Optional[ConversationMemory] = None
+_memory_lock = threading.Lock()
+_vacuum_thread: Optional[_VacuumThread] = None
+
+
+@remote_object("memory", ("delete_conversation",))
+def get_conversation_memory() -> ConversationMemory:
+    global _memory
+    if _memory is None:
+        with _memory_lock:
+            if _memory is None:
+                _memory = ConversationMemory()
+    return _memory
+
+
+def start_vacuum_thread(is_known_conversation, interval: float = VACUUM_INTERVAL):
+    global _vacuum_thread
+    memory = get_conversation_memory()
+    with _memory_lock:
+        if _vacuum_thread is None and interval > 0:
+            _vacuum_thread = _VacuumThread(memory, is_known_conversation, interval)
+            _vacuum_thread.start()
+
+
+def stop_vacuum_thread():
+    global _vacuum_thread
+    with _memory_lock:
+        thread, _vacuum_thread = _vacuum_thread, None
+    if thread is not None:
+        thread.stopped.set()
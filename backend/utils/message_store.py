@@ -0,0 +1,128 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+from typing import Optional
+from utils.sqlite_utils import SQLiteDatabase, SQLITE_DB_PATH
+
+COLLECTIONS_DIR = "./collections"
+ROLES = ("user", "model")
+
+
+class MessageStore(SQLiteDatabase):
+    """Append-only store of chat messages for every conversation.
+
+    Messages live in one SQLite table indexed by (conversation_id, id), so an
+    append is a single O(1) insert regardless of conversation length, and
+    history is read in pages walking backwards from a message id.
+    """
+
+    def __init__(self, db_path=SQLITE_DB_PATH, collections_dir=COLLECTIONS_DIR):
+        super().__init__(db_path)
+        self.migrate_tinydb_conversations(collections_dir)
+
+    def init_schema(self, conn: sqlite3.Connection):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT NOT NULL,
+                collection TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)")
+
+    def append(self, conversation_id: str, collection_name: str, role: str, content: str) -> int:
+        if role not in ROLES:
+            raise ValueError(f"role must be one of {ROLES}")
+        cursor = self.conn.execute(
+            "INSERT INTO messages (conversation_id, collection, role, content) VALUES (?, ?, ?, ?)",
+            (conversation_id, collection_name, role, content),
+        )
+        return cursor.lastrowid
+
+    def append_many(self, messages: list):
+        """Insert `(conversation_id, collection_name, role, content)` rows in one transaction."""
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO messages (conversation_id, collection, role, content) VALUES (?, ?, ?, ?)",
+                messages,
+            )
+
+    def get_messages(self, conversation_id: str, before: Optional[int] = None, limit: Optional[int] = None) -> list:
+        """Messages in chronological order, as `{"id", "user"|"model"}` dicts.
+
+        Without `limit` the whole conversation is returned. With `limit`, the
+        latest `limit` messages older than `before` (a message id) are returned.
+        """
+        query = "SELECT id, role, content FROM messages WHERE conversation_id = ?"
+        params = [conversation_id]
+        if before is not None:
+            query += " AND id < ?"
+            params.append(before)
+        if limit is not None:
+            query += " ORDER BY id DESC LIMIT ?"
+            params.append(limit)
+            rows = self.conn.execute(query, params).fetchall()[::-1]
+        else:
+            rows = self.conn.execute(query + " ORDER BY id", params).fetchall()
+        return [{"id": row["id"], row["role"]: row["content"]} for row in rows]
+
+    def has_older(self, conversation_id: str, before: int) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM messages WHERE conversation_id = ? AND id < ? LIMIT 1",
+            (conversation_id, before),
+        ).fetchone()
+        return row is not None
+
+    def delete_conversation(self, conversation_id: str) -> int:
+        cursor = self.conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+        return cursor.rowcount
+
+    def migrate_tinydb_conversations(self, collections_dir: str):
+        """One-time import of the legacy `collections/<name>/db/<id>.json` TinyDB files."""
+        with self.transaction() as conn:
+            done = conn.execute("SELECT 1 FROM migrations WHERE name = 'tinydb_conversations'").fetchone()
+            if done:
+                return
+            for path in sorted(glob.glob(os.path.join(collections_dir, "*", "db", "*.json"))):
+                collection_name = os.path.basename(os.path.dirname(os.path.dirname(path)))
+                conversation_id = os.path.splitext(os.path.basename(path))[0]
+                exists = conn.execute(
+                    "SELECT 1 FROM messages WHERE conversation_id = ? LIMIT 1", (conversation_id,)
+                ).fetchone()
+                if exists:
+                    continue
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        table = json.load(f).get("_default", {})
+                except (OSError, ValueError) as e:
+                    print(f"Skipping unreadable conversation file {path}: {e}")
+                    continue
+                rows = []
+                for _, message in sorted(table.items(), key=lambda item: int(item[0])):
+                    for role in ROLES:
+                        if role in message:
+                            rows.append((conversation_id, collection_name, role, message[role]))
+                conn.executemany(
+                    "INSERT INTO messages (conversation_id, collection, role, content) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+            conn.execute("INSERT INTO migrations (name) VALUES ('tinydb_conversations')")
+
+
+_store: Optional[MessageStore] = None
+_store_lock = threading.Lock()
+
+
+def get_message_store() -> MessageStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MessageStore()
+    return _store
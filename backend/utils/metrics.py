@@ -0,0 +1,249 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+from utils.retrieval_ipc import remote_procedure
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+# Spans recorded for the current request, read by the Server-Timing middleware.
+# Threads started with asyncio.to_thread copy the context and share the list.
+_request_spans: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_spans", default=None)
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram; `observe` is a bisect and a lock."""
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                label_text = _format_labels(self.labelnames + ("le",), labels + (le,))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+_registry = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+STAGE_SECONDS = _register(Histogram(
+    "rag_stage_seconds", "Duration of request and ingestion stages.", ("stage",)
+))
+HTTP_SECONDS = _register(Histogram(
+    "rag_http_request_seconds", "Time until the response headers are sent.", ("method", "route", "status")
+))
+LLM_TTFT_SECONDS = _register(Histogram(
+    "rag_llm_time_to_first_token_seconds", "Time from the Ollama request to the first streamed token.", ("model",)
+))
+LLM_PREFILL_SECONDS = _register(Histogram(
+    "rag_llm_prefill_seconds", "Prompt evaluation time reported by Ollama.", ("model",)
+))
+LLM_TOKENS_PER_SECOND = _register(Histogram(
+    "rag_llm_tokens_per_second", "Generation speed reported by Ollama.", ("model",), RATE_BUCKETS
+))
+LLM_PROMPT_TOKENS = _register(Counter(
+    "rag_llm_prompt_tokens_total", "Prompt tokens evaluated by Ollama.", ("model",)
+))
+LLM_GENERATED_TOKENS = _register(Counter(
+    "rag_llm_generated_tokens_total", "Tokens generated by Ollama.", ("model",)
+))
+INGEST_CHUNKS = _register(Counter(
+    "rag_ingest_chunks_total", "Chunks embedded and written by ingestion.", ("collection",)
+))
+GENERATION_REJECTED = _register(Counter(
+    "rag_generation_rejected_total", "Generations rejected by the scheduler.", ("model", "reason")
+))
+GENERATION_COALESCED = _register(Counter(
+    "rag_generation_coalesced_total", "Requests that joined an identical in-flight generation.", ("model",)
+))
+WRITE_BEHIND_FAILURES = _register(Counter(
+    "rag_write_behind_failures_total", "Write-behind items whose write failed, by what happened to them.", ("kind", "outcome")
+))
+RESOURCE_REQUESTS = _register(Counter(
+    "rag_resource_requests_total", "Lookups in the open-resource registries.", ("registry", "result")
+))
+RESOURCE_EVICTIONS = _register(Counter(
+    "rag_resource_evictions_total", "Resources closed to stay within the registry limits.", ("registry",)
+))
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block as `stage`: recorded in `rag_stage_seconds` and, inside a
+    request, in its `Server-Timing` header."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def observe_generation(model: str, ttft: Optional[float], done_chunk=None):
+    """Record LLM timings; `done_chunk` is Ollama's final stream message."""
+    if ttft is not None:
+        LLM_TTFT_SECONDS.observe(ttft, model)
+    if done_chunk is None:
+        return
+    prompt_tokens = done_chunk.get("prompt_eval_count") or 0
+    prompt_duration = done_chunk.get("prompt_eval_duration") or 0
+    eval_count = done_chunk.get("eval_count") or 0
+    eval_duration = done_chunk.get("eval_duration") or 0
+    if prompt_tokens:
+        LLM_PROMPT_TOKENS.inc(prompt_tokens, model)
+    if prompt_duration:
+        LLM_PREFILL_SECONDS.observe(prompt_duration / 1e9, model)
+    if eval_count:
+        LLM_GENERATED_TOKENS.inc(eval_count, model)
+    if eval_count and eval_duration:
+        LLM_TOKENS_PER_SECOND.observe(eval_count / (eval_duration / 1e9), model)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@remote_procedure("render_metrics")
+def render_server_metrics() -> str:
+    """The retrieval server's metrics, for a worker's `/metrics` in multi-worker mode."""
+    return render_metrics()
+
+
+def merge_metrics(*texts: str) -> str:
+    """Combine expositions of the same registry from several processes:
+    each family is listed once and samples of the same series are added,
+    which is right for counters and cumulative histogram buckets alike."""
+    families = {}
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                family = families.setdefault(line.split(" ", 3)[2], ([], {}))
+                if line not in family[0]:
+                    family[0].append(line)
+            elif line and family is not None:
+                series, _, value = line.rpartition(" ")
+                try:
+                    value = int(value)
+                except ValueError:
+                    value = float(value)
+                family[1][series] = family[1].get(series, 0) + value
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header)
+        lines.extend(f"{series} {value}" for series, value in samples.items())
+    return "\n".join(lines) + "\n"
+
+
+def _server_timing(spans: list) -> str:
+    totals = {}
+    for stage, seconds in spans:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (it never buffers streamed bodies) that times each
+    request until its headers go out and adds the spans recorded so far as a
+    `Server-Timing` header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        spans = []
+        token = _request_spans.set(spans)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - started
+                route = getattr(scope.get("route"), "path", "unmatched")
+                HTTP_SECONDS.observe(elapsed, scope.get("method", ""), route, str(message.get("status", 0)))
+                if spans:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", _server_timing(spans + [("app", elapsed)]).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_spans.reset(token)
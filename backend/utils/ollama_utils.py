@@ -1,4 +1,15 @@
+import time
 import ollama
+from utils.context_packer import get_token_counter
+from utils.metrics import observe_generation
+
+_async_client = None
+
+def get_async_client() -> ollama.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = ollama.AsyncClient()
+    return _async_client
 
 def models_available():
     models_list = ollama.list()
@@ -24,4 +35,42 @@ def ollama_response_stream(modelName, user_prompt):
                 if content:
                     yield content
     except Exception as e:
-        yield f"Error: {str(e)}"
\ No newline at end of file
+        yield f"Error: {str(e)}"
+
+async def async_ollama_response_stream(modelName, user_prompt):
+    """Stream tokens from Ollama without blocking the event loop.
+
+    Tokens are pulled one at a time, so a slow consumer applies backpressure to
+    the upstream connection. Closing or cancelling this generator closes the
+    underlying HTTP stream, which aborts the generation on the Ollama side.
+    """
+    stream = None
+    started = time.perf_counter()
+    ttft = None
+    try:
+        stream = await get_async_client().chat(
+            model=modelName,
+            messages=[
+                {
+                    'role': 'user',
+                    'content': user_prompt,
+                },
+            ],
+            stream=True
+        )
+        async for chunk in stream:
+            if 'message' in chunk and 'content' in chunk['message']:
+                content = chunk['message']['content']
+                if content:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    yield content
+            if chunk.get('done'):
+                observe_generation(modelName, ttft, chunk)
+                if chunk.get('prompt_eval_count'):
+                    get_token_counter().observe(modelName, user_prompt, chunk['prompt_eval_count'])
+    except Exception as e:
+        yield f"Error: {str(e)}"
+    finally:
+        if stream is not None:
+            await stream.aclose()
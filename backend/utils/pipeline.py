@@ -1,15 +1,44 @@
-from docling.document_converter import DocumentConverter
-from docling_core.transforms.chunker.tokenizer.huggingface import HuggingFaceTokenizer
-from docling.chunking import HybridChunker
-from transformers import AutoTokenizer
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
-from utils.cache import get_embedding_model, get_chroma_client, get_chroma_collection
+from utils.cache import get_embedding_model, get_chroma_client, get_chroma_collection, hold_chroma_client
+from utils.manifest import CollectionManifest, file_sha256, chunk_id, bump_generation, read_generation
+from utils.lexical_index import get_lexical_index, build_from_collection
+from utils.vector_index import get_vector_index
+from utils.locks import get_collection_lock
+from utils.metrics import span, observe_stage, INGEST_CHUNKS
+from utils.embedding_backends import EMBEDDING_MODEL, hf_model_id, check_compatible, read_fingerprint, write_fingerprint
+import multiprocessing
 import os
-import uuid
+import queue
+import threading
+import time
 
-def run_pipeline(input_dir, output_dir, collection_name, model="sentence-transformers/all-MiniLM-L6-v2", batch_size=32):
+# Chunks are sized with the embedding model's own tokenizer
+DEFAULT_MODEL = hf_model_id(EMBEDDING_MODEL)
+INGEST_WORKERS = int(os.environ.get("RAG_INGEST_WORKERS", min(4, os.cpu_count() or 1)))
+EMBED_BATCH_CHUNKS = int(os.environ.get("RAG_EMBED_BATCH_CHUNKS", 256))
+QUEUE_SIZE = int(os.environ.get("RAG_INGEST_QUEUE_SIZE", 8))
+CHECKPOINT_CHUNKS = int(os.environ.get("RAG_INGEST_CHECKPOINT_CHUNKS", 5000))
+
+_process_pool = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+# Per-process converter/chunker, built once by the pool initializer
+_worker_converter = None
+_worker_chunker = None
+
+_DONE = object()
+
+
+def build_converter_and_chunker(model):
+    # docling and transformers are imported here, on first ingestion, so they
+    # stay out of server startup
+    from docling.document_converter import DocumentConverter
+    from docling_core.transforms.chunker.tokenizer.huggingface import HuggingFaceTokenizer
+    from docling.chunking import HybridChunker
+    from transformers import AutoTokenizer
     huggingface_tokenizer = AutoTokenizer.from_pretrained(model)
-    embedding_model = get_embedding_model()
     converter = DocumentConverter()
     tokenizer = HuggingFaceTokenizer(
         tokenizer=huggingface_tokenizer,
@@ -19,44 +48,399 @@ def run_pipeline(input_dir, output_dir, collection_name, model="sentence-transfo
         tokenizer=tokenizer,
         max_tokens=tokenizer.max_tokens
     )
-    
-    client = get_chroma_client(os.path.join(output_dir, "chromadb"))
-    collection = get_chroma_collection(client, collection_name)
-    
-    folder_path = Path(input_dir)
-    files_to_process = list(folder_path.rglob('*.*'))
-    
-    for file_path in files_to_process:
+    return converter, chunker
+
+
+def _init_worker(model):
+    global _worker_converter, _worker_chunker
+    _worker_converter, _worker_chunker = build_converter_and_chunker(model)
+
+
+def convert_and_chunk(file_path: str, model: str = DEFAULT_MODEL) -> list:
+    """Convert one document and return its chunk texts. Runs inside pool workers."""
+    global _worker_converter, _worker_chunker
+    if _worker_converter is None:
+        _init_worker(model)
+    result = _worker_converter.convert(file_path)
+    return [chunk.text for chunk in _worker_chunker.chunk(dl_doc=result.document)]
+
+
+def _timed_convert_and_chunk(file_path: str, model: str = DEFAULT_MODEL):
+    """`convert_and_chunk` plus its duration, measured inside the worker so the
+    time spent queued for a free process is not counted."""
+    started = time.perf_counter()
+    texts = convert_and_chunk(file_path, model)
+    return texts, time.perf_counter() - started
+
+
+def get_process_pool(workers: int, model: str = DEFAULT_MODEL) -> ProcessPoolExecutor:
+    """Shared conversion pool. Workers are spawned (not forked) so torch and
+    tokenizer thread pools in the parent never leak into them."""
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != workers:
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model,),
+            )
+            _process_pool_workers = workers
+        return _process_pool
+
+
+def run_pipeline(input_dir, output_dir, collection_name, model=DEFAULT_MODEL, batch_size=32, prune=False,
+                 workers=None, embed_batch_chunks=None, progress=None, should_cancel=None):
+    """Incrementally ingest `input_dir` into the collection.
+
+    Files whose content hash matches the manifest are skipped. Changed files are
+    converted and chunked in a process pool, new chunks from many files are
+    gathered into full embedding batches by a single embedding stage, and a
+    writer upserts them into Chroma. Bounded queues between the stages keep
+    memory flat. Chunks that disappeared from a file are deleted, and with
+    `prune=True` sources missing from `input_dir` are removed.
+
+    `progress(source, status, chunks=0, error=None)` is called as each file is
+    skipped, processed or fails. `should_cancel()` is polled before each file is
+    dispatched; files already in flight are still finished.
+    """
+    with get_collection_lock(collection_name), span("ingest_run"):
+        engine = _IngestionEngine(
+            output_dir,
+            collection_name,
+            model,
+            batch_size,
+            INGEST_WORKERS if workers is None else workers,
+            embed_batch_chunks or EMBED_BATCH_CHUNKS,
+            progress,
+            should_cancel,
+        )
+        with hold_chroma_client(engine.client_path):
+            return engine.run(input_dir, prune)
+
+
+class _FileJob:
+    def __init__(self, source, file_hash, chunk_ids, stale_ids, added):
+        self.source = source
+        self.file_hash = file_hash
+        self.chunk_ids = chunk_ids
+        self.stale_ids = stale_ids
+        self.added = added
+        self.remaining = len(added)
+
+
+class _IngestionEngine:
+    def __init__(self, output_dir, collection_name, model, batch_size, workers, embed_batch_chunks,
+                 progress=None, should_cancel=None):
+        self.output_dir = output_dir
+        self.collection_name = collection_name
+        self.progress = progress
+        self.should_cancel = should_cancel
+        self.model = model
+        self.batch_size = batch_size
+        self.workers = workers
+        self.embed_batch_chunks = embed_batch_chunks
+        check_compatible(output_dir)
+        self.client_path = os.path.join(output_dir, "chromadb")
+        self.client = get_chroma_client(self.client_path)
+        self.collection = get_chroma_collection(self.client, collection_name)
+        if read_fingerprint(output_dir) is None:
+            write_fingerprint(output_dir, get_embedding_model().fingerprint())
+        self.manifest = CollectionManifest(output_dir)
+        self.lexical = get_lexical_index(output_dir)
+        if not self.lexical.exists() and self.collection.count() > 0:
+            build_from_collection(self.lexical, self.collection)
+        self.uncommitted_chunks = 0
+        self.embed_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.write_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.stats = {"files_processed": 0, "files_skipped": 0, "files_failed": 0, "chunks_added": 0, "chunks_deleted": 0,
+                      "cancelled": False}
+        self.stats_lock = threading.Lock()
+        self.manifest_lock = threading.Lock()
+        self.stage_error = None
+
+    def run(self, input_dir, prune):
+        # Sources are paths relative to input_dir, so same-named files in
+        # different subfolders keep separate manifest entries and chunk ids
+        files_to_process = [(p, p.relative_to(input_dir).as_posix()) for p in Path(input_dir).rglob('*.*') if p.is_file()]
+        self._drop_basename_sources(files_to_process)
+        embedder = threading.Thread(target=self._embed_stage, name="ingest-embed", daemon=True)
+        writer = threading.Thread(target=self._write_stage, name="ingest-write", daemon=True)
+        embedder.start()
+        writer.start()
+        try:
+            seen_sources = self._convert_stage(files_to_process)
+        finally:
+            self.embed_queue.put(_DONE)
+            embedder.join()
+            writer.join()
+            self._checkpoint()
+        if self.stage_error is not None:
+            # The files were failed one by one; fail the run (and its job) too
+            raise self.stage_error
+        if prune and not self.stats["cancelled"]:
+            self._prune(seen_sources)
+        self._refresh_vector_index()
+        return self.stats
+
+    def _count(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    def _report(self, source, status, chunks=0, error=None):
+        if self.progress is None:
+            return
         try:
-            result = converter.convert(str(file_path))
-            chunks_iter = chunker.chunk(dl_doc=result.document)
-            processed_chunks = list(chunks_iter)
-            
-            if not processed_chunks:
+            self.progress(source, status, chunks=chunks, error=error)
+        except Exception as e:
+            print(f"Error reporting progress for {source}: {str(e)}")
+
+    def _fail(self, source, error):
+        print(f"Error processing {source}: {error}")
+        self._count("files_failed")
+        self._report(source, "failed", error=str(error))
+
+    def _convert_stage(self, files_to_process):
+        """Hash files, skip unchanged ones and fan conversions out to the pool,
+        keeping at most 2x workers documents in flight."""
+        seen_sources = set()
+        pending = {}
+        pool = get_process_pool(self.workers, self.model) if self.workers > 0 else None
+        max_in_flight = max(1, self.workers * 2)
+        local_converter = None
+
+        for file_path, source in files_to_process:
+            if self.should_cancel is not None and self.should_cancel():
+                self.stats["cancelled"] = True
+                break
+            seen_sources.add(source)
+            try:
+                with span("ingest_hash"):
+                    file_hash = file_sha256(file_path)
+            except Exception as e:
+                self._fail(source, e)
                 continue
-            source_type = "url" if file_path.name.startswith("url_") else "file"
-            original_name = file_path.name
-            chunk_texts = [chunk.text for chunk in processed_chunks]
-            embeddings = embedding_model.encode(
-                chunk_texts,
-                batch_size=batch_size,
-                normalize_embeddings=True,
-            )
-            ids = [str(uuid.uuid4()) for _ in chunk_texts]
-            metadatas = [
-                {
-                    "source": original_name,
-                    "source_type": source_type,
-                    "collection": collection_name
-                }
-                for _ in chunk_texts
-            ]
-            collection.add(
-                ids=ids,
-                embeddings=embeddings,
-                documents=chunk_texts,
-                metadatas=metadatas
-            )
+            if self.manifest.is_unchanged(source, file_hash):
+                self._count("files_skipped")
+                self._report(source, "skipped")
+                continue
+            if pool is None:
+                try:
+                    if local_converter is None:
+                        local_converter = build_converter_and_chunker(self.model)
+                    converter, chunker = local_converter
+                    with span("ingest_convert"):
+                        result = converter.convert(str(file_path))
+                        texts = [chunk.text for chunk in chunker.chunk(dl_doc=result.document)]
+                except Exception as e:
+                    self._fail(source, e)
+                    continue
+                self._dispatch(file_path, source, file_hash, texts)
+                continue
+            while len(pending) >= max_in_flight:
+                self._drain(pending, return_when=FIRST_COMPLETED)
+            future = pool.submit(_timed_convert_and_chunk, str(file_path), self.model)
+            pending[future] = (file_path, source, file_hash)
+
+        while pending:
+            self._drain(pending, return_when=FIRST_COMPLETED)
+        return seen_sources
+
+    def _drain(self, pending, return_when):
+        done, _ = wait(list(pending.keys()), return_when=return_when)
+        for future in done:
+            file_path, source, file_hash = pending.pop(future)
+            try:
+                texts, seconds = future.result()
+            except Exception as e:
+                self._fail(source, e)
+                continue
+            observe_stage("ingest_convert", seconds)
+            self._dispatch(file_path, source, file_hash, texts)
+
+    def _dispatch(self, file_path, source, file_hash, texts):
+        with self.manifest_lock:
+            known = self.manifest.get(source) is not None
+            old_ids = set(self.manifest.chunk_ids(source))
+        if not known:
+            # Chunks ingested before the manifest existed carry random ids
+            self.collection.delete(where={"source": source})
+        new_chunks = {}
+        for text in texts:
+            new_chunks.setdefault(chunk_id(source, text), text)
+        stale_ids = [cid for cid in old_ids if cid not in new_chunks]
+        added = [(cid, text) for cid, text in new_chunks.items() if cid not in old_ids]
+        self.embed_queue.put(_FileJob(source, file_hash, list(new_chunks.keys()), stale_ids, added))
+
+    def _embed_stage(self):
+        """Gather chunks from consecutive files into full batches before encoding.
+
+        If the stage itself breaks (e.g. the model cannot be loaded), the files
+        it holds and every later one are failed, and the queue is still drained,
+        so the convert stage never blocks on it and the writer always gets `_DONE`."""
+        buffer = []
+        done = False
+        try:
+            embedding_model = get_embedding_model()
+            while not done:
+                item = self.embed_queue.get()
+                if item is _DONE:
+                    done = True
+                else:
+                    if not item.added:
+                        self.write_queue.put((item, [], []))
+                    buffer.extend((item, cid, text) for cid, text in item.added)
+                flush_partial = done or self.embed_queue.empty()
+                while buffer and (len(buffer) >= self.embed_batch_chunks or flush_partial):
+                    batch, buffer = buffer[:self.embed_batch_chunks], buffer[self.embed_batch_chunks:]
+                    try:
+                        with span("ingest_embed"):
+                            embeddings = embedding_model.encode(
+                                [text for _, _, text in batch],
+                                batch_size=self.batch_size,
+                                normalize_embeddings=True,
+                            )
+                    except Exception as e:
+                        embeddings = e
+                    self.write_queue.put((None, batch, embeddings))
         except Exception as e:
-            print(f"Error processing {file_path}: {str(e)}")
-            continue
\ No newline at end of file
+            self.stage_error = e
+            if buffer:
+                self.write_queue.put((None, buffer, e))
+            while not done:
+                item = self.embed_queue.get()
+                if item is _DONE:
+                    done = True
+                else:
+                    self.write_queue.put((None, [(item, cid, text) for cid, text in item.added] or [(item, None, None)], e))
+        finally:
+            self.write_queue.put(_DONE)
+
+    def _write_stage(self):
+        failed_sources = set()
+        while True:
+            item = self.write_queue.get()
+            if item is _DONE:
+                break
+            try:
+                self._write(item, failed_sources)
+            except Exception as e:
+                # Keep consuming, so the embed stage never blocks on a full queue
+                self.stage_error = e
+                job, batch, _ = item
+                for batch_job in ([job] if job is not None else []) + [batch_job for batch_job, _, _ in batch]:
+                    if batch_job.source not in failed_sources:
+                        failed_sources.add(batch_job.source)
+                        self._fail(batch_job.source, e)
+
+    def _write(self, item, failed_sources):
+        job, batch, embeddings = item
+        if job is not None:
+            self._finish_file(job)
+            return
+        if isinstance(embeddings, Exception):
+            for batch_job, _, _ in batch:
+                if batch_job.source not in failed_sources:
+                    failed_sources.add(batch_job.source)
+                    self._fail(batch_job.source, embeddings)
+            return
+        try:
+            with span("ingest_write"):
+                self.collection.upsert(
+                    ids=[cid for _, cid, _ in batch],
+                    embeddings=embeddings,
+                    documents=[text for _, _, text in batch],
+                    metadatas=[
+                        {
+                            "source": batch_job.source,
+                            "source_type": "url" if batch_job.source.startswith("url_") else "file",
+                            "collection": self.collection_name
+                        }
+                        for batch_job, _, _ in batch
+                    ]
+                )
+        except Exception as e:
+            for batch_job, _, _ in batch:
+                if batch_job.source not in failed_sources:
+                    failed_sources.add(batch_job.source)
+                    self._fail(batch_job.source, e)
+            return
+        INGEST_CHUNKS.inc(len(batch), self.collection_name)
+        for batch_job, _, _ in batch:
+            batch_job.remaining -= 1
+            if batch_job.remaining == 0 and batch_job.source not in failed_sources:
+                self._finish_file(batch_job)
+
+    def _checkpoint(self):
+        """Commit the lexical index, then the manifest. Files finished since the
+        last checkpoint are re-ingested after a crash, which is idempotent."""
+        with self.manifest_lock, span("ingest_checkpoint"):
+            self.lexical.commit()
+            self.manifest.save()
+            if self.uncommitted_chunks:
+                bump_generation(self.output_dir)
+            self.uncommitted_chunks = 0
+
+    def _refresh_vector_index(self):
+        """Snapshot the collection into its exact-search index, unless the run
+        changed nothing and the index is already current."""
+        generation = read_generation(self.output_dir)
+        index = get_vector_index(self.output_dir)
+        state = index.state
+        if state is not None and state.get("generation") == generation:
+            return
+        with span("ingest_vector_index"):
+            index.build(self.collection, generation)
+
+    def _finish_file(self, job):
+        """Runs once every chunk of a file is written: drop stale chunks and
+        only then record the new hash, so a crash mid-file re-ingests it."""
+        try:
+            if job.stale_ids:
+                self.collection.delete(ids=job.stale_ids)
+            self.lexical.delete(job.stale_ids)
+            self.lexical.add([cid for cid, _ in job.added], [text for _, text in job.added])
+            with self.manifest_lock:
+                self.manifest.set(job.source, job.file_hash, job.chunk_ids)
+                self.uncommitted_chunks += len(job.added) + len(job.stale_ids)
+                checkpoint = self.uncommitted_chunks >= CHECKPOINT_CHUNKS
+            if checkpoint:
+                self._checkpoint()
+        except Exception as e:
+            self._fail(job.source, e)
+            return
+        self._count("files_processed")
+        self._count("chunks_added", len(job.added))
+        self._count("chunks_deleted", len(job.stale_ids))
+        self._report(job.source, "processed", chunks=len(job.added))
+
+    def _remove_source(self, source):
+        """Delete a source's chunks and manifest entry; call with `manifest_lock` held."""
+        stale_ids = self.manifest.chunk_ids(source)
+        if stale_ids:
+            self.collection.delete(ids=stale_ids)
+        self.lexical.delete(stale_ids)
+        self.manifest.remove(source)
+        self.uncommitted_chunks += len(stale_ids) or 1
+        self._count("chunks_deleted", len(stale_ids))
+
+    def _drop_basename_sources(self, files_to_process):
+        """A version 1 manifest keyed files by basename, so an entry named like
+        a file in a subfolder may hold any same-named file's chunks. Drop those
+        entries; their files are then re-ingested under their relative paths."""
+        if self.manifest.version >= 2:
+            return
+        nested_names = {file_path.name for file_path, source in files_to_process if source != file_path.name}
+        with self.manifest_lock:
+            for source in self.manifest.sources():
+                if source in nested_names:
+                    self._remove_source(source)
+
+    def _prune(self, seen_sources):
+        with self.manifest_lock:
+            for source in self.manifest.sources():
+                if source not in seen_sources:
+                    self._remove_source(source)
+        self._checkpoint()
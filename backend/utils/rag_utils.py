@@ -1,20 +1,51 @@
 import os
-from typing import List, Tuple, Dict
-from utils.cache import get_embedding_model, get_chroma_client, get_chroma_collection
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Optional
+from utils.cache import get_chroma_client, get_chroma_collection
+from utils.embedding_service import embed_query
+from utils.lexical_index import get_lexical_index, build_from_collection, INDEX_DIRNAME
+from utils.locks import get_collection_lock
+from utils.manifest import read_generation
+from utils.memory_store import get_conversation_memory
+from utils.metrics import span
+from utils.retrieval_ipc import remote_procedure
+from utils.vector_index import get_vector_index
+import threading
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../collections"))
+FEDERATION_WORKERS = int(os.environ.get("RAG_FEDERATION_WORKERS", 16))
+COLLECTION_TIMEOUT = float(os.environ.get("RAG_COLLECTION_TIMEOUT", 5.0))
 
-def query_chroma_ranked(collection_name: str, query_text: str, n_results: int = 5) -> List[Tuple[str, float]]:
+_background_builds = set()
+_background_builds_lock = threading.Lock()
+
+def query_chroma_ranked(collection_name: str, query_text: str, n_results: int = 5, query_embedding=None) -> List[Tuple[str, float]]:
+    with span("retrieve_dense"):
+        return _query_chroma_ranked(collection_name, query_text, n_results, query_embedding)
+
+
+@remote_procedure("query_chroma_ranked")
+def _query_chroma_ranked(collection_name, query_text, n_results, query_embedding):
     try:
-        chroma_path = os.path.join(BASE_DIR, collection_name, "chromadb")
+        collection_dir = os.path.join(BASE_DIR, collection_name)
+        chroma_path = os.path.join(collection_dir, "chromadb")
         if not os.path.exists(chroma_path):
             return []
+        if query_embedding is None:
+            query_embedding = embed_query(query_text)
+        index = get_vector_index(collection_dir)
+        generation = read_generation(collection_dir)
+        if index.usable(generation):
+            return index.search(query_embedding, n_results)
+        state = index.state
+        if state is None or state.get("generation") != generation:
+            _build_vector_index_in_background(collection_name, collection_dir)
         client = get_chroma_client(chroma_path)
         collection = get_chroma_collection(client, collection_name)
-        embedding_model = get_embedding_model()
-        prompt_embedding = embedding_model.encode([query_text], normalize_embeddings=True)[0]
         results = collection.query(
-            query_embeddings=[prompt_embedding],
+            query_embeddings=[query_embedding],
             n_results=n_results,
             include=["documents", "distances"]
         )
@@ -27,34 +58,209 @@ def query_chroma_ranked(collection_name: str, query_text: str, n_results: int =
         return []
 
 
-def query_context_ranked(collection_name: str, conversation_id: str, query_text: str, n_results: int = 5) -> List[Tuple[str, float]]:
+def query_context_ranked(collection_name: str, conversation_id: str, query_text: str, n_results: int = 5, query_embedding=None) -> List[Tuple[str, float]]:
+    with span("retrieve_context"):
+        return _query_context_ranked(collection_name, conversation_id, query_text, n_results, query_embedding)
+
+
+@remote_procedure("query_context_ranked")
+def _query_context_ranked(collection_name, conversation_id, query_text, n_results, query_embedding):
     try:
-        context_path = os.path.join(BASE_DIR, collection_name, "context")
-        if not os.path.exists(context_path):
-            return []
-        client = get_chroma_client(context_path)
-        collection = get_chroma_collection(client, conversation_id)
-        embedding_model = get_embedding_model()
-        prompt_embedding = embedding_model.encode([query_text], normalize_embeddings=True)[0]
-        results = collection.query(
-            query_embeddings=[prompt_embedding],
-            n_results=n_results,
-            include=["documents", "distances"]
-        )
-        documents = results.get("documents", [[]])[0]
-        distances = results.get("distances", [[]])[0]
-        ranked = [(doc, 1 - dist) for doc, dist in zip(documents, distances)]
-        return ranked
+        if query_embedding is None:
+            query_embedding = embed_query(query_text)
+        return get_conversation_memory().search(collection_name, conversation_id, query_embedding, n_results)
     except Exception as e:
         print(f"Error querying context store: {e}")
         return []
 
 
-def reciprocal_rank_fusion(lists: List[List[Tuple[str, float]]], k: int = 60, top_k: int = 5) -> List[str]:
+def query_lexical_ranked(collection_name: str, query_text: str, n_results: int = 5) -> List[Tuple[str, float]]:
+    """BM25 hits from the collection's inverted index, with their raw BM25
+    scores. Those are not on the cosine scale, so fuse them with `rank_only`."""
+    with span("retrieve_lexical"):
+        return _query_lexical_ranked(collection_name, query_text, n_results)
+
+
+@remote_procedure("query_lexical_ranked")
+def _query_lexical_ranked(collection_name, query_text, n_results):
+    try:
+        collection_dir = os.path.join(BASE_DIR, collection_name)
+        if not os.path.exists(os.path.join(collection_dir, INDEX_DIRNAME)):
+            _build_lexical_index_in_background(collection_name, collection_dir)
+            return []
+        hits = get_lexical_index(collection_dir).search(query_text, n_results)
+        if not hits:
+            return []
+        client = get_chroma_client(os.path.join(collection_dir, "chromadb"))
+        collection = get_chroma_collection(client, collection_name)
+        results = collection.get(ids=[chunk_id for chunk_id, _ in hits], include=["documents"])
+        documents = dict(zip(results.get("ids", []), results.get("documents", [])))
+        return [(documents[chunk_id], score) for chunk_id, score in hits if chunk_id in documents]
+    except Exception as e:
+        print(f"Error querying lexical index: {e}")
+        return []
+
+
+@remote_procedure("query_collection_batch")
+def query_collection_batch(collection_name: str, query_texts: List[str], query_embeddings, n_results: int = 5
+                           ) -> List[Tuple[List[Tuple[str, str, float]], List[Tuple[str, str, float]]]]:
+    """Dense and lexical hits for many questions at once, as `(dense, lexical)`
+    per question with `(chunk_id, document, score)` hits; lexical scores are
+    raw BM25, as from `query_lexical_ranked`.
+
+    Dense hits come from one multi-query call (a single matrix product on the
+    exact index, or one Chroma query for all embeddings); lexical hits share
+    one Chroma lookup for the documents of every question's BM25 hits.
+    """
+    collection_dir = os.path.join(BASE_DIR, collection_name)
+    chroma_path = os.path.join(collection_dir, "chromadb")
+    if not os.path.exists(chroma_path) or not len(query_texts):
+        return [([], []) for _ in query_texts]
+    collection = get_chroma_collection(get_chroma_client(chroma_path), collection_name)
+
+    with span("retrieve_dense"):
+        index = get_vector_index(collection_dir)
+        if index.usable(read_generation(collection_dir)):
+            dense = index.search_many_hits(query_embeddings, n_results)
+        else:
+            results = collection.query(
+                query_embeddings=[list(map(float, embedding)) for embedding in query_embeddings],
+                n_results=n_results,
+                include=["documents", "distances"]
+            )
+            dense = [
+                [(chunk_id, doc, 1 - dist) for chunk_id, doc, dist in zip(ids, documents, distances)]
+                for ids, documents, distances in zip(results["ids"], results["documents"], results["distances"])
+            ]
+
+    with span("retrieve_lexical"):
+        if not os.path.exists(os.path.join(collection_dir, INDEX_DIRNAME)):
+            _build_lexical_index_in_background(collection_name, collection_dir)
+            lexical_hits = [[] for _ in query_texts]
+        else:
+            lexical_index = get_lexical_index(collection_dir)
+            lexical_hits = [lexical_index.search(text, n_results) for text in query_texts]
+        wanted = list({chunk_id for hits in lexical_hits for chunk_id, _ in hits})
+        documents = {}
+        if wanted:
+            results = collection.get(ids=wanted, include=["documents"])
+            documents = dict(zip(results.get("ids", []), results.get("documents", [])))
+        lexical = [
+            [(chunk_id, documents[chunk_id], score) for chunk_id, score in hits if chunk_id in documents]
+            for hits in lexical_hits
+        ]
+    return list(zip(dense, lexical))
+
+
+def _build_in_background(kind: str, collection_name: str, collection_dir: str, build):
+    """Run `build(collection)` once at a time per collection and kind, under the
+    collection lock, without holding up the query that asked for it."""
+    if not os.path.exists(os.path.join(collection_dir, "chromadb")):
+        return
+    with _background_builds_lock:
+        if (kind, collection_name) in _background_builds:
+            return
+        _background_builds.add((kind, collection_name))
+
+    def run():
+        try:
+            with get_collection_lock(collection_name):
+                client = get_chroma_client(os.path.join(collection_dir, "chromadb"))
+                build(get_chroma_collection(client, collection_name))
+        except Exception as e:
+            print(f"Error building {kind} index for {collection_name}: {e}")
+        finally:
+            with _background_builds_lock:
+                _background_builds.discard((kind, collection_name))
+
+    threading.Thread(target=run, name=f"{kind}-build-{collection_name}", daemon=True).start()
+
+
+def _build_lexical_index_in_background(collection_name: str, collection_dir: str):
+    """Collections ingested before the lexical index existed get one built on first query."""
+    def build(collection):
+        index = get_lexical_index(collection_dir)
+        if not index.exists():
+            build_from_collection(index, collection)
+
+    _build_in_background("bm25", collection_name, collection_dir, build)
+
+
+def _build_vector_index_in_background(collection_name: str, collection_dir: str):
+    """Collections without an exact index for their current generation (ingested
+    before it existed, or left by an interrupted run) get one on first query."""
+    def build(collection):
+        index = get_vector_index(collection_dir)
+        generation = read_generation(collection_dir)
+        state = index.state
+        if state is None or state.get("generation") != generation:
+            index.build(collection, generation)
+
+    _build_in_background("exact", collection_name, collection_dir, build)
+
+
+_federation_executor: Optional[ThreadPoolExecutor] = None
+_federation_executor_lock = threading.Lock()
+
+
+def get_federation_executor() -> ThreadPoolExecutor:
+    """Shared, bounded pool for per-collection lookups, so a request spanning
+    many collections cannot start an unbounded number of threads."""
+    global _federation_executor
+    if _federation_executor is None:
+        with _federation_executor_lock:
+            if _federation_executor is None:
+                _federation_executor = ThreadPoolExecutor(max_workers=FEDERATION_WORKERS, thread_name_prefix="retrieve")
+    return _federation_executor
+
+
+async def query_collections_ranked(collection_names: List[str], query_text: str, query_embedding, n_results: int = 5,
+                                   timeout: float = COLLECTION_TIMEOUT) -> Dict[str, Optional[Tuple[list, list]]]:
+    """Dense and lexical hits from several collections at once.
+
+    Every lookup runs on the federation executor with the same query embedding.
+    Returns `{collection: (dense, lexical)}`; a collection whose lookups did not
+    finish within `timeout` seconds (`0` waits indefinitely) maps to None and
+    is left out of the answer, while its threads finish in the background.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_federation_executor()
+
+    def submit(fn, *args):
+        # Copy the context so spans land in this request's Server-Timing
+        return loop.run_in_executor(executor, contextvars.copy_context().run, fn, *args)
+
+    async def query_one(collection_name):
+        lookups = asyncio.gather(
+            submit(query_chroma_ranked, collection_name, query_text, n_results, query_embedding),
+            submit(query_lexical_ranked, collection_name, query_text, n_results),
+        )
+        try:
+            dense, lexical = await asyncio.wait_for(lookups, timeout or None)
+            return dense, lexical
+        except asyncio.TimeoutError:
+            print(f"Retrieval from {collection_name} timed out after {timeout}s")
+            return None
+
+    results = await asyncio.gather(*(query_one(name) for name in collection_names))
+    return dict(zip(collection_names, results))
+
+
+def rank_only(ranked_list: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+    """Drop the scores of a ranked list, so `reciprocal_rank_fusion` counts only
+    its ranks. Used for BM25 hits: normalizing them per query would give the top
+    lexical hit a perfect score however weak the match."""
+    return [(doc, 0.0) for doc, _ in ranked_list]
+
+
+def reciprocal_rank_fusion(lists: List[List[Tuple[str, float]]], k: int = 60, top_k: int = 5,
+                           weights: Optional[List[float]] = None) -> List[str]:
     scores: Dict[str, float] = {}
-    for ranked_list in lists:
+    if weights is None:
+        weights = [1.0] * len(lists)
+    for ranked_list, weight in zip(lists, weights):
         for rank_index, (doc, score) in enumerate(ranked_list):
-            fusion_score = (1.0 / (k + rank_index + 1)) + score
+            fusion_score = weight * ((1.0 / (k + rank_index + 1)) + score)
             scores[doc] = scores.get(doc, 0.0) + fusion_score
     sorted_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)
     return [doc for doc, _ in sorted_docs[:top_k]]
\ No newline at end of file
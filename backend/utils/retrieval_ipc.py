@@ -0,0 +1,212 @@
+import functools
+import os
+import queue
+import secrets
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Callable, Dict, Optional, Tuple
+
+RETRIEVAL_POOL_SIZE = int(os.environ.get("RAG_RETRIEVAL_POOL", 32))
+
+# Procedures and objects the retrieval server exposes, registered by the
+# modules that own them. The server calls them directly; an API worker in
+# multi-worker mode forwards the call over the retrieval socket instead.
+_procedures: Dict[str, Callable] = {}
+_objects: Dict[str, Tuple[Callable, frozenset]] = {}
+_serving = False
+
+
+class RemoteCallError(RuntimeError):
+    """A procedure raised on the retrieval server."""
+
+
+def retrieval_socket() -> Optional[str]:
+    return os.environ.get("RAG_RETRIEVAL_SOCKET") or None
+
+
+def _key_path(socket_path: str) -> str:
+    return socket_path + ".key"
+
+
+def _authkey(socket_path: str, create: bool = False) -> bytes:
+    """`RAG_RETRIEVAL_AUTHKEY`, else the key in the `0600` file next to the
+    socket, which the server (`create=True`) writes with a fresh random key."""
+    key = os.environ.get("RAG_RETRIEVAL_AUTHKEY", "")
+    if key:
+        return key.encode("utf-8")
+    path = _key_path(socket_path)
+    if create:
+        key = secrets.token_hex(16)
+        tmp_path = path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(key)
+        os.replace(tmp_path, path)
+        return key.encode("utf-8")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        key = ""
+    if not key:
+        raise AuthenticationError(
+            f"No retrieval server key: set RAG_RETRIEVAL_AUTHKEY or start the server to create {path}"
+        )
+    return key.encode("utf-8")
+
+
+def is_remote() -> bool:
+    """True in an API worker whose model and Chroma live in the retrieval server."""
+    return not _serving and retrieval_socket() is not None
+
+
+def remote_procedure(name: str):
+    """Run the function in the retrieval server when this process is a worker."""
+    def decorate(fn):
+        _procedures[name] = fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if is_remote():
+                return get_retrieval_client().call(name, *args, **kwargs)
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def remote_object(name: str, methods):
+    """Expose `methods` of the singleton returned by the decorated accessor;
+    in a worker process the accessor returns a proxy instead."""
+    def decorate(accessor):
+        _objects[name] = (accessor, frozenset(methods))
+
+        @functools.wraps(accessor)
+        def wrapper():
+            if is_remote():
+                return RemoteObject(name, _objects[name][1])
+            return accessor()
+        return wrapper
+    return decorate
+
+
+class RemoteObject:
+    def __init__(self, name: str, methods: frozenset):
+        self._name = name
+        self._methods = methods
+
+    def __getattr__(self, method: str):
+        if method not in self._methods:
+            raise AttributeError(f"{self._name}.{method} is not available from the retrieval server")
+        return functools.partial(get_retrieval_client().call, f"{self._name}.{method}")
+
+
+class RetrievalClient:
+    """Pool of connections to the retrieval server, shared by a worker's threads.
+
+    Each call takes an idle connection (opening one while fewer than
+    `pool_size` exist, otherwise waiting), sends `(name, args, kwargs)` and
+    waits for the reply. A connection that fails is dropped, not reused.
+    """
+
+    def __init__(self, path: str, pool_size: int = RETRIEVAL_POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def call(self, name: str, *args, **kwargs):
+        self._slots.acquire()
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = Client(self.path, family="AF_UNIX", authkey=_authkey(self.path))
+            conn.send((name, args, kwargs))
+            status, value = conn.recv()
+            self._idle.put(conn)
+            conn = None
+        finally:
+            if conn is not None:
+                conn.close()
+            self._slots.release()
+        if status == "error":
+            raise RemoteCallError(value)
+        return value
+
+
+_client: Optional[RetrievalClient] = None
+_client_lock = threading.Lock()
+
+
+def get_retrieval_client() -> RetrievalClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = RetrievalClient(retrieval_socket())
+    return _client
+
+
+def _resolve(name: str) -> Callable:
+    if name in _procedures:
+        return _procedures[name]
+    object_name, _, method = name.rpartition(".")
+    if object_name in _objects and method in _objects[object_name][1]:
+        return getattr(_objects[object_name][0](), method)
+    raise KeyError(f"Unknown retrieval procedure {name!r}")
+
+
+def _handle(conn):
+    with conn:
+        while True:
+            try:
+                name, args, kwargs = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ("ok", _resolve(name)(*args, **kwargs))
+            except Exception as e:
+                reply = ("error", f"{type(e).__name__}: {e}")
+            try:
+                conn.send(reply)
+            except (OSError, ValueError) as e:
+                print(f"Error replying to {name}: {e}")
+                return
+
+
+def mark_serving():
+    """Make this process run procedures locally even though the socket is set."""
+    global _serving
+    _serving = True
+
+
+def open_listener(path: str) -> Listener:
+    """Listen on a Unix socket at `path` that only this user can connect to."""
+    if os.path.exists(path):
+        os.unlink(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    listener = Listener(path, family="AF_UNIX", authkey=_authkey(path, create=True))
+    os.chmod(path, 0o600)
+    return listener
+
+
+def remove_socket(path: str):
+    """Remove the socket and any key file `open_listener` wrote for it."""
+    for name in (path, _key_path(path)):
+        if os.path.exists(name):
+            os.unlink(name)
+
+
+def serve_forever(listener: Listener):
+    """Accept worker connections, one thread each, until interrupted."""
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                print(f"Rejected retrieval connection: {e}")
+                continue
+            threading.Thread(target=_handle, args=(conn,), name="retrieval-conn", daemon=True).start()
+    finally:
+        listener.close()
@@ -0,0 +1,40 @@
+import os
+import signal
+import sys
+from utils.retrieval_ipc import mark_serving, open_listener, remove_socket, serve_forever
+
+DEFAULT_SOCKET = "./db/retrieval.sock"
+
+
+def serve(socket_path: str):
+    """Run the process that owns the embedding model, Chroma, ingestion jobs
+    and conversation memory, serving API workers over `socket_path`."""
+    mark_serving()
+    # Importing these registers the procedures workers may call
+    from utils import cache, embedding_service, rag_utils, snapshot, write_behind  # noqa: F401
+    from utils.catalog import get_catalog
+    from utils.jobs import get_job_manager
+    from utils.memory_store import start_vacuum_thread, stop_vacuum_thread
+    from utils.warmup import start_warmup
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    listener = open_listener(socket_path)
+    print(f"Retrieval server listening on {socket_path} (pid {os.getpid()})")
+    start_warmup()
+    resumed = get_job_manager().resume()
+    if resumed:
+        print(f"Resumed {resumed} ingestion job(s)")
+    start_vacuum_thread(lambda conversation_id: get_catalog().get(conversation_id) is not None)
+    try:
+        serve_forever(listener)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_vacuum_thread()
+        get_job_manager().shutdown()
+        write_behind.shutdown_write_behind_queue()
+        remove_socket(socket_path)
+
+
+if __name__ == "__main__":
+    serve(os.path.abspath(os.environ.get("RAG_RETRIEVAL_SOCKET", DEFAULT_SOCKET)))
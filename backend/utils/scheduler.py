@@ -0,0 +1,312 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from typing import AsyncIterator, Dict, Optional, Tuple
+from utils.metrics import observe_stage, GENERATION_REJECTED, GENERATION_COALESCED
+from utils.ollama_utils import async_ollama_response_stream
+
+# Set by `main.py --workers`: every API worker runs its own scheduler, so
+# each one gets an equal share of the configured limits (at least 1)
+GEN_WORKERS = max(1, int(os.environ.get("RAG_GEN_WORKERS", 1)))
+
+
+def _worker_share(limit: int, workers: int = GEN_WORKERS) -> int:
+    """This worker's part of a limit; 0 (unlimited) stays unlimited."""
+    return max(1, limit // workers) if limit > 0 else limit
+
+
+MAX_CONCURRENCY = _worker_share(int(os.environ.get("RAG_GEN_MAX_CONCURRENCY", 2)))
+MAX_TOTAL = _worker_share(int(os.environ.get("RAG_GEN_MAX_TOTAL", 0)))
+MAX_QUEUE = _worker_share(int(os.environ.get("RAG_GEN_MAX_QUEUE", 64)))
+QUEUE_TIMEOUT = float(os.environ.get("RAG_GEN_QUEUE_TIMEOUT", 30))
+COALESCE = os.environ.get("RAG_GEN_COALESCE", "1") != "0"
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+def _parse_model_limits(spec: str) -> Dict[str, int]:
+    """`"llama3:8b=4,qwen2.5:7b=1"` -> per-model concurrency limits."""
+    limits = {}
+    for item in spec.split(","):
+        model, sep, value = item.strip().rpartition("=")
+        if sep and model:
+            limits[model] = int(value)
+    return limits
+
+
+MODEL_LIMITS = {
+    model: _worker_share(limit)
+    for model, limit in _parse_model_limits(os.environ.get("RAG_GEN_MODEL_LIMITS", "")).items()
+}
+
+
+class GenerationRejected(Exception):
+    """The generation queue is full, or a request waited past its deadline."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Generation:
+    """One upstream generation, shared by every request with the same prompt."""
+
+    def __init__(self, model: str, prompt: str, priority: int, tag: float, seq: int, deadline: float):
+        self.model = model
+        self.prompt = prompt
+        self.priority = priority
+        self.tag = tag
+        self.seq = seq
+        self.deadline = deadline
+        self.state = "queued"
+        self.chunks = []
+        self.subscribers = []
+        self.task: Optional[asyncio.Task] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.position = None
+
+    def sort_key(self):
+        return self.priority, self.tag, self.seq
+
+    def publish(self, event: Tuple[str, object]):
+        for subscriber in self.subscribers:
+            subscriber.put_nowait(event)
+
+
+class GenerationScheduler:
+    """Admission control in front of Ollama.
+
+    Each model runs at most its limit of generations at once (`RAG_GEN_MODEL_LIMITS`,
+    else `RAG_GEN_MAX_CONCURRENCY`), optionally under a total cap across
+    models. Waiting requests are ordered by priority, then by a per-client
+    virtual start tag, so one client submitting many requests is interleaved
+    with others instead of being served first-come-first-served. A request
+    that waits longer than `queue_timeout` is rejected, and a full queue
+    rejects new requests up front; both carry a Retry-After estimate from the
+    model's recent generation times.
+
+    Requests for the same model and prompt while one is queued or running
+    subscribe to it and receive its chunks from the start. The generation is
+    aborted only when its last subscriber leaves.
+
+    All state is owned by the event loop; nothing here is thread-safe.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, model_limits=None, max_total=MAX_TOTAL,
+                 max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT, coalesce=COALESCE):
+        self.max_concurrency = max_concurrency
+        self.model_limits = MODEL_LIMITS if model_limits is None else model_limits
+        self.max_total = max_total
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.coalesce = coalesce
+        self._waiting: Dict[str, list] = {}
+        self._running: Dict[str, int] = {}
+        self._inflight: Dict[Tuple[str, str], _Generation] = {}
+        self._durations: Dict[str, float] = {}
+        self._last_tag: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+
+    def limit(self, model: str) -> int:
+        return self.model_limits.get(model, self.max_concurrency)
+
+    def _queued(self, model: str, below: Optional[int] = None) -> int:
+        """Queued generations of `model`, only those at a priority more urgent
+        than `below` if it is given."""
+        return sum(
+            1 for _, generation in self._waiting.get(model, ())
+            if generation.state == "queued" and (below is None or generation.priority < below)
+        )
+
+    def retry_after(self, model: str, position: Optional[int] = None) -> int:
+        """Seconds until a slot is likely free, from the model's average generation time."""
+        if position is None:
+            position = self._queued(model) + 1
+        average = self._durations.get(model, 10.0)
+        return max(1, math.ceil(average * position / max(1, self.limit(model))))
+
+    def admit(self, model: str):
+        """Raise `GenerationRejected` if the model's queue is already full.
+
+        Low-priority (batch) generations do not count: they are always served
+        after interactive ones, so a long batch must not lock chats out.
+        """
+        if self.max_queue and self._queued(model, below=PRIORITIES["low"]) >= self.max_queue:
+            GENERATION_REJECTED.inc(1, model, "queue_full")
+            raise GenerationRejected(f"Too many queued generations for {model}", self.retry_after(model))
+
+    async def stream(self, model: str, prompt: str, priority: str = "normal",
+                     client: str = "") -> AsyncIterator[Tuple[str, object]]:
+        """Yield `("queued", position)` while waiting, then `("chunk", text)`.
+
+        Raises `GenerationRejected` if the request is still queued at its
+        deadline. Closing the iterator releases this request's subscription.
+        """
+        generation = self._inflight.get((model, prompt)) if self.coalesce else None
+        subscriber = asyncio.Queue()
+        if generation is not None:
+            GENERATION_COALESCED.inc(1, model)
+            for chunk in generation.chunks:
+                subscriber.put_nowait(("chunk", chunk))
+        else:
+            generation = self._enqueue(model, prompt, PRIORITIES.get(priority, PRIORITIES["normal"]), client)
+        generation.subscribers.append(subscriber)
+        if generation.state == "queued" and generation.position is not None:
+            subscriber.put_nowait(("queued", generation.position))
+        # Starts the generation if a slot is free, otherwise publishes its position
+        self._dispatch(model)
+
+        queued_at = time.perf_counter()
+        waited = False
+        try:
+            while True:
+                kind, value = await subscriber.get()
+                if kind == "queued":
+                    waited = True
+                    yield kind, value
+                elif kind == "chunk":
+                    if waited:
+                        observe_stage("generation_queue", time.perf_counter() - queued_at)
+                        waited = False
+                    yield kind, value
+                elif kind == "rejected":
+                    raise GenerationRejected(f"Timed out waiting for a {model} generation slot", value)
+                else:
+                    return
+        finally:
+            self._unsubscribe(generation, subscriber)
+
+    def _enqueue(self, model: str, prompt: str, priority: int, client: str) -> _Generation:
+        tag = max(self._virtual_time, self._last_tag.get(client, 0.0)) + 1
+        self._last_tag[client] = tag
+        loop = asyncio.get_running_loop()
+        generation = _Generation(model, prompt, priority, tag, next(self._seq), loop.time() + self.queue_timeout)
+        heapq.heappush(self._waiting.setdefault(model, []), (generation.sort_key(), generation))
+        if self.queue_timeout:
+            generation.timer = loop.call_at(generation.deadline, self._expire, generation)
+        if self.coalesce:
+            self._inflight[(model, prompt)] = generation
+        return generation
+
+    def _expire(self, generation: _Generation):
+        if generation.state != "queued":
+            return
+        GENERATION_REJECTED.inc(len(generation.subscribers), generation.model, "deadline")
+        generation.publish(("rejected", self.retry_after(generation.model)))
+        self._drop(generation)
+
+    def _forget(self, generation: _Generation):
+        if self._inflight.get((generation.model, generation.prompt)) is generation:
+            del self._inflight[(generation.model, generation.prompt)]
+
+    def _drop(self, generation: _Generation):
+        generation.state = "dropped"
+        if generation.timer is not None:
+            generation.timer.cancel()
+        self._forget(generation)
+        heap = [entry for entry in self._waiting.get(generation.model, ()) if entry[1].state == "queued"]
+        heapq.heapify(heap)
+        self._waiting[generation.model] = heap
+        self._publish_positions(generation.model)
+
+    def _unsubscribe(self, generation: _Generation, subscriber: asyncio.Queue):
+        if subscriber in generation.subscribers:
+            generation.subscribers.remove(subscriber)
+        if generation.subscribers:
+            return
+        if generation.state == "queued":
+            self._drop(generation)
+        elif generation.state == "running" and generation.task is not None:
+            # Nobody is listening any more: abort upstream, and stop new
+            # requests from joining a generation that is going away
+            generation.state = "cancelling"
+            self._forget(generation)
+            generation.task.cancel()
+
+    def _total_running(self) -> int:
+        return sum(self._running.values())
+
+    def _dispatch(self, model: str):
+        heap = self._waiting.get(model)
+        while heap and self._running.get(model, 0) < self.limit(model):
+            if self.max_total and self._total_running() >= self.max_total:
+                break
+            _, generation = heapq.heappop(heap)
+            if generation.state != "queued":
+                continue
+            generation.state = "running"
+            if generation.timer is not None:
+                generation.timer.cancel()
+            self._virtual_time = max(self._virtual_time, generation.tag)
+            self._running[model] = self._running.get(model, 0) + 1
+            generation.task = asyncio.get_running_loop().create_task(self._run(generation))
+            # Not in `_run`'s finally: a task cancelled before its first step
+            # never runs its body, and the slot would be lost
+            generation.task.add_done_callback(lambda task, generation=generation: self._release(generation))
+        if len(self._last_tag) > 1024:
+            self._last_tag = {client: tag for client, tag in self._last_tag.items() if tag > self._virtual_time}
+        self._publish_positions(model)
+
+    def _publish_positions(self, model: str):
+        waiting = sorted((entry for entry in self._waiting.get(model, ()) if entry[1].state == "queued"),
+                         key=lambda entry: entry[0])
+        for position, (_, generation) in enumerate(waiting, start=1):
+            if generation.position != position:
+                generation.position = position
+                generation.publish(("queued", position))
+
+    async def _run(self, generation: _Generation):
+        started = time.perf_counter()
+        stream = async_ollama_response_stream(generation.model, generation.prompt)
+        completed = False
+        try:
+            async for chunk in stream:
+                generation.chunks.append(chunk)
+                generation.publish(("chunk", chunk))
+            completed = True
+        finally:
+            await stream.aclose()
+            generation.state = "done"
+            generation.publish(("done", None))
+            self._forget(generation)
+            if completed:
+                # Aborted generations would make Retry-After estimates too short
+                elapsed = time.perf_counter() - started
+                previous = self._durations.get(generation.model)
+                self._durations[generation.model] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+
+    def _release(self, generation: _Generation):
+        generation.state = "done"
+        self._forget(generation)
+        self._running[generation.model] -= 1
+        self._dispatch_all()
+
+    def _dispatch_all(self):
+        # A finished generation may free the total cap for any model
+        for model in list(self._waiting):
+            self._dispatch(model)
+
+    def stats(self) -> dict:
+        models = set(self._waiting) | set(self._running)
+        return {
+            model: {
+                "running": self._running.get(model, 0),
+                "queued": self._queued(model),
+                "limit": self.limit(model),
+                "avg_generation_seconds": round(self._durations[model], 3) if model in self._durations else None,
+            }
+            for model in sorted(models)
+        }
+
+
+_scheduler: Optional[GenerationScheduler] = None
+
+
+def get_generation_scheduler() -> GenerationScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = GenerationScheduler()
+    return _scheduler
@@ -0,0 +1,81 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from utils.sqlite_utils import SQLiteDatabase, SQLITE_DB_PATH
+
+SETTINGS_TTL = float(os.environ.get("RAG_SETTINGS_TTL", 1.0))
+
+
+class SettingsStore(SQLiteDatabase):
+    """Runtime settings (such as the active prompt template) shared by every
+    worker process.
+
+    Values are JSON in a small key/value table. Each process keeps a snapshot
+    of the whole table and re-reads it at most every `ttl` seconds, so a change
+    made by one worker reaches the others within that time, and the process
+    that made it sees it immediately.
+    """
+
+    def __init__(self, db_path=SQLITE_DB_PATH, ttl=SETTINGS_TTL):
+        super().__init__(db_path)
+        self.ttl = ttl
+        self._snapshot = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def init_schema(self, conn: sqlite3.Connection):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+    def _current(self) -> dict:
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._snapshot
+        rows = self.conn.execute("SELECT key, value FROM settings").fetchall()
+        snapshot = {row["key"]: json.loads(row["value"]) for row in rows}
+        with self._lock:
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+        return snapshot
+
+    def get(self, key: str, default=None):
+        return self._current().get(key, default)
+
+    def set(self, key: str, value):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO settings (key, value, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                (key, json.dumps(value), time.time())
+            )
+        self._invalidate()
+
+    def delete(self, key: str):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM settings WHERE key = ?", (key,))
+        self._invalidate()
+
+    def _invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+
+_settings: Optional[SettingsStore] = None
+_settings_lock = threading.Lock()
+
+
+def get_settings() -> SettingsStore:
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = SettingsStore()
+    return _settings
@@ -0,0 +1,283 @@
+import argparse
+import datetime
+import json
+import os
+import shutil
+import tarfile
+import time
+from typing import Iterator
+import numpy as np
+from utils.cache import get_chroma_client, get_chroma_collection, drop_chroma_client
+from utils.embedding_backends import configured_fingerprint, read_fingerprint, write_fingerprint, same_vector_space, EmbeddingMismatchError, LEGACY_FINGERPRINT
+from utils.lexical_index import get_lexical_index, drop_lexical_index
+from utils.locks import get_collection_lock
+from utils.manifest import MANIFEST_FILENAME, bump_generation, read_generation
+from utils.metrics import span
+from utils.retrieval_ipc import remote_procedure
+from utils.vector_index import get_vector_index
+
+SNAPSHOT_FORMAT = "rag-collection-snapshot"
+SNAPSHOT_VERSION = 1
+HEADER_FILENAME = "snapshot.json"
+EMBEDDINGS_FILENAME = "embeddings.npy"
+CHUNKS_FILENAME = "chunks.jsonl"
+SNAPSHOT_DTYPES = ("float32", "float16")
+SNAPSHOT_PAGE_SIZE = int(os.environ.get("RAG_SNAPSHOT_PAGE_SIZE", 5000))
+
+
+class SnapshotError(ValueError):
+    """The snapshot is malformed, of an unknown version, or cannot be imported here."""
+
+
+def export_collection(collection_name: str, collection_dir: str, snapshot_dir: str, dtype: str = "float32",
+                      page_size: int = SNAPSHOT_PAGE_SIZE) -> dict:
+    """Write the collection to `snapshot_dir` as a versioned snapshot.
+
+    The snapshot holds `embeddings.npy` (one row per chunk, memory-mappable),
+    `chunks.jsonl` with each row's id, text and metadata in the same order,
+    the ingestion manifest, and `snapshot.json` with the embedding model
+    fingerprint. `snapshot.json` is written last, so a snapshot without it is
+    incomplete. Runs under the collection lock, so ingestion cannot change
+    the collection half-way through.
+    """
+    if dtype not in SNAPSHOT_DTYPES:
+        raise SnapshotError(f"dtype must be one of {', '.join(SNAPSHOT_DTYPES)}")
+    chroma_path = os.path.join(collection_dir, "chromadb")
+    if not os.path.isdir(chroma_path):
+        raise FileNotFoundError(f"Collection {collection_name!r} does not exist")
+    os.makedirs(snapshot_dir, exist_ok=True)
+    with get_collection_lock(collection_name), span("snapshot_export"):
+        collection = get_chroma_collection(get_chroma_client(chroma_path), collection_name)
+        count = collection.count()
+        embeddings = None
+        row = 0
+        offset = 0
+        with open(os.path.join(snapshot_dir, CHUNKS_FILENAME), "w", encoding="utf-8") as chunks:
+            while row < count:
+                page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+                if not len(page["ids"]):
+                    break
+                vectors = np.asarray(page["embeddings"], dtype=np.float32)
+                if embeddings is None:
+                    embeddings = np.lib.format.open_memmap(
+                        os.path.join(snapshot_dir, EMBEDDINGS_FILENAME), mode="w+", dtype=dtype,
+                        shape=(count, vectors.shape[1])
+                    )
+                rows = min(len(vectors), count - row)
+                embeddings[row:row + rows] = vectors[:rows]
+                for chunk_id, document, metadata in zip(page["ids"][:rows], page["documents"][:rows], page["metadatas"][:rows]):
+                    chunks.write(json.dumps({"id": chunk_id, "document": document, "metadata": metadata or {}}, ensure_ascii=False))
+                    chunks.write("\n")
+                row += rows
+                offset += len(page["ids"])
+        dimensions = 0 if embeddings is None else embeddings.shape[1]
+        if embeddings is None:
+            np.save(os.path.join(snapshot_dir, EMBEDDINGS_FILENAME), np.empty((0, 0), dtype=dtype))
+        else:
+            embeddings.flush()
+            del embeddings
+        if row < count:
+            raise SnapshotError(f"Collection {collection_name!r} shrank while it was exported")
+        manifest_path = os.path.join(collection_dir, MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            shutil.copyfile(manifest_path, os.path.join(snapshot_dir, MANIFEST_FILENAME))
+        header = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "collection": collection_name,
+            "count": row,
+            "dimensions": dimensions,
+            "dtype": dtype,
+            "embedding": read_fingerprint(collection_dir) or LEGACY_FINGERPRINT,
+            "generation": read_generation(collection_dir),
+            "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with open(os.path.join(snapshot_dir, HEADER_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(header, f)
+    return header
+
+
+def read_header(snapshot_dir: str) -> dict:
+    try:
+        with open(os.path.join(snapshot_dir, HEADER_FILENAME), "r", encoding="utf-8") as f:
+            header = json.load(f)
+    except FileNotFoundError:
+        raise SnapshotError(f"{HEADER_FILENAME} is missing; the snapshot is incomplete")
+    except json.JSONDecodeError as e:
+        raise SnapshotError(f"{HEADER_FILENAME} is not valid JSON: {e}")
+    if header.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError("Not a collection snapshot")
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {header.get('version')} (expected {SNAPSHOT_VERSION})")
+    return header
+
+
+def check_snapshot(snapshot_dir: str) -> dict:
+    """Read the snapshot header and check that the server's embedding model
+    can query the vectors in it; returns the header."""
+    header = read_header(snapshot_dir)
+    current = configured_fingerprint()
+    stored = header.setdefault("embedding", LEGACY_FINGERPRINT)
+    if not same_vector_space(stored, current):
+        raise EmbeddingMismatchError(
+            f"Snapshot was built with {stored.get('model')} ({stored.get('backend')}, {stored.get('precision')}) "
+            f"but the server embeds with {current.get('model')} ({current.get('backend')}, {current.get('precision')})"
+        )
+    return header
+
+
+def _pages(snapshot_dir: str, header: dict, page_size: int) -> Iterator[tuple]:
+    """`(ids, embeddings, documents, metadatas)` pages, with the embeddings
+    sliced from the memory-mapped matrix and upcast one page at a time."""
+    embeddings = np.load(os.path.join(snapshot_dir, EMBEDDINGS_FILENAME), mmap_mode="r")
+    if embeddings.shape[0] != header["count"]:
+        raise SnapshotError(f"{EMBEDDINGS_FILENAME} has {embeddings.shape[0]} rows, expected {header['count']}")
+    row = 0
+    with open(os.path.join(snapshot_dir, CHUNKS_FILENAME), "r", encoding="utf-8") as f:
+        while True:
+            lines = [line for _, line in zip(range(page_size), f)]
+            if not lines:
+                break
+            chunks = [json.loads(line) for line in lines]
+            if row + len(chunks) > header["count"]:
+                raise SnapshotError(f"{CHUNKS_FILENAME} has more chunks than {EMBEDDINGS_FILENAME}")
+            yield (
+                [chunk["id"] for chunk in chunks],
+                np.asarray(embeddings[row:row + len(chunks)], dtype=np.float32),
+                [chunk["document"] for chunk in chunks],
+                [chunk.get("metadata") or None for chunk in chunks],
+            )
+            row += len(chunks)
+    if row != header["count"]:
+        raise SnapshotError(f"{CHUNKS_FILENAME} has {row} chunks, expected {header['count']}")
+
+
+def import_collection(collection_name: str, collection_dir: str, snapshot_dir: str) -> dict:
+    """Load a snapshot into a new collection, bulk-upserting into Chroma and
+    building the BM25 and exact vector indexes from the same pass over it.
+
+    The snapshot's embedding fingerprint must match the server's model, and
+    the collection must not exist yet. A failed import removes what it wrote.
+    """
+    header = check_snapshot(snapshot_dir)
+    stored = header["embedding"]
+    chroma_path = os.path.join(collection_dir, "chromadb")
+    with get_collection_lock(collection_name), span("snapshot_import"):
+        if os.path.isdir(chroma_path):
+            raise FileExistsError(f"Collection {collection_name!r} already exists")
+        try:
+            client = get_chroma_client(chroma_path)
+            collection = get_chroma_collection(client, collection_name)
+            batch_size = min(SNAPSHOT_PAGE_SIZE, client.get_max_batch_size())
+            ids = []
+            texts = []
+
+            def load():
+                for page_ids, embeddings, documents, metadatas in _pages(snapshot_dir, header, batch_size):
+                    for metadata in metadatas:
+                        if metadata is not None and "collection" in metadata:
+                            metadata["collection"] = collection_name
+                    collection.upsert(ids=page_ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+                    ids.extend(page_ids)
+                    texts.extend(documents)
+                    yield page_ids, embeddings, documents
+
+            write_fingerprint(collection_dir, stored)
+            manifest_path = os.path.join(snapshot_dir, MANIFEST_FILENAME)
+            if os.path.exists(manifest_path):
+                shutil.copyfile(manifest_path, os.path.join(collection_dir, MANIFEST_FILENAME))
+            bump_generation(collection_dir)
+            get_vector_index(collection_dir).build_from_pages(load(), header["count"], read_generation(collection_dir))
+            get_lexical_index(collection_dir).rebuild(ids, texts)
+        except BaseException:
+            drop_chroma_client(chroma_path)
+            drop_lexical_index(collection_dir)
+            shutil.rmtree(collection_dir, ignore_errors=True)
+            raise
+    return {**header, "collection": collection_name, "source_collection": header.get("collection")}
+
+
+@remote_procedure("export_snapshot")
+def export_snapshot(collection_name: str, collection_dir: str, snapshot_dir: str, dtype: str = "float32") -> dict:
+    return export_collection(collection_name, collection_dir, snapshot_dir, dtype)
+
+
+@remote_procedure("import_snapshot")
+def import_snapshot(collection_name: str, collection_dir: str, snapshot_dir: str) -> dict:
+    return import_collection(collection_name, collection_dir, snapshot_dir)
+
+
+def iter_tar(snapshot_dir: str, block_size: int = 1 << 20) -> Iterator[bytes]:
+    """Stream the snapshot as an uncompressed tar archive, file by file, without
+    building the archive on disk or in memory."""
+    names = [HEADER_FILENAME, EMBEDDINGS_FILENAME, CHUNKS_FILENAME, MANIFEST_FILENAME]
+    for name in names:
+        path = os.path.join(snapshot_dir, name)
+        if not os.path.exists(path):
+            continue
+        info = tarfile.TarInfo(name)
+        info.size = os.path.getsize(path)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                yield block
+        remainder = info.size % tarfile.BLOCKSIZE
+        if remainder:
+            yield b"\0" * (tarfile.BLOCKSIZE - remainder)
+    yield b"\0" * (tarfile.BLOCKSIZE * 2)
+
+
+def write_tar(snapshot_dir: str, tar_path: str):
+    with open(tar_path, "wb") as f:
+        for block in iter_tar(snapshot_dir):
+            f.write(block)
+
+
+def extract_tar(tar_path: str, snapshot_dir: str):
+    """Unpack a snapshot archive, refusing paths outside `snapshot_dir`."""
+    try:
+        with tarfile.open(tar_path, "r:*") as tar:
+            tar.extractall(snapshot_dir, filter="data")
+    except (tarfile.TarError, OSError) as e:
+        raise SnapshotError(f"Cannot read snapshot archive: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import a collection snapshot")
+    parser.add_argument("--collections", default=os.path.join(os.path.dirname(__file__), "../collections"),
+                        help="Collections directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Write a collection to a snapshot directory or .tar file")
+    export_parser.add_argument("collection")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--float16", action="store_true", help="Store embeddings as float16 (half the size)")
+    import_parser = commands.add_parser("import", help="Create a collection from a snapshot directory or .tar file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("collection")
+    args = parser.parse_args()
+
+    collection_dir = os.path.join(os.path.abspath(args.collections), args.collection)
+    as_tar = args.path.endswith(".tar")
+    snapshot_dir = args.path + ".d" if as_tar else args.path
+    started = time.perf_counter()
+    try:
+        if args.command == "export":
+            header = export_collection(args.collection, collection_dir, snapshot_dir,
+                                       "float16" if args.float16 else "float32")
+            if as_tar:
+                write_tar(snapshot_dir, args.path)
+        else:
+            if as_tar:
+                extract_tar(args.path, snapshot_dir)
+            header = import_collection(args.collection, collection_dir, snapshot_dir)
+    finally:
+        if as_tar:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+    print(f"{args.command}ed {header['count']} chunks of {args.collection} ({header['dtype']}, "
+          f"{header['dimensions']} dims) in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import os
+import sqlite3
+import threading
+
+SQLITE_DB_PATH = "./db/rag.sqlite3"
+
+
+class SQLiteDatabase:
+    """Thread-safe handle on a SQLite database in WAL mode.
+
+    Each thread gets its own connection, so readers never block writers and
+    concurrent writers are serialized by SQLite itself (with a busy timeout)
+    instead of corrupting a shared file. Subclasses create their tables in
+    `init_schema`, which runs once per process.
+    """
+
+    def __init__(self, db_path=SQLITE_DB_PATH):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self._local = threading.local()
+        with self.transaction() as conn:
+            self.init_schema(conn)
+
+    def init_schema(self, conn: sqlite3.Connection):
+        pass
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def transaction(self):
+        return _Transaction(self.conn)
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import os
+import threading
+import uuid
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+SSE_FLUSH_INTERVAL = float(os.environ.get("RAG_SSE_FLUSH_MS", 50)) / 1000
+SSE_FLUSH_CHARS = int(os.environ.get("RAG_SSE_FLUSH_CHARS", 512))
+SSE_BUFFER_FRAMES = int(os.environ.get("RAG_SSE_BUFFER_FRAMES", 1024))
+SSE_RESUME_WINDOW = float(os.environ.get("RAG_SSE_RESUME_WINDOW", 30))
+SSE_RETENTION = float(os.environ.get("RAG_SSE_RETENTION", 60))
+
+
+class ResumableStream:
+    """One response's SSE frames, produced by a task that does not depend on
+    any HTTP connection.
+
+    Text written with `write` is coalesced into one `streaming` frame per
+    `flush_interval` seconds or `flush_chars` characters, whichever comes
+    first; `send` flushes that text and then emits a frame of its own. Each
+    frame is serialized once, numbered with an SSE `id`, and kept in a ring
+    buffer of the last `capacity` frames, so any number of subscribers can
+    follow the stream and a reconnecting client resumes after the last id it
+    saw (`Last-Event-ID`) instead of restarting the generation.
+    """
+
+    def __init__(self, stream_id: str, capacity: int = SSE_BUFFER_FRAMES,
+                 flush_interval: float = SSE_FLUSH_INTERVAL, flush_chars: int = SSE_FLUSH_CHARS):
+        self.stream_id = stream_id
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.frames = deque(maxlen=max(1, capacity))
+        self.next_id = 0
+        self.done = False
+        self.subscribers = 0
+        self._pending = []
+        self._pending_chars = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._wakeup = asyncio.Event()
+
+    def write(self, text: str):
+        if self.done or not text:
+            return
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars >= self.flush_chars:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._pending:
+            chunk = "".join(self._pending)
+            self._pending = []
+            self._pending_chars = 0
+            self._publish({"chunk": chunk, "status": "streaming"})
+
+    def send(self, payload: dict):
+        if self.done:
+            return
+        self.flush()
+        self._publish(payload)
+
+    def _publish(self, payload: dict):
+        self.frames.append((self.next_id, f"id: {self.next_id}\ndata: {json.dumps(payload)}\n\n"))
+        self.next_id += 1
+        wakeup, self._wakeup = self._wakeup, asyncio.Event()
+        wakeup.set()
+
+    def close(self):
+        self.flush()
+        self.done = True
+        self._wakeup.set()
+
+    def _first_id(self) -> int:
+        return self.frames[0][0] if self.frames else self.next_id
+
+    def can_resume(self, last_event_id: Optional[int]) -> bool:
+        """True unless frames after `last_event_id` have left the ring buffer."""
+        return (-1 if last_event_id is None else last_event_id) + 1 >= self._first_id()
+
+    async def subscribe(self, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+        """Yield frames after `last_event_id` (all buffered ones if None) until
+        the stream is closed."""
+        after = -1 if last_event_id is None else last_event_id
+        self.subscribers += 1
+        try:
+            while True:
+                wakeup = self._wakeup
+                while after + 1 < self.next_id:
+                    first = self._first_id()
+                    if after + 1 < first:
+                        # A subscriber this far behind would silently lose text
+                        yield f"data: {json.dumps({'status': 'error', 'error': 'Stream fell behind its buffer', 'code': 410})}\n\n"
+                        return
+                    after, frame = self.frames[after + 1 - first]
+                    yield frame
+                if self.done:
+                    return
+                await wakeup.wait()
+        finally:
+            self.subscribers -= 1
+
+
+class StreamRegistry:
+    """Live and recently finished streams of this process, by id.
+
+    `start` runs a producer as its own task. Once every subscriber has gone,
+    a still-running producer is cancelled after `resume_window` seconds unless
+    a client resumed in the meantime; finished streams stay resumable for
+    `retention` seconds.
+    """
+
+    def __init__(self, resume_window: float = SSE_RESUME_WINDOW, retention: float = SSE_RETENTION):
+        self.resume_window = resume_window
+        self.retention = retention
+        self._streams: Dict[str, ResumableStream] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._abandon_timers: Dict[str, asyncio.TimerHandle] = {}
+
+    def start(self, produce: Callable[[ResumableStream], Awaitable[None]]) -> ResumableStream:
+        stream = ResumableStream(uuid.uuid4().hex)
+        self._streams[stream.stream_id] = stream
+        task = asyncio.get_running_loop().create_task(produce(stream))
+        self._tasks[stream.stream_id] = task
+        task.add_done_callback(lambda task: self._finished(stream, task))
+        return stream
+
+    def get(self, stream_id: str) -> Optional[ResumableStream]:
+        return self._streams.get(stream_id)
+
+    async def follow(self, stream: ResumableStream, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+        """`stream.subscribe`, watching for the last subscriber to disconnect."""
+        subscription = stream.subscribe(last_event_id)
+        try:
+            async for frame in subscription:
+                yield frame
+        finally:
+            await subscription.aclose()
+            if not stream.done and stream.subscribers == 0:
+                timer = self._abandon_timers.pop(stream.stream_id, None)
+                if timer is not None:
+                    timer.cancel()
+                self._abandon_timers[stream.stream_id] = asyncio.get_running_loop().call_later(
+                    self.resume_window, self._abandon, stream
+                )
+
+    def _abandon(self, stream: ResumableStream):
+        self._abandon_timers.pop(stream.stream_id, None)
+        task = self._tasks.get(stream.stream_id)
+        if task is not None and not stream.done and stream.subscribers == 0:
+            task.cancel()
+
+    def _finished(self, stream: ResumableStream, task: asyncio.Task):
+        if task.cancelled():
+            stream.send({"status": "error", "error": "Generation stopped after the client disconnected"})
+        stream.close()
+        self._tasks.pop(stream.stream_id, None)
+        timer = self._abandon_timers.pop(stream.stream_id, None)
+        if timer is not None:
+            timer.cancel()
+        asyncio.get_running_loop().call_later(self.retention, self._streams.pop, stream.stream_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "streams": len(self._streams),
+            "running": len(self._tasks),
+            "subscribers": sum(stream.subscribers for stream in self._streams.values()),
+        }
+
+
+_registry: Optional[StreamRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_stream_registry() -> StreamRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = StreamRegistry()
+    return _registry
@@ -0,0 +1,261 @@
+import json
+import mmap
+import os
+import shutil
+import threading
+from typing import List, Optional, Tuple
+import numpy as np
+
+INDEX_DIRNAME = "vectors"
+STATE_FILENAME = "current.json"
+EXACT_MAX_VECTORS = int(os.environ.get("RAG_EXACT_MAX_VECTORS", 50000))
+EXACT_DTYPE = os.environ.get("RAG_EXACT_DTYPE", "float32")
+BLOCK_ROWS = int(os.environ.get("RAG_EXACT_BLOCK_ROWS", 16384))
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` largest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+class _Version:
+    """One immutable build: `vectors.npy` (n x dim, row-normalized), the
+    chunk ids and documents as UTF-8 blobs with `int64` offset tables.
+    Everything is memory-mapped, so loading copies nothing."""
+
+    def __init__(self, version_dir: str):
+        self.vectors = np.load(os.path.join(version_dir, "vectors.npy"), mmap_mode="r")
+        self.id_offsets = np.load(os.path.join(version_dir, "id_offsets.npy"), mmap_mode="r")
+        self.doc_offsets = np.load(os.path.join(version_dir, "doc_offsets.npy"), mmap_mode="r")
+        self.ids = _map(os.path.join(version_dir, "ids.bin"))
+        self.documents = _map(os.path.join(version_dir, "documents.bin"))
+
+    def _text(self, blob, offsets, row: int) -> str:
+        start, end = int(offsets[row]), int(offsets[row + 1])
+        return bytes(blob[start:end]).decode("utf-8")
+
+    def chunk_id(self, row: int) -> str:
+        return self._text(self.ids, self.id_offsets, row)
+
+    def document(self, row: int) -> str:
+        return self._text(self.documents, self.doc_offsets, row)
+
+
+def _map(path: str):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ExactVectorIndex:
+    """Brute-force cosine search over a collection's chunk embeddings.
+
+    For small and medium collections a matrix product over every vector is
+    faster than Chroma's HNSW index and exact. The index is rebuilt from the
+    Chroma collection after each ingestion run and records the collection's
+    ingestion generation; a query only uses it while that generation is
+    current, so the caller falls back to HNSW mid-ingestion, for collections
+    above `EXACT_MAX_VECTORS`, or before the first build. Builds go to a new
+    directory and `current.json` is swapped atomically; readers pick it up by
+    mtime, as with the lexical index.
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._state_mtime = None
+        self._state = None
+        self._version: Optional[_Version] = None
+        self._maybe_reload()
+
+    def _state_path(self) -> str:
+        return os.path.join(self.index_dir, STATE_FILENAME)
+
+    def _maybe_reload(self):
+        try:
+            mtime = os.stat(self._state_path()).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._state_mtime:
+            return
+        with self._lock:
+            if mtime is None:
+                self._state, self._version = None, None
+            else:
+                with open(self._state_path(), "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                version = None
+                if state.get("name"):
+                    version = _Version(os.path.join(self.index_dir, state["name"]))
+                self._state, self._version = state, version
+            self._state_mtime = mtime
+
+    @property
+    def state(self) -> Optional[dict]:
+        self._maybe_reload()
+        return self._state
+
+    def usable(self, generation: str) -> bool:
+        """True if the index holds exactly the collection at `generation`."""
+        state = self.state
+        return state is not None and self._version is not None and state.get("generation") == generation
+
+    def _top_rows(self, version: _Version, queries, n_results: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Top `(rows, scores)` per query, best first, from one pass over the
+        matrix in blocks of `BLOCK_ROWS` rows."""
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        if not len(version.vectors):
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in range(len(queries))]
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(version.vectors), BLOCK_ROWS):
+            block = np.asarray(version.vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+            scores = queries @ block.T
+            k = min(n_results, scores.shape[1])
+            rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_rows = np.concatenate([best_rows, rows + start], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, rows, axis=1)], axis=1)
+
+        results = []
+        for rows, scores in zip(best_rows, best_scores):
+            order = top_k(scores, n_results)
+            results.append((rows[order], scores[order]))
+        return results
+
+    def search_many(self, queries, n_results: int = 5) -> List[List[Tuple[str, float]]]:
+        """Top `n_results` `(document, cosine)` per query."""
+        version = self._version
+        if version is None:
+            return [[] for _ in range(len(np.atleast_2d(queries)))]
+        return [
+            [(version.document(int(row)), float(score)) for row, score in zip(rows, scores)]
+            for rows, scores in self._top_rows(version, queries, n_results)
+        ]
+
+    def search_many_hits(self, queries, n_results: int = 5) -> List[List[Tuple[str, str, float]]]:
+        """Like `search_many`, with each hit's chunk id: `(chunk_id, document, cosine)`."""
+        version = self._version
+        if version is None:
+            return [[] for _ in range(len(np.atleast_2d(queries)))]
+        return [
+            [(version.chunk_id(int(row)), version.document(int(row)), float(score)) for row, score in zip(rows, scores)]
+            for rows, scores in self._top_rows(version, queries, n_results)
+        ]
+
+    def search(self, query_embedding, n_results: int = 5) -> List[Tuple[str, float]]:
+        return self.search_many([query_embedding], n_results)[0]
+
+    def build(self, collection, generation: str, max_vectors: int = EXACT_MAX_VECTORS,
+              dtype: str = EXACT_DTYPE, page_size: int = 1000) -> bool:
+        """Snapshot every chunk of a Chroma collection; returns False (and
+        records that HNSW should be used) when it has more than `max_vectors`."""
+        count = collection.count()
+        if not max_vectors or count > max_vectors:
+            return self.build_from_pages(iter(()), count, generation, max_vectors, dtype)
+        return self.build_from_pages(_collection_pages(collection, page_size), count, generation, max_vectors, dtype)
+
+    def build_from_pages(self, pages, count: int, generation: str, max_vectors: int = EXACT_MAX_VECTORS,
+                         dtype: str = EXACT_DTYPE) -> bool:
+        """Build from `(ids, embeddings, documents)` pages holding `count` rows
+        in total. `pages` is consumed even when the index is not built, so a
+        caller can load the same pages elsewhere as they stream past."""
+        os.makedirs(self.index_dir, exist_ok=True)
+        if not max_vectors or count > max_vectors:
+            for _ in pages:
+                pass
+            self._publish({"name": None, "generation": generation, "count": count, "backend": "hnsw"})
+            return False
+
+        name = f"v_{generation}"
+        version_dir = os.path.join(self.index_dir, name)
+        shutil.rmtree(version_dir, ignore_errors=True)
+        os.makedirs(version_dir)
+        vectors = None
+        ids_blob = bytearray()
+        docs_blob = bytearray()
+        id_offsets = [0]
+        doc_offsets = [0]
+        row = 0
+        for ids, embeddings, documents in pages:
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            rows = min(len(ids), count - row)
+            if rows <= 0:
+                continue
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(
+                    os.path.join(version_dir, "vectors.npy"), mode="w+", dtype=dtype, shape=(count, embeddings.shape[1])
+                )
+            norms = np.linalg.norm(embeddings[:rows], axis=1, keepdims=True)
+            vectors[row:row + rows] = embeddings[:rows] / np.where(norms == 0, 1, norms)
+            for chunk_id, document in zip(ids[:rows], documents[:rows]):
+                ids_blob += chunk_id.encode("utf-8")
+                docs_blob += (document or "").encode("utf-8")
+                id_offsets.append(len(ids_blob))
+                doc_offsets.append(len(docs_blob))
+            row += rows
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(
+                os.path.join(version_dir, "vectors.npy"), mode="w+", dtype=dtype, shape=(0, 0)
+            )
+        elif row < count:
+            # Fewer rows arrived than announced (the collection shrank while
+            # it was read); keep the rows we got
+            del vectors
+            vectors = np.load(os.path.join(version_dir, "vectors.npy"))[:row]
+            np.save(os.path.join(version_dir, "vectors.npy"), vectors)
+        if isinstance(vectors, np.memmap):
+            vectors.flush()
+        del vectors
+        np.save(os.path.join(version_dir, "id_offsets.npy"), np.asarray(id_offsets, dtype=np.int64))
+        np.save(os.path.join(version_dir, "doc_offsets.npy"), np.asarray(doc_offsets, dtype=np.int64))
+        with open(os.path.join(version_dir, "ids.bin"), "wb") as f:
+            f.write(ids_blob)
+        with open(os.path.join(version_dir, "documents.bin"), "wb") as f:
+            f.write(docs_blob)
+        self._publish({"name": name, "generation": generation, "count": row, "dtype": dtype, "backend": "exact"})
+        return True
+
+    def _publish(self, state: dict):
+        path = self._state_path()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+        self._maybe_reload()
+        # Earlier builds are unlinked; readers that still map them keep working
+        for entry in os.listdir(self.index_dir):
+            if entry.startswith("v_") and entry != state.get("name"):
+                shutil.rmtree(os.path.join(self.index_dir, entry), ignore_errors=True)
+
+
+def _collection_pages(collection, page_size: int):
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "documents"], limit=page_size, offset=offset)
+        if not len(page["ids"]):
+            return
+        yield page["ids"], page["embeddings"], page["documents"]
+        offset += len(page["ids"])
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_vector_index(collection_dir: str) -> ExactVectorIndex:
+    index_dir = os.path.abspath(os.path.join(collection_dir, INDEX_DIRNAME))
+    with _indexes_lock:
+        index = _indexes.get(index_dir)
+        if index is None:
+            index = _indexes[index_dir] = ExactVectorIndex(index_dir)
+        return index
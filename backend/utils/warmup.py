@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from typing import Optional
+from utils.retrieval_ipc import remote_object
+
+WARMUP_ENABLED = os.environ.get("RAG_WARMUP", "1") != "0"
+
+
+class Warmup:
+    """Loads the query path's heavy state in the background after startup.
+
+    Steps run in order on one daemon thread: the SQLite stores (and their
+    one-time migrations), the embedding model (with a first encode, so lazy
+    kernels are initialized), the query embedding service, and every
+    collection's Chroma client, vector index (exact or HNSW) and BM25 index. A
+    failed step is recorded and skipped; that resource is then loaded lazily by
+    the first request that needs it, as before.
+    """
+
+    def __init__(self, collections_dir: str):
+        self.collections_dir = collections_dir
+        self.status = "pending"
+        self.steps = {}
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.status = "warming"
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def _step(self, name: str, fn):
+        started = time.perf_counter()
+        with self._lock:
+            self.steps[name] = {"status": "running", "seconds": None, "error": None}
+        try:
+            fn()
+            status, error = "done", None
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {e}")
+            status, error = "failed", str(e)
+        with self._lock:
+            self.steps[name] = {"status": status, "seconds": round(time.perf_counter() - started, 3), "error": error}
+
+    def _run(self):
+        from utils.cache import get_embedding_model
+        from utils.catalog import get_catalog
+        from utils.embedding_service import embed_query
+        from utils.message_store import get_message_store
+
+        self._step("sqlite_stores", lambda: (get_catalog(), get_message_store()))
+        self._step("embedding_model", lambda: get_embedding_model().encode(["warm-up"], normalize_embeddings=True))
+        self._step("query_embedding_service", lambda: embed_query("warm-up"))
+        if os.path.isdir(self.collections_dir):
+            for collection_name in sorted(os.listdir(self.collections_dir)):
+                collection_dir = os.path.join(self.collections_dir, collection_name)
+                if os.path.isdir(os.path.join(collection_dir, "chromadb")):
+                    self._step(f"collection:{collection_name}", lambda d=collection_dir, n=collection_name: _open_collection(d, n))
+        with self._lock:
+            failed = any(step["status"] == "failed" for step in self.steps.values())
+            self.status = "degraded" if failed else "ready"
+            self.finished_at = time.time()
+
+    @property
+    def ready(self) -> bool:
+        return self.status in ("ready", "degraded", "disabled")
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "status": self.status,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "steps": {name: dict(step) for name, step in self.steps.items()},
+            }
+
+
+def _open_collection(collection_dir: str, collection_name: str):
+    """Open the document and memory clients and touch both indexes so the
+    first query does not pay for loading them."""
+    from utils.cache import get_chroma_client, get_chroma_collection
+    from utils.embedding_service import embed_query
+    from utils.lexical_index import get_lexical_index, INDEX_DIRNAME
+    from utils.manifest import read_generation
+    from utils.vector_index import get_vector_index
+
+    collection = get_chroma_collection(get_chroma_client(os.path.join(collection_dir, "chromadb")), collection_name)
+    vector_index = get_vector_index(collection_dir)
+    if vector_index.usable(read_generation(collection_dir)):
+        vector_index.search(embed_query("warm-up"), 1)
+    elif collection.count() > 0:
+        collection.query(query_embeddings=[embed_query("warm-up")], n_results=1, include=["distances"])
+    if os.path.isdir(os.path.join(collection_dir, "context")):
+        get_chroma_client(os.path.join(collection_dir, "context"))
+    if os.path.isdir(os.path.join(collection_dir, INDEX_DIRNAME)):
+        get_lexical_index(collection_dir).search("warm-up", 1)
+
+
+_warmup: Optional[Warmup] = None
+_warmup_lock = threading.Lock()
+
+
+@remote_object("warmup", ("to_dict",))
+def get_warmup() -> Warmup:
+    global _warmup
+    if _warmup is None:
+        with _warmup_lock:
+            if _warmup is None:
+                from utils.rag_utils import BASE_DIR
+                _warmup = Warmup(BASE_DIR)
+                if not WARMUP_ENABLED:
+                    _warmup.status = "disabled"
+    return _warmup
+
+
+def start_warmup() -> Warmup:
+    warmup = get_warmup()
+    if warmup.status == "pending":
+        warmup.start()
+    return warmup
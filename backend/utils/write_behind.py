@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+from utils.cache import get_embedding_model
+from utils.embedding_backends import EmbeddingMismatchError
+from utils.memory_store import get_conversation_memory
+from utils.message_store import get_message_store
+from utils.metrics import span, WRITE_BEHIND_FAILURES
+from utils.retrieval_ipc import remote_procedure
+
+FLUSH_BATCH_SIZE = int(os.environ.get("RAG_WRITE_BEHIND_BATCH", 64))
+FLUSH_INTERVAL = float(os.environ.get("RAG_WRITE_BEHIND_INTERVAL", 0.25))
+WRITE_RETRIES = int(os.environ.get("RAG_WRITE_BEHIND_RETRIES", 3))
+
+
+class WriteBehindQueue:
+    """Batches chat-turn persistence off the request path.
+
+    Message appends and conversation-memory texts from every request are
+    queued, and a background thread flushes them when `batch_size` items are
+    pending or `interval` seconds after the first one arrived: messages go to
+    the message store in one transaction, and memory texts are embedded in a
+    single encode and added to Chroma with one call per conversation. `close`
+    flushes whatever is left, so a clean shutdown never loses a turn.
+
+    A failed write puts its items back at the front of the queue and retries
+    them up to `retries` times, backing off exponentially from `interval`;
+    after that they are dropped. Both are counted in
+    `rag_write_behind_failures_total`.
+    """
+
+    def __init__(self, batch_size=FLUSH_BATCH_SIZE, interval=FLUSH_INTERVAL, retries=WRITE_RETRIES):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retries = retries
+        self._messages = []
+        self._memories = []
+        self._attempts = {"messages": 0, "memories": 0}
+        self._retry_at = 0.0
+        self._first_pending = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flushed = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._worker.start()
+
+    def append_message(self, conversation_id: str, collection_name: str, role: str, content: str):
+        self._enqueue(self._messages, (conversation_id, collection_name, role, content))
+
+    def add_memory(self, collection_name: str, conversation_id: str, text: str):
+        self._enqueue(self._memories, (collection_name, conversation_id, text))
+
+    def _enqueue(self, target: list, item):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("write-behind queue is closed")
+            target.append(item)
+            if self._first_pending is None:
+                self._first_pending = time.monotonic()
+            if self._pending() >= self.batch_size:
+                self._wakeup.notify()
+
+    def _pending(self) -> int:
+        return len(self._messages) + len(self._memories)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far has been written."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._first_pending = 0.0 if self._pending() else self._first_pending
+            self._wakeup.notify()
+            while self._pending() or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._flushed.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = 30):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._worker.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if self._pending() and (self._closed or (now >= self._retry_at and (
+                        self._pending() >= self.batch_size
+                        or now - self._first_pending >= self.interval
+                    ))):
+                        break
+                    if self._closed:
+                        return
+                    timeout = None
+                    if self._first_pending is not None:
+                        timeout = max(0.0, self.interval - (now - self._first_pending), self._retry_at - now)
+                    self._wakeup.wait(timeout)
+                messages, self._messages = self._messages, []
+                memories, self._memories = self._memories, []
+                self._first_pending = None
+                self._in_flight += 1
+            failed = {}
+            try:
+                failed = self._write(messages, memories)
+            finally:
+                with self._lock:
+                    self._requeue(failed)
+                    self._in_flight -= 1
+                    self._flushed.notify_all()
+
+    def _write(self, messages: list, memories: list) -> dict:
+        """Write both batches; returns the ones that failed, by kind."""
+        failed = {}
+        if messages:
+            try:
+                with span("persist_messages"):
+                    get_message_store().append_many(messages)
+            except Exception as e:
+                print(f"Error persisting {len(messages)} message(s): {e}")
+                failed["messages"] = messages
+        if memories:
+            try:
+                with span("persist_memory"):
+                    save_memories(memories)
+            except Exception as e:
+                print(f"Error persisting {len(memories)} conversation memory entries: {e}")
+                failed["memories"] = memories
+        return failed
+
+    def _requeue(self, failed: dict):
+        """Put failed items back ahead of newer ones, so messages keep their
+        order; called with the lock held."""
+        for kind in self._attempts:
+            items = failed.get(kind)
+            if not items:
+                self._attempts[kind] = 0
+                continue
+            self._attempts[kind] += 1
+            if self._attempts[kind] > self.retries:
+                print(f"Dropping {len(items)} {kind} after {self.retries} retries")
+                WRITE_BEHIND_FAILURES.inc(len(items), kind, "dropped")
+                self._attempts[kind] = 0
+                continue
+            WRITE_BEHIND_FAILURES.inc(len(items), kind, "retried")
+            if kind == "messages":
+                self._messages = items + self._messages
+            else:
+                self._memories = items + self._memories
+            if self._first_pending is None:
+                self._first_pending = time.monotonic()
+            self._retry_at = max(self._retry_at, time.monotonic() + self.interval * 2 ** self._attempts[kind])
+
+
+@remote_procedure("save_memories")
+def save_memories(memories: list):
+    """Embed `(collection_name, conversation_id, text)` entries in one batch and
+    add them to each conversation's memory."""
+    embeddings = get_embedding_model().encode([text for _, _, text in memories], normalize_embeddings=True)
+    grouped = defaultdict(lambda: ([], []))
+    for (collection_name, conversation_id, text), embedding in zip(memories, embeddings):
+        texts, vectors = grouped[(collection_name, conversation_id)]
+        texts.append(text)
+        vectors.append(embedding)
+    memory = get_conversation_memory()
+    for (collection_name, conversation_id), (texts, vectors) in grouped.items():
+        try:
+            memory.add_turns(collection_name, conversation_id, texts, vectors)
+        except EmbeddingMismatchError as e:
+            # Retrying cannot help until the context store is rebuilt
+            print(f"Not saving memory of {conversation_id} in {collection_name}: {e}")
+
+
+_queue: Optional[WriteBehindQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_write_behind_queue() -> WriteBehindQueue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = WriteBehindQueue()
+    return _queue
+
+
+def shutdown_write_behind_queue():
+    global _queue
+    with _queue_lock:
+        queue, _queue = _queue, None
+    if queue is not None:
+        queue.close()
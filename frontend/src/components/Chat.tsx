@@ -48,55 +48,101 @@ function Chat() {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
 
-            const reader = response.body?.getReader();
-            if (!reader) {
+            const initialReader = response.body?.getReader();
+            if (!initialReader) {
                 throw new Error("No reader available");
             }
+            let reader = initialReader;
 
-            const decoder = new TextDecoder();
+            // The server keeps each answer's frames for a while, so a dropped
+            // connection can reattach and continue after the last frame seen
+            const streamId = response.headers.get("X-Stream-Id");
+            let lastEventId: string | null = null;
+            let resumeAttempts = 0;
+            let decoder = new TextDecoder();
+            let buffer = "";
             let accumulatedResponse = "";
-            let isComplete = false;
+
+            const resume = async () => {
+                if (!streamId || resumeAttempts >= 3) {
+                    return false;
+                }
+                resumeAttempts += 1;
+                try {
+                    const resumed = await fetch(`http://localhost:3000/conversation/resume_stream/${streamId}`, {
+                        headers: lastEventId !== null ? { "Last-Event-ID": lastEventId } : {}
+                    });
+                    if (!resumed.ok || !resumed.body) {
+                        return false;
+                    }
+                    reader = resumed.body.getReader();
+                    decoder = new TextDecoder();
+                    buffer = "";
+                    return true;
+                } catch {
+                    return false;
+                }
+            };
 
             while (true) {
-                const { done, value } = await reader.read();
-            
+                let result: ReadableStreamReadResult<Uint8Array>;
+                try {
+                    result = await reader.read();
+                } catch (readError) {
+                    if (await resume()) {
+                        continue;
+                    }
+                    throw readError;
+                }
+                const { done, value } = result;
+
                 if (done) {
-                    if (!isComplete && accumulatedResponse) {
+                    // Ended without a complete event: the connection dropped
+                    if (await resume()) {
+                        continue;
+                    }
+                    if (accumulatedResponse) {
                         dispatch(updateLastModelMessage({ model: accumulatedResponse }));
                     }
                     dispatch(setIsStreaming(false));
                     break;
                 }
 
-                const chunk = decoder.decode(value, { stream: true });
-                const lines = chunk.split('\n');
-
-                for (const line of lines) {
-                    if (line.startsWith('data: ') && line.length > 6) {
-                        try {
-                            const jsonData = JSON.parse(line.slice(6));
-                        
-                            if (jsonData.status === 'streaming' && jsonData.chunk) {
-                                accumulatedResponse += jsonData.chunk;
-                                dispatch(updateLastModelMessage({ model: accumulatedResponse }));
-                            } else if (jsonData.status === 'complete') {
-                                isComplete = true;
-                                if (jsonData.full_response) {
-                                    dispatch(updateLastModelMessage({ model: jsonData.full_response }));
-                                } else {
-                                    dispatch(updateLastModelMessage({ model: accumulatedResponse }));
-                                }
-                                dispatch(setIsStreaming(false));
-                                return;
-                            } else if (jsonData.status === 'error') {
-                                dispatch(updateLastModelMessage({ model: `Error: ${jsonData.error}` }));
-                                dispatch(showError("Failed to get a response from the model. Please try again."));
-                                dispatch(setIsStreaming(false));
-                                return;
-                            }
-                        } catch (parseError) {
-                            console.warn("Failed to parse streaming data:", line);
+                // Frames can be split across reads; keep the unfinished tail
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop() ?? "";
+
+                for (const event of events) {
+                    let data = "";
+                    for (const line of event.split('\n')) {
+                        if (line.startsWith('id: ')) {
+                            lastEventId = line.slice(4);
+                        } else if (line.startsWith('data: ')) {
+                            data += line.slice(6);
+                        }
+                    }
+                    if (!data) {
+                        continue;
+                    }
+                    try {
+                        const jsonData = JSON.parse(data);
+
+                        if (jsonData.status === 'streaming' && jsonData.chunk) {
+                            accumulatedResponse += jsonData.chunk;
+                            dispatch(updateLastModelMessage({ model: accumulatedResponse }));
+                        } else if (jsonData.status === 'complete') {
+                            dispatch(updateLastModelMessage({ model: accumulatedResponse }));
+                            dispatch(setIsStreaming(false));
+                            return;
+                        } else if (jsonData.status === 'error') {
+                            dispatch(updateLastModelMessage({ model: `Error: ${jsonData.error}` }));
+                            dispatch(showError("Failed to get a response from the model. Please try again."));
+                            dispatch(setIsStreaming(false));
+                            return;
                         }
+                    } catch (parseError) {
+                        console.warn("Failed to parse streaming data:", data);
                     }
                 }
             }
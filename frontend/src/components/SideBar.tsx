@@ -1,4 +1,4 @@
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { useNavigate, useParams } from "react-router-dom"; // Import useParams
 import { useDispatch, useSelector } from "react-redux";
 import { setConversationId, setModelName, setSelectedCollection } from "../features/footerSlice";
@@ -14,11 +14,26 @@ interface Conversation {
     conversation_id: string;
 }
 
+const HISTORY_SEARCH_DEBOUNCE_MS = 300;
+
+// The catalog searches every conversation server-side, by summary prefix
+const historyUrl = (search: string, cursor?: string | null) => {
+    const params = new URLSearchParams();
+    if (search) params.set("q", search);
+    if (cursor) params.set("cursor", cursor);
+    const query = params.toString();
+    return `http://localhost:3000/conversation/get_history${query ? `?${query}` : ""}`;
+};
+
 function SideBar() {
     const [conversations, setConversations] = useState<Conversation[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
     const [isOpen, setIsOpen] = useState(true);
     const [loading, setLoading] = useState(false);
     const [historySearch, setHistorySearch] = useState("");
+    const [debouncedSearch, setDebouncedSearch] = useState("");
+    // Only the latest history request may update the list
+    const historyRequest = useRef(0);
     const navigate = useNavigate();
     const dispatch = useDispatch();
     const { id: activeConversationId } = useParams<{ id: string }>();
@@ -29,23 +44,48 @@ function SideBar() {
     const lastMessage = chatMessages.length > 0 ? chatMessages[chatMessages.length - 1] : null;
 
     const fetchHistory = async () => {
+        const request = ++historyRequest.current;
         setLoading(true);
         try {
-            const res = await fetch("http://localhost:3000/conversation/get_history");
+            const res = await fetch(historyUrl(debouncedSearch));
             if (!res.ok) throw new Error("Failed to fetch history");
             const data = await res.json();
-            setConversations(data);
+            if (request !== historyRequest.current) return;
+            setConversations(data.conversations);
+            setNextCursor(data.next_cursor);
         } catch (err) {
             console.error("Error fetching history:", err);
             dispatch(showError("Failed to fetch conversation history. Please try again."));
         } finally {
-            setLoading(false);
+            if (request === historyRequest.current) setLoading(false);
         }
     };
 
+    const fetchMoreHistory = async () => {
+        if (!nextCursor) return;
+        const request = historyRequest.current;
+        try {
+            const res = await fetch(historyUrl(debouncedSearch, nextCursor));
+            if (!res.ok) throw new Error("Failed to fetch history");
+            const data = await res.json();
+            if (request !== historyRequest.current) return;
+            setConversations(prev => [...prev, ...data.conversations]);
+            setNextCursor(data.next_cursor);
+        } catch (err) {
+            console.error("Error fetching history:", err);
+            dispatch(showError("Failed to fetch conversation history. Please try again."));
+        }
+    };
+
+    useEffect(() => {
+        const timer = setTimeout(() => setDebouncedSearch(historySearch.trim()), HISTORY_SEARCH_DEBOUNCE_MS);
+        return () => clearTimeout(timer);
+    }, [historySearch]);
+
+    // Also runs on mount
     useEffect(() => {
         fetchHistory();
-    }, []);
+    }, [debouncedSearch]);
 
     useEffect(() => {
         if (activeConversationId) {
@@ -175,13 +215,7 @@ function SideBar() {
                                 <Skeleton variant="rectangular" height={32} sx={{ bgcolor: "#1A1A1D" }}/>
                             </div>
                         ) : conversations.length > 0 ? (
-                            conversations
-                                .filter((c) =>
-                                    c.conversation_summary
-                                        ?.toLowerCase()
-                                        .includes(historySearch.toLowerCase())
-                                )
-                                .map((conv) => (
+                            conversations.map((conv) => (
                                 <div
                                     key={conv.conversation_id}
                                     className={`group flex items-center justify-between rounded-md transition-colors mb-2 bg-[#1A1A1D] ${activeConversationId === conv.conversation_id ? 'bg-white text-black' : 'hover:bg-white hover:text-black'}`}
@@ -217,7 +251,15 @@ function SideBar() {
                                 </div>
                             ))
                         ) : (
-                            <div className="p-4 text-sm text-gray-400">No history yet</div>
+                            <div className="p-4 text-sm text-gray-400">{debouncedSearch ? "No matching conversations" : "No history yet"}</div>
+                        )}
+                        {!loading && nextCursor && (
+                            <button
+                                onClick={fetchMoreHistory}
+                                className="w-full px-3 py-2 text-sm text-gray-400 hover:text-white cursor-pointer"
+                            >
+                                Load more
+                            </button>
                         )}
                     </div>
                 )}
@@ -60,6 +60,25 @@ function UploadModal({
         }
     };
 
+    const waitForJob = async (jobId: string) => {
+        while (true) {
+            const res = await fetch(`http://localhost:3000/api/jobs/${jobId}`);
+            if (!res.ok) throw new Error("Failed to fetch ingestion status");
+            const job = await res.json();
+            const fileStates = Object.values(job.files ?? {}) as { status: string }[];
+            const finished = fileStates.filter((f) => f.status !== "pending").length;
+            if (job.status === "completed" || job.status === "failed" || job.status === "cancelled") {
+                return job;
+            }
+            setUploadProgress(
+                job.status === "queued"
+                    ? "Waiting for ingestion to start..."
+                    : `Processing ${finished}/${fileStates.length} files (${job.chunks_added} chunks)...`
+            );
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+        }
+    };
+
     const resetForm = () => {
         setFiles([]);
         setUrls([]);
@@ -103,6 +122,10 @@ function UploadModal({
             }
 
             const data = await response.json();
+            const job = await waitForJob(data.job_id);
+            if (job.status !== "completed") {
+                throw new Error(job.error || `Ingestion ${job.status}`);
+            }
             let successMessage = `Collection '${data.collection}' created successfully!`;            
             if (data.files && data.files.length > 0) {
                 successMessage += `\n📄 Files processed: ${data.files.length}`;